@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmark suite for the pipeline stages, on synthetic events with the real schema (see synthetic.py).
+#
+#   python benchmark.py --sizes 250000 2500000 25000000 --output benchmark.json
+#   python benchmark.py --sizes 250000 --baseline benchmark.json          # exit status 1 on regressions
+#
+# Every size runs in a fresh process. Each stage is recorded by the instrumentation layer (instrument.py):
+# wall time, CPU time, rows per second, and peak resident memory during the stage (the kernel's high-water
+# mark is reset before each stage on Linux). Setup work between stages (generating the events, fitting what
+# a stage needs) is not timed.
+#
+#   csv_ingest   CSV parse into the column cache (sizes up to --csv-rows)
+#   load         cached columns read into memory
+#   mask         -999 mask                          impute       column means and mean imputation
+#   iqr_filter   IQR bounds and row mask            scale        fused imputation and scaling
+#   eda_stats    skew/kurt/-999/unique tables       df_corr      the four correlation matrices
+#   train_epoch  Keras epochs on up to --train-rows preprocessed rows
+#   inference    batch scoring of all events (NumPy engine)
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+SIZES = [250_000, 2_500_000, 25_000_000]
+STAGES = ['csv_ingest', 'load', 'mask', 'impute', 'iqr_filter', 'scale', 'eda_stats', 'df_corr', 'train_epoch', 'inference']
+TRAIN_FRACTION = 0.65
+
+
+# Events per second of the fastest of `repeat` passes of predict over x, in batches of batch_size (None:
+# all of x in one call)
+def throughput(predict, x, batch_size = None, repeat = 3):
+    batch_size = batch_size or max(len(x), 1)
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in range(0, len(x), batch_size):
+            predict(x[i:i + batch_size])
+        best = min(best, time.perf_counter() - start)
+    return len(x) / max(best, 1e-9)
+
+
+# All stages on n synthetic events; runs in its own process
+def run_size(n, data_dir, seed = 0, csv_rows = 2_500_000, train_rows = 250_000, epochs = 1, batch_size = 32, skip = ()):
+    import instrument
+    from eda_stats import accumulate, corr_matrices, eda_tables
+    from ingest import FEATURES, FLOAT_FEATURES, build_cache, open_cache
+    from numpy_model import NumpyModel
+    from preprocessing import Preprocessor, impute_mean, iqr_filter, missing_mask
+    from score import score_events
+    from synthetic import write_synthetic_cache, write_synthetic_csv
+
+    os.makedirs(data_dir, exist_ok = True)
+    cache = write_synthetic_cache(os.path.join(data_dir, 'synthetic_{}_{}.cache'.format(n, seed)), n, seed)
+    instrument.enable()
+    instrument.clear()
+    stage = instrument.stage
+
+    if n <= csv_rows and 'csv_ingest' not in skip:
+        csv = os.path.join(data_dir, 'synthetic_{}_{}.csv'.format(n, seed))
+        if not os.path.exists(csv):
+            write_synthetic_csv(csv + '.tmp', n, seed)
+            os.replace(csv + '.tmp', csv)
+        scratch = os.path.join(data_dir, 'csv_ingest.cache')
+        with stage('csv_ingest', n):
+            build_cache(csv, scratch)
+        shutil.rmtree(scratch)
+
+    events = open_cache(cache)
+    with stage('load', n):
+        x = np.array(events.features)
+        label = np.array(events.label)
+    with stage('mask', n):
+        missing = missing_mask(x)
+    with stage('impute', n):
+        mean, imputed = impute_mean(x, missing)
+    with stage('iqr_filter', n) as s:
+        lower, upper, keep, _ = iqr_filter(imputed)
+        s.rows_out = int(keep.sum())
+
+    prep = Preprocessor()
+    prep.mean_, prep.lower_, prep.upper_ = mean, lower, upper
+    kept = imputed[keep]
+    prep.center_, prep.scale_ = kept.mean(axis = 0).astype(np.float32), np.maximum(kept.std(axis = 0), 1e-6).astype(np.float32)
+    del missing, imputed, kept
+    with stage('scale', n):
+        xs = prep.transform(x)
+
+    n_train = int(n * TRAIN_FRACTION)
+    if 'eda_stats' not in skip:
+        with stage('eda_stats', n):
+            eda_tables(accumulate(x[:n_train], label[:n_train], n_classes = 2), accumulate(x[n_train:]))
+    if 'df_corr' not in skip:
+        cols = [FEATURES.index(c) for c in FLOAT_FEATURES]
+        with stage('df_corr', n):
+            corr_matrices(x[:n_train, cols], label[:n_train], x[n_train:, cols])
+
+    if 'train_epoch' not in skip:
+        import keras
+        from model import build_model
+        keras.utils.set_random_seed(seed)
+        model = build_model(input_dim = len(FEATURES))
+        m = min(n, train_rows)
+        with stage('train_epoch', m * epochs, epochs = epochs, batch_size = batch_size):
+            model.fit(xs[:m], label[:m], epochs = epochs, batch_size = batch_size, verbose = 0)
+    del x, xs
+
+    if 'inference' not in skip:
+        rng = np.random.default_rng(seed)
+        shapes = [(len(FEATURES), 12), (12, 8), (8, 1)]
+        engine = NumpyModel([rng.normal(0, 0.3, s) for s in shapes], [np.zeros(s[1]) for s in shapes], ['relu', 'relu', 'sigmoid'])
+        with stage('inference', n):
+            score_events(events.features, engine.predict, prep)
+
+    # top-level stages only; the pipeline's own hooks nest below them
+    results = {}
+    for r in instrument.records():
+        if r['depth'] == 0:
+            metrics = {k: v for k, v in r.items() if k not in ('name', 'depth', 'thread', 'start_s', 'rows_in')}
+            results[r['name']] = dict(metrics, rows = r['rows_in'], rows_per_s = r['rows_in'] / max(r['wall_s'], 1e-9))
+    return results
+
+
+# (size, stage, metric, baseline, current) for every metric more than `tolerance` above the baseline;
+# stages faster than min_seconds in the baseline are too noisy to compare on time
+def compare(results, baseline, tolerance = 0.25, min_seconds = 0.05):
+    regressions = []
+    for size, stages in results.items():
+        for stage, cur in stages.items():
+            base = baseline.get(size, {}).get(stage)
+            if base is None:
+                continue
+            if base['wall_s'] >= min_seconds and cur['wall_s'] > base['wall_s'] * (1 + tolerance):
+                regressions.append((size, stage, 'wall_s', base['wall_s'], cur['wall_s']))
+            if cur['peak_rss_bytes'] > base['peak_rss_bytes'] * (1 + tolerance):
+                regressions.append((size, stage, 'peak_rss_bytes', base['peak_rss_bytes'], cur['peak_rss_bytes']))
+    return regressions
+
+
+def environment():
+    import sklearn
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'sklearn': sklearn.__version__, 'platform': platform.platform(), 'cpu_count': os.cpu_count()}
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Benchmark the pipeline stages on synthetic events")
+    parser.add_argument('--sizes', type = int, nargs = '+', default = SIZES)
+    parser.add_argument('--output', default = 'benchmark.json')
+    parser.add_argument('--baseline', default = None, help = "Earlier --output to compare against")
+    parser.add_argument('--tolerance', type = float, default = 0.25, help = "Allowed slowdown/memory growth (0.25 = 25%%)")
+    parser.add_argument('--data-dir', default = 'benchmark_data', help = "Synthetic events, kept between runs")
+    parser.add_argument('--csv-rows', type = int, default = 2_500_000, help = "Largest size that also times the CSV ingest")
+    parser.add_argument('--train-rows', type = int, default = 250_000)
+    parser.add_argument('--epochs', type = int, default = 1)
+    parser.add_argument('--batch-size', type = int, default = 32)
+    parser.add_argument('--skip', nargs = '+', default = [], choices = STAGES)
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args(argv)
+
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for n in args.sizes:
+        with context.Pool(1) as pool:
+            results[str(n)] = pool.apply(run_size, (n, args.data_dir, args.seed, args.csv_rows, args.train_rows, args.epochs,
+                                                    args.batch_size, args.skip))
+        print("{:,} events done".format(n), flush = True)
+
+    table = pd.DataFrame([dict(size = int(n), stage = s, **r) for n, stages in results.items() for s, r in stages.items()])
+    table['peak_rss_mb'] = table['peak_rss_bytes'] / (1024 * 1024)
+    print(table[['size', 'stage', 'rows', 'wall_s', 'cpu_s', 'rows_per_s', 'peak_rss_mb']].to_string(index = False))
+
+    params = {k: getattr(args, k) for k in ['csv_rows', 'train_rows', 'epochs', 'batch_size', 'seed']}
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(), 'params': params, 'results': results}, f, indent = 2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('params') != params:
+            print("Note: baseline parameters differ: {}".format(baseline.get('params')))
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for size, stage, metric, base, cur in regressions:
+            print("REGRESSION {} events, {}: {} {:.4g} -> {:.4g} ({:+.0%})".format(size, stage, metric, base, cur, cur / base - 1))
+        if regressions:
+            sys.exit(1)
+        print("No regressions against {}".format(args.baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Periodic training checkpoints, so an interrupted fit resumes where it stopped instead of at epoch 0.
+#
+#   python train.py training.csv --checkpoint-dir checkpoints --checkpoint-minutes 10 --keep-checkpoints 3
+#   python checkpoint.py checkpoints                  # snapshots, latest first
+#   python score.py test.csv --model checkpoints/step-000001200/model.npz
+#
+# train.fit writes a snapshot every --checkpoint-steps batches or --checkpoint-minutes (whichever comes
+# first), at the end of every epoch, and once more when training ends (with the restored best weights). A
+# snapshot is a directory step-<global step> that holds:
+#   state.npz          Keras weights, optimizer variables (Adam moments, iteration count) and the best
+#                      weights seen by early stopping
+#   state.json         epoch and batch reached, shuffle seed, run configuration, per-epoch history and
+#                      early-stopping counters
+#   model.npz          NumPy export of the weights (see numpy_model.py)
+#   preprocessing.npz  the fitted preprocessing, so the snapshot can be scored on its own
+# Each snapshot is written to a temporary directory and renamed into place, so a kill during a write leaves
+# the earlier snapshots intact. Only the last --keep-checkpoints are kept.
+#
+# On start, fit restores the latest snapshot and continues from the batch it reached. Every epoch's row
+# order is derived from the seed and the epoch number (see train.make_training_dataset), so the resumed run
+# sees the same batches as an uninterrupted one. A snapshot from a different configuration (batch size,
+# rows, learning rate, ...) or of other data is refused. The configuration includes a digest of the
+# preprocessed training and validation arrays, so a changed input file, split or preprocessing counts as
+# other data. Use another directory or train.py --restart.
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+PREFIX = 'step-'
+KEEP = 3
+DIGEST_ROWS = 1 << 16
+
+
+# sha256 of the content (dtype, shape and values) of arrays, read in blocks of rows (memory maps included)
+def data_digest(*arrays):
+    from instrument import stage
+
+    h = hashlib.sha256()
+    with stage('data_digest', rows_in = sum(len(a) for a in arrays)):
+        for a in map(np.asarray, arrays):
+            h.update('{}{}'.format(np.dtype(a.dtype).str, a.shape).encode())
+            for i in range(0, len(a), DIGEST_ROWS):
+                h.update(np.ascontiguousarray(a[i:i + DIGEST_ROWS]).data)
+    return h.hexdigest()
+
+
+def _arrays(f, name):
+    return [f['{}{}'.format(name, i)] for i in range(sum(k.startswith(name) for k in f.files))]
+
+
+class Checkpoints:
+    def __init__(self, directory, keep = KEEP):
+        self.directory = directory
+        self.keep = keep
+        os.makedirs(directory, exist_ok = True)
+        # leftovers of writes that were interrupted
+        for name in os.listdir(directory):
+            if name.startswith('.tmp-'):
+                shutil.rmtree(os.path.join(directory, name), ignore_errors = True)
+
+    def path(self, step):
+        return os.path.join(self.directory, '{}{:09d}'.format(PREFIX, step))
+
+    # (step, path) of every complete snapshot, oldest first
+    def snapshots(self):
+        out = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(PREFIX) and os.path.isfile(os.path.join(path, 'state.json')):
+                out.append((int(name[len(PREFIX):]), path))
+        return sorted(out)
+
+    def latest(self):
+        snapshots = self.snapshots()
+        return snapshots[-1][1] if snapshots else None
+
+    # Write a snapshot of `model` (weights and optimizer state) with `state` (JSON-serializable), the best
+    # weights of early stopping and the fitted preprocessing; then drop all but the last `keep` snapshots
+    def save(self, model, state, best_weights = None, preprocessor = None):
+        from numpy_model import NumpyModel
+
+        final = self.path(state['step'])
+        tmp = os.path.join(self.directory, '.tmp-{}-{}'.format(os.path.basename(final), os.getpid()))
+        shutil.rmtree(tmp, ignore_errors = True)
+        os.makedirs(tmp)
+        arrays = {}
+        for name, values in [('weight', model.get_weights()), ('optimizer', [v.numpy() for v in model.optimizer.variables]),
+                             ('best', best_weights or [])]:
+            for i, value in enumerate(values):
+                arrays['{}{}'.format(name, i)] = value
+        np.savez(os.path.join(tmp, 'state.npz'), **arrays)
+        NumpyModel.from_keras(model).save(os.path.join(tmp, 'model.npz'))
+        if preprocessor is not None:
+            preprocessor.save(os.path.join(tmp, 'preprocessing.npz'))
+        with open(os.path.join(tmp, 'state.json'), 'w') as f:
+            json.dump(dict(state, saved = time.time()), f, indent = 1)
+
+        # a snapshot of the same step (the epoch-end one, replaced by the final one) is swapped out
+        old = None
+        if os.path.exists(final):
+            old = tmp + '.old'
+            os.rename(final, old)
+        os.rename(tmp, final)
+        if old is not None:
+            shutil.rmtree(old, ignore_errors = True)
+        self.evict()
+        return final
+
+    # Restore the weights and optimizer state of the latest snapshot into a compiled `model`; returns its
+    # state and the best weights of early stopping (None, None when there is no snapshot). A snapshot whose
+    # run configuration differs from `config` is refused before anything is restored.
+    def restore(self, model, config = None):
+        path = self.latest()
+        if path is None:
+            return None, None
+        with open(os.path.join(path, 'state.json')) as f:
+            state = json.load(f)
+        if config is not None:
+            config = json.loads(json.dumps(config))
+            changed = sorted(k for k in set(config) | set(state['config']) if config.get(k) != state['config'].get(k))
+            if changed:
+                raise ValueError("Checkpoint {} is from another run (different {}); use another checkpoint directory or start "
+                                 "over".format(path, ', '.join(changed)))
+        with np.load(os.path.join(path, 'state.npz')) as f:
+            weights, optimizer, best = _arrays(f, 'weight'), _arrays(f, 'optimizer'), _arrays(f, 'best')
+        model.set_weights(weights)
+        if not model.optimizer.built:
+            model.optimizer.build(model.trainable_variables)
+        if len(model.optimizer.variables) != len(optimizer):
+            raise ValueError("Checkpoint {} holds {} optimizer variables, the model's optimizer has {}".format(
+                path, len(optimizer), len(model.optimizer.variables)))
+        for variable, value in zip(model.optimizer.variables, optimizer):
+            variable.assign(value)
+        return state, best or None
+
+    def evict(self):
+        snapshots = self.snapshots()
+        for _, path in snapshots[:max(0, len(snapshots) - self.keep)]:
+            shutil.rmtree(path, ignore_errors = True)
+
+    def clear(self):
+        for _, path in self.snapshots():
+            shutil.rmtree(path, ignore_errors = True)
+
+
+# Keras callback writing snapshots every `every_steps` batches or `every_minutes`, and at every epoch end.
+# `state` carries the run over from a restored snapshot; `early` is the EarlyStopping callback (listed
+# before this one) whose counters and best weights go into the snapshots.
+def checkpoint_callback(checkpoints, state, every_steps = None, every_minutes = None, early = None, preprocessor = None):
+    import keras
+
+    class Checkpoint(keras.callbacks.Callback):
+        def __init__(self):
+            super().__init__()
+            self.state = state
+            self.skip = state['batch']
+            self.last = time.monotonic()
+
+        def snapshot(self):
+            if early is not None:
+                self.state['early_stopping'] = {'wait': early.wait, 'best': None if early.best is None else float(early.best),
+                                                'best_epoch': early.best_epoch, 'stopped_epoch': early.stopped_epoch}
+            checkpoints.save(self.model, self.state, early.best_weights if early is not None else None, preprocessor)
+            self.last = time.monotonic()
+
+        def on_epoch_begin(self, epoch, logs = None):
+            self.state['epoch'] = epoch
+
+        def on_train_batch_end(self, batch, logs = None):
+            self.state['step'] += 1
+            self.state['batch'] = self.skip + batch + 1
+            if (every_steps and self.state['step'] % every_steps == 0) or \
+                    (every_minutes and time.monotonic() - self.last >= 60 * every_minutes):
+                self.snapshot()
+
+        def on_epoch_end(self, epoch, logs = None):
+            self.skip = 0
+            self.state['epoch'], self.state['batch'] = epoch + 1, 0
+            for k, v in (logs or {}).items():
+                self.state['history'].setdefault(k, []).append(float(v))
+            self.snapshot()
+
+    return Checkpoint()
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "List the training checkpoints")
+    parser.add_argument('directory', nargs = '?', default = 'checkpoints')
+    args = parser.parse_args(argv)
+
+    import pandas as pd
+
+    rows = []
+    for step, path in reversed(Checkpoints(args.directory).snapshots()):
+        with open(os.path.join(path, 'state.json')) as f:
+            state = json.load(f)
+        val_loss = state['history'].get('val_loss', [])
+        rows.append({'snapshot': os.path.basename(path), 'epoch': state['epoch'], 'batch': state['batch'],
+                     'val_loss': val_loss[-1] if val_loss else np.nan, 'done': state['done'],
+                     'saved': pd.to_datetime(state['saved'], unit = 's').strftime('%Y-%m-%d %H:%M:%S')})
+    if rows:
+        print(pd.DataFrame(rows).to_string(index = False))
+    print("{} snapshots in {}".format(len(rows), os.path.abspath(args.directory)))
+
+
+if __name__ == '__main__':
+    main()
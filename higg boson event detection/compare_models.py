@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmark of the classifier backends on the same split: the dense network (model.py, on the fitted
+# preprocessing) and the gradient-boosted trees (gbt.py, on raw features with NaN for -999).
+#
+#   python compare_models.py training.csv --epochs 20 --threads 8 --json compare.json
+#
+# For each backend: training time, inference throughput on the holdout events (the network through the
+# NumPy engine, see numpy_model.py), precision at the 0.5 threshold and the best AMS of the threshold scan.
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmark import throughput
+from ingest import load_events
+from metrics import best_threshold, holdout_weights, precision
+from split import strata, stratified_split
+
+
+def bench_nn(x_train, y_train, w_train, epochs = 20, batch_size = 32, hidden = (12, 8), seed = 20):
+    import keras
+    from model import build_model
+    from numpy_model import NumpyModel
+    from preprocessing import Preprocessor
+
+    start = time.time()
+    keras.utils.set_random_seed(seed)
+    preprocessor = Preprocessor().fit(x_train)
+    keep = preprocessor.inlier_mask(x_train)
+    model = build_model(input_dim = x_train.shape[1], hidden = hidden)
+    model.fit(preprocessor.transform(x_train[keep]), y_train[keep], sample_weight = None if w_train is None else w_train[keep],
+              epochs = epochs, batch_size = batch_size, verbose = 0)
+    train_time = time.time() - start
+    engine = NumpyModel.from_keras(model)
+
+    def predict(x):
+        return engine.predict(preprocessor.transform(x))
+    return train_time, predict
+
+
+def bench_gbt(x_train, y_train, w_train, threads = 0, seed = 20, **params):
+    from gbt import fit_gbt, predict_gbt
+
+    start = time.time()
+    model = fit_gbt(x_train, y_train, w_train, threads, random_state = seed, **params)
+    train_time = time.time() - start
+
+    def predict(x):
+        return predict_gbt(model, x)
+    return train_time, predict
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Compare the dense network and the gradient-boosted trees")
+    parser.add_argument('csv', help = "Training events (Kaggle training.csv layout)")
+    parser.add_argument('--epochs', type = int, default = 20)
+    parser.add_argument('--batch-size', type = int, default = 32)
+    parser.add_argument('--threads', type = int, default = 0, help = "Threads for both backends (0 = all cores)")
+    parser.add_argument('--no-weights', dest = 'weighted', action = 'store_false', help = "Ignore the event weights")
+    parser.add_argument('--test-size', type = float, default = 0.35)
+    parser.add_argument('--random-state', type = int, default = 20)
+    parser.add_argument('--json', default = None, help = "Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    from preprocessing import training_weights
+    from score import set_threads, thread_limits
+
+    set_threads(args.threads)
+
+    events = load_events(args.csv)
+    train, test = stratified_split(strata(events.label, events.jet_num), args.test_size, args.random_state)
+    x_train, y_train = np.asarray(events.features[train]), events.label[train]
+    w_train = training_weights(events.weight[train], y_train) if args.weighted else None
+    x_test, y_test = np.asarray(events.features[test]), events.label[test] == 1
+    w_test = holdout_weights(events.weight[test], y_test, events.weight, events.label)
+
+    results = {}
+    for name, bench in [('Dense network', lambda: bench_nn(x_train, y_train, w_train, args.epochs, args.batch_size,
+                                                           seed = args.random_state)),
+                        ('Gradient-boosted trees', lambda: bench_gbt(x_train, y_train, w_train, args.threads,
+                                                                     seed = args.random_state))]:
+        # the BLAS/OpenMP pools are already loaded by now, so they are capped at run time rather than through
+        # OMP_NUM_THREADS and friends
+        with thread_limits(args.threads):
+            train_time, predict = bench()
+            probs = predict(x_test)
+            events_per_s = throughput(predict, x_test, batch_size = 65536)
+        best = best_threshold(y_test, probs, w_test)
+        results[name] = {'train_time_s': train_time, 'events_per_s': events_per_s,
+                         'precision': precision(y_test, probs >= 0.5), 'best_ams': float(best['ams']),
+                         'best_threshold': float(best['threshold'])}
+
+    print(pd.DataFrame(results).T.to_string())
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'source': os.path.abspath(args.csv), 'events': len(events), 'results': results}, f, indent = 2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# K-fold cross-validation of the dense classifier; the fold models are kept as an averaged ensemble.
+#
+#   python cv.py training.csv --folds 5 --out cv_model --epochs 20
+#   python score.py test.csv --model cv_model                       # mean probability of the fold models
+#   python serve.py --model cv_model --port 8000                    # online, same probabilities
+#
+# The events are dealt into k folds stratified by Label and PRI_jet_num (see split.py). Every fold trains in
+# its own worker process. The workers memory-map the event cache (see ingest.py), so they share one copy of
+# the feature matrix through the page cache. Each worker refits the preprocessing on its k-1 training folds,
+# trains the network with the event weights (renormalized per class) and scores its held-out fold. The
+# training rows are gathered from the memory map and preprocessed batch by batch (see
+# train.make_training_dataset), so no worker holds a copy of its folds while it trains; --iqr-mode sketch
+# also fits the preprocessing in chunks. All folds run at once with cores // k threads each, so the run
+# takes about the time of a single fit.
+#
+# Reported per fold: precision and AMS at the 0.5 threshold, the best AMS of the threshold scan, and the
+# training time. The out-of-fold probabilities of all events give one overall precision and AMS. Each
+# fold's NumPy weights (see numpy_model.py) and its preprocessing are saved to --out, and cv.json is
+# written last. The ensemble takes raw features (each member applies its own fold preprocessing), so
+# score.py and serve.py skip the global preprocessing.npz for it.
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from ingest import cache_dir_for, load_events, open_cache
+from instrument import stage
+from metrics import ams_score, best_threshold, holdout_weights, precision
+from numpy_model import NumpyModel
+from preprocessing import Preprocessor, training_weights
+from split import strata, stratified_folds
+from streaming import iter_chunk_rows
+
+_worker = {}
+
+
+# Fold models averaged: each one applies the preprocessing fitted on its own training folds
+class CVEnsemble:
+    def __init__(self, members):
+        self.members = list(members)  # (Preprocessor, NumpyModel) per fold
+
+    # Mean signal probability of the fold models for a raw float32 batch (NaN for missing values)
+    def predict(self, features):
+        x = np.asarray(features, dtype = np.float32)
+        probs = np.zeros(len(x), dtype = np.float32)
+        buf = np.empty(x.shape, dtype = np.float32)
+        for prep, model in self.members:
+            probs += model.predict(prep.transform(x, out = buf))
+        probs /= len(self.members)
+        return probs
+
+    __call__ = predict
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, 'cv.json')) as f:
+            meta = json.load(f)
+        return cls((Preprocessor.load(os.path.join(path, 'preprocessing_fold{}.npz'.format(k))),
+                    NumpyModel.load(os.path.join(path, 'model_fold{}.npz'.format(k)))) for k in range(meta['folds']))
+
+
+def is_cv_ensemble(path):
+    return os.path.isfile(os.path.join(path, 'cv.json'))
+
+
+# Pool initializer: pin the thread counts before TensorFlow starts, then memory-map the events and folds
+def init_worker(cache_dir, folds_path, threads):
+    for var in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']:
+        os.environ[var] = str(threads)
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+    from score import set_threads
+    set_threads(threads)
+    _worker['events'] = open_cache(cache_dir)
+    _worker['folds'] = np.load(folds_path, mmap_mode = 'r')
+
+
+# Fit the preprocessing and the network on every fold but `fold`, save them to `out` and score `fold`;
+# returns one row of the results table and the held-out probabilities
+def run_fold(task):
+    import keras
+    from model import build_model
+    from train import make_training_dataset
+
+    fold, out, config = task['fold'], task['out'], task['config']
+    start = time.time()
+    events, folds = _worker['events'], np.asarray(_worker['folds'])
+    train, held_out = np.flatnonzero(folds != fold), np.flatnonzero(folds == fold)
+
+    prep = Preprocessor(iqr_mode = config['iqr_mode'])
+    if config['iqr_mode'] == 'sketch':
+        prep.fit_streaming(events.features, rows = train)
+    else:
+        # the exact quartiles need the fold's values; the copy is dropped before training
+        prep.fit(events.features[train])
+    rows = train[np.concatenate([prep.inlier_mask(events.features[r]) for r in iter_chunk_rows(len(events), rows = train)])]
+    weight = np.zeros(len(events), dtype = np.float32)
+    weight[rows] = training_weights(events.weight[rows], events.label[rows])
+    # the fold's rows are gathered from the shared memory map and preprocessed batch by batch
+    batches = make_training_dataset(events.features, events.label, weight, config['batch_size'], seed = config['seed'] + fold,
+                                    cache_bytes = 0, epochs = config['epochs'], rows = rows, transform = prep.transform)
+    keras.utils.set_random_seed(config['seed'] + fold)
+    model = build_model(input_dim = events.features.shape[1], hidden = tuple(config['hidden']), optimizer = config['optimizer'])
+    with stage('fit', rows_in = len(rows), fold = fold, epochs = config['epochs']):
+        model.fit(batches, epochs = config['epochs'], steps_per_epoch = -(-len(rows) // config['batch_size']), shuffle = False,
+                  verbose = 0)
+    trained = time.time()
+
+    engine = NumpyModel.from_keras(model)
+    prep.save(os.path.join(out, 'preprocessing_fold{}.npz'.format(fold)))
+    engine.save(os.path.join(out, 'model_fold{}.npz'.format(fold)))
+    probs = np.concatenate([engine.predict(prep.transform(events.features[r]))
+                            for r in iter_chunk_rows(len(events), rows = held_out)])
+    y_held_out = events.label[held_out] == 1
+    w_held_out = holdout_weights(events.weight[held_out], y_held_out, events.weight, events.label)
+    best = best_threshold(y_held_out, probs, w_held_out)
+    row = {'fold': fold, 'train_events': len(rows), 'held_out_events': len(held_out), 'precision': precision(y_held_out, probs >= 0.5),
+           'ams': ams_score(y_held_out, probs, w_held_out), 'best_threshold': best['threshold'], 'best_ams': best['ams'],
+           'train_time': trained - start, 'wall_time': time.time() - start, 'pid': os.getpid()}
+    return row, probs
+
+
+# Train all folds on `workers` processes of `threads` threads each; returns the per-fold rows (fold order)
+# and the out-of-fold probabilities of every event
+def run_cv(cache_dir, folds, out, config, workers = 0, threads = 0):
+    k = int(folds.max()) + 1
+    cores = os.cpu_count() or 1
+    workers = workers or min(k, cores)
+    threads = threads or max(1, cores // workers)
+    os.makedirs(out, exist_ok = True)
+    # an ensemble left by an earlier run is incomplete until this run writes cv.json again
+    if is_cv_ensemble(out):
+        os.remove(os.path.join(out, 'cv.json'))
+    folds_path = os.path.join(out, 'folds.npy')
+    np.save(folds_path, folds)
+
+    rows, oof = [], np.full(len(folds), np.nan, dtype = np.float32)
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, initializer = init_worker, initargs = (cache_dir, folds_path, threads), maxtasksperchild = 1) as pool:
+        for row, probs in pool.imap_unordered(run_fold, [{'fold': f, 'out': out, 'config': config} for f in range(k)]):
+            oof[folds == row['fold']] = probs
+            rows.append(row)
+            print("fold {fold}: precision {precision:.4f}, AMS {ams:.3f} (best {best_ams:.3f} at {best_threshold:.3f}), "
+                  "trained in {train_time:.1f} s".format(**row), flush = True)
+    with open(os.path.join(out, 'cv.json'), 'w') as f:
+        json.dump({'folds': k, 'config': config, 'workers': workers, 'threads': threads}, f, indent = 2)
+    return sorted(rows, key = lambda r: r['fold']), oof
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "K-fold cross-validation of the dense classifier")
+    parser.add_argument('csv', help = "Training events (Kaggle training.csv layout)")
+    parser.add_argument('--out', default = 'cv_model', help = "Directory of the fold models (scored as an ensemble by score.py)")
+    parser.add_argument('--folds', type = int, default = 5)
+    parser.add_argument('--epochs', type = int, default = 20)
+    parser.add_argument('--batch-size', type = int, default = 32)
+    parser.add_argument('--hidden', type = int, nargs = '+', default = [12, 8])
+    parser.add_argument('--optimizer', default = 'adam')
+    parser.add_argument('--iqr-mode', default = 'sequential', choices = ['sequential', 'independent', 'sketch'],
+                        help = "Outlier bounds of the fold preprocessing ('sketch' fits in chunks, without a copy of the fold)")
+    parser.add_argument('--workers', type = int, default = 0, help = "Worker processes (0 = min(folds, cores))")
+    parser.add_argument('--threads', type = int, default = 0, help = "Threads per worker (0 = cores / workers)")
+    parser.add_argument('--random-state', type = int, default = 20)
+    args = parser.parse_args(argv)
+
+    import pandas as pd
+
+    if args.folds < 2:
+        parser.error("--folds must be at least 2")
+    start = time.time()
+    events = load_events(args.csv)
+    folds = stratified_folds(strata(events.label, events.jet_num), args.folds, args.random_state)
+    config = {'hidden': args.hidden, 'optimizer': args.optimizer, 'epochs': args.epochs, 'batch_size': args.batch_size,
+              'iqr_mode': args.iqr_mode, 'seed': args.random_state}
+    rows, oof = run_cv(cache_dir_for(args.csv), folds, args.out, config, args.workers, args.threads)
+    wall = time.time() - start
+
+    table = pd.DataFrame(rows).set_index('fold')
+    metrics = ['precision', 'ams', 'best_ams', 'train_time']
+    print(table.drop(columns = ['pid']).to_string())
+    print(table[metrics].agg(['mean', 'std']).to_string())
+    y = events.label == 1
+    best = best_threshold(y, oof, events.weight)
+    print(pd.Series({"Out-of-fold precision": "{:.4f}".format(precision(y, oof >= 0.5)),
+                     "Out-of-fold AMS": "{:.3f}".format(ams_score(y, oof, events.weight)),
+                     "Out-of-fold best AMS": "{:.3f} at threshold {:.3f}".format(best['ams'], best['threshold']),
+                     "Sum of fold training times": "{:.1f} s".format(table['train_time'].sum()),
+                     "Wall time": "{:.1f} s".format(wall),
+                     "Ensemble": args.out}).to_string())
+
+
+if __name__ == '__main__':
+    main()
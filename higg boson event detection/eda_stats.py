@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Single-pass statistics engine for the EDA tables (skewness, kurtosis, -999 proportion, unique counts).
+#
+# One MomentAccumulator keeps, per class and per column, the count, the missing (-999) count and the
+# power sums of (x - shift) up to the fourth power. It is filled chunk by chunk from a float32 matrix
+# and accumulators of different chunks or processes can be merged. Skewness and kurtosis use the same
+# bias-corrected estimators as pandas.
+
+from math import comb
+
+import numpy as np
+import pandas as pd
+
+from ingest import FEATURES, FLOAT_FEATURES, MISSING
+from instrument import stage
+
+CHUNK_ROWS = 250_000
+
+SUBSETS = ['Training set (background events)', 'Training set (signal events)',
+           'Training set (all events)', 'Test set (all events)']
+
+
+class MomentAccumulator:
+    def __init__(self, n_cols, n_classes = 1, track_unique = True):
+        self.n_cols, self.n_classes = n_cols, n_classes
+        self.shift = None
+        self.count = np.zeros((n_classes, n_cols))
+        self.missing = np.zeros((n_classes, n_cols))
+        self.sums = np.zeros((4, n_classes, n_cols))  # sums of (x - shift)**k, k = 1..4
+        self.unique = [[np.empty(0, np.float32) for _ in range(n_cols)] for _ in range(n_classes)] if track_unique else None
+
+    @property
+    def rows(self):
+        return self.count + self.missing
+
+    # Accumulate a chunk x (rows x n_cols, -999 marks missing) with integer class labels in [0, n_classes)
+    def update(self, x, classes = None):
+        x = np.asarray(x, dtype = np.float32)
+        classes = np.zeros(len(x), np.intp) if classes is None else np.asarray(classes, dtype = np.intp)
+        missing = (x == MISSING) | np.isnan(x)
+        if self.shift is None:
+            with np.errstate(invalid = 'ignore'):
+                shift = np.nanmean(np.where(missing, np.nan, x), axis = 0, dtype = np.float64)
+            self.shift = np.nan_to_num(shift)
+
+        # One-hot class matrix: every class-conditional sum becomes a single matrix product
+        onehot = np.zeros((len(x), self.n_classes))
+        onehot[np.arange(len(x)), classes] = 1.0
+        v = np.where(missing, 0.0, x - self.shift)
+        p = v.copy()
+        for k in range(4):
+            if k:
+                p *= v
+            self.sums[k] += onehot.T @ p
+        self.missing += onehot.T @ missing
+        self.count += onehot.T @ ~missing
+
+        if self.unique is not None:
+            for c in range(self.n_classes):
+                xc = x[classes == c]
+                for j in range(self.n_cols):
+                    self.unique[c][j] = np.union1d(self.unique[c][j], xc[:, j])
+        return self
+
+    # Power sums re-centred on another shift, using the binomial expansion of ((x - a) + d)**k
+    def _sums_at(self, shift):
+        d = self.shift - shift
+        s = [self.count] + list(self.sums)
+        out = np.zeros_like(self.sums)
+        for k in range(1, 5):
+            out[k - 1] = sum(comb(k, j) * s[j] * d ** (k - j) for j in range(k + 1))
+        return out
+
+    def merge(self, other):
+        if other.shift is None:
+            return self
+        if self.shift is None:
+            self.shift = other.shift
+        self.sums += other._sums_at(self.shift)
+        self.count += other.count
+        self.missing += other.missing
+        if self.unique is not None and other.unique is not None:
+            for c in range(self.n_classes):
+                for j in range(self.n_cols):
+                    self.unique[c][j] = np.union1d(self.unique[c][j], other.unique[c][j])
+        return self
+
+    # Accumulator over all classes together
+    def combined(self):
+        acc = MomentAccumulator(self.n_cols, 1, track_unique = self.unique is not None)
+        acc.shift = self.shift
+        acc.count = self.count.sum(axis = 0, keepdims = True)
+        acc.missing = self.missing.sum(axis = 0, keepdims = True)
+        acc.sums = self.sums.sum(axis = 1, keepdims = True)
+        if self.unique is not None:
+            acc.unique = [[np.unique(np.concatenate([u[j] for u in self.unique])) for j in range(self.n_cols)]]
+        return acc
+
+    def _central(self):
+        n = self.count
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            d = self.sums[0] / n
+        s1, s2, s3, s4 = self.sums
+        m2 = s2 - n * d ** 2
+        m3 = s3 - 3 * d * s2 + 2 * n * d ** 3
+        m4 = s4 - 4 * d * s3 + 6 * d ** 2 * s2 - 3 * n * d ** 4
+        return n, d + self.shift, m2, m3, m4
+
+    def mean(self):
+        return self._central()[1]
+
+    # Adjusted Fisher-Pearson skewness, as in pandas.DataFrame.skew
+    def skew(self):
+        n, _, m2, m3, _ = self._central()
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            g = n * (n - 1) ** 0.5 / (n - 2) * m3 / m2 ** 1.5
+        g[n < 3] = np.nan
+        g[(n >= 3) & (m2 <= 0)] = 0.0
+        return g
+
+    # Bias-corrected excess kurtosis, as in pandas.DataFrame.kurt
+    def kurt(self):
+        n, _, m2, _, m4 = self._central()
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            g = n * (n + 1) * (n - 1) * m4 / ((n - 2) * (n - 3) * m2 ** 2) - 3 * (n - 1) ** 2 / ((n - 2) * (n - 3))
+        g[n < 4] = np.nan
+        g[(n >= 4) & (m2 <= 0)] = 0.0
+        return g
+
+    def missing_rate(self):
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return self.missing / self.rows
+
+    # Number of distinct values, missing (-999 or NaN) counted as one value like DataFrame.nunique on the raw data
+    def nunique(self):
+        return np.array([[len(u) for u in row] for row in self.unique])
+
+
+# Accumulate a whole feature matrix chunk by chunk
+def accumulate(features, classes = None, n_classes = 1, chunk_rows = CHUNK_ROWS, track_unique = True):
+    acc = MomentAccumulator(features.shape[1], n_classes, track_unique)
+    with stage('eda_accumulate', rows_in = len(features)):
+        for i in range(0, len(features), chunk_rows):
+            acc.update(features[i:i + chunk_rows], None if classes is None else classes[i:i + chunk_rows])
+    return acc
+
+
+# The four EDA tables from a class-conditional training accumulator (0 = 'b', 1 = 's') and a test
+# accumulator: df_skew, df_kurt, df_minus_999, df_unique
+def eda_tables(acc_train, acc_test, columns = FEATURES, float_columns = FLOAT_FEATURES):
+    subsets = [acc_train, acc_train.combined(), acc_test.combined()]
+
+    def table(stat, cols):
+        b_s, train, test = [getattr(acc, stat)() for acc in subsets]
+        df = pd.DataFrame(np.vstack([b_s, train, test]).T, index = list(columns), columns = SUBSETS)
+        return df.loc[list(cols)]
+
+    df_skew = table('skew', float_columns)
+    df_kurt = table('kurt', float_columns)
+
+    df_minus_999 = table('missing_rate', columns)
+    df_minus_999 = df_minus_999[df_minus_999['Training set (all events)'] > 0]
+    df_minus_999 = df_minus_999.sort_values(by = 'Training set (all events)', ascending = False)
+
+    df_unique = None
+    if acc_train.unique is not None and acc_test.unique is not None:
+        df_unique = table('nunique', columns).astype(int)
+    return df_skew, df_kurt, df_minus_999, df_unique
+
+
+# Cross-product accumulator for correlation matrices: per class, the sums of (x - shift) and of its outer
+# products, so each chunk costs one BLAS matrix product per class. Missing values enter as the -999
+# sentinel (NaN is re-encoded), which is what DataFrame.corr gives on the raw columns.
+class CorrAccumulator:
+    def __init__(self, n_cols, n_classes = 1):
+        self.n_cols, self.n_classes = n_cols, n_classes
+        self.shift = None
+        self.count = np.zeros(n_classes)
+        self.sums = np.zeros((n_classes, n_cols))
+        self.cross = np.zeros((n_classes, n_cols, n_cols))
+
+    def update(self, x, classes = None):
+        x = np.asarray(x, dtype = np.float32)
+        x = np.where(np.isnan(x), np.float32(MISSING), x)
+        if self.shift is None:
+            self.shift = x.mean(axis = 0, dtype = np.float64)
+        v = x - self.shift
+        for c in range(self.n_classes):
+            vc = v if classes is None else v[np.asarray(classes) == c]
+            self.count[c] += len(vc)
+            self.sums[c] += vc.sum(axis = 0)
+            self.cross[c] += vc.T @ vc
+        return self
+
+    def merge(self, other):
+        if other.shift is None:
+            return self
+        if self.shift is None:
+            self.shift = other.shift
+        # Re-centre the other accumulator on this shift: (x - a) = (x - b) + d
+        d = other.shift - self.shift
+        n, s = other.count[:, None], other.sums
+        self.cross += other.cross + s[:, :, None] * d[None, None, :] + d[None, :, None] * s[:, None, :] + n[:, :, None] * np.outer(d, d)
+        self.sums += s + n * d
+        self.count += other.count
+        return self
+
+    def combined(self):
+        acc = CorrAccumulator(self.n_cols, 1)
+        acc.shift = self.shift
+        acc.count = self.count.sum(keepdims = True)
+        acc.sums = self.sums.sum(axis = 0, keepdims = True)
+        acc.cross = self.cross.sum(axis = 0, keepdims = True)
+        return acc
+
+    # Pearson correlation matrices, one per class
+    def corr(self):
+        n = self.count[:, None]
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            mean = self.sums / n
+            cov = self.cross / n[:, :, None] - mean[:, :, None] * mean[:, None, :]
+            std = np.sqrt(np.diagonal(cov, axis1 = 1, axis2 = 2))
+            return np.clip(cov / (std[:, :, None] * std[:, None, :]), -1.0, 1.0)
+
+
+# The four correlation matrices (background, signal, all train, test) as DataFrames, in SUBSETS order
+def corr_matrices(train_x, train_classes, test_x, columns = FLOAT_FEATURES, chunk_rows = CHUNK_ROWS):
+    acc_train, acc_test = CorrAccumulator(train_x.shape[1], 2), CorrAccumulator(test_x.shape[1])
+    with stage('corr_matrices', rows_in = len(train_x) + len(test_x)):
+        for i in range(0, len(train_x), chunk_rows):
+            acc_train.update(train_x[i:i + chunk_rows], train_classes[i:i + chunk_rows])
+        for i in range(0, len(test_x), chunk_rows):
+            acc_test.update(test_x[i:i + chunk_rows])
+    return corr_frames(acc_train, acc_test, columns)
+
+
+# The four correlation matrices of a class-conditional training accumulator and a test accumulator
+def corr_frames(acc_train, acc_test, columns = FLOAT_FEATURES):
+    mats = list(acc_train.corr()) + [acc_train.combined().corr()[0], acc_test.corr()[0]]
+    return [pd.DataFrame(m, index = list(columns), columns = list(columns)) for m in mats]
+
+
+# Long-format table of the upper triangles: one row per pair of features, one column per subset
+def corr_table(mats):
+    columns = np.asarray(mats[0].columns)
+    i, j = np.triu_indices(len(columns), k = 1)
+    df_corr = pd.DataFrame({'feature_1': columns[i], 'feature_2': columns[j]})
+    for subset, m in zip(SUBSETS, mats):
+        df_corr[subset] = m.to_numpy()[i, j]
+    return df_corr
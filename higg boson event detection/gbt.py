@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Histogram gradient-boosted trees as a second classifier backend, next to the dense network.
+#
+#   python gbt.py training.csv --out trained_gbt.joblib --threads 8
+#   python score.py test.csv --model trained_gbt.joblib
+#
+# The trees train on the raw cached float32 features with -999 decoded to NaN (missing values get their own
+# branch at every split, no imputation or scaling) and PRI_jet_num as a categorical feature. The artifact is
+# a scikit-learn pipeline (decoding + classifier) saved with joblib, which score.py runs on raw events.
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from ingest import FEATURES, JET_NUM, MISSING, load_events
+from instrument import stage
+from metrics import best_threshold, holdout_weights, precision
+from split import strata, stratified_split
+
+GBT_PARAMS = {'max_iter': 200, 'learning_rate': 0.1, 'max_leaf_nodes': 31, 'max_bins': 255, 'l2_regularization': 0.0}
+
+
+# Float32 copy of raw features with the -999 sentinel replaced by NaN
+def decode_missing(x):
+    x = np.array(x, dtype = np.float32)
+    x[x == MISSING] = np.nan
+    return x
+
+
+def build_gbt(random_state = 20, **params):
+    from sklearn.ensemble import HistGradientBoostingClassifier
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import FunctionTransformer
+    # pickled by reference to this module, also when the file runs as __main__
+    from gbt import decode_missing
+
+    params = dict(GBT_PARAMS, **params)
+    clf = HistGradientBoostingClassifier(categorical_features = [FEATURES.index(JET_NUM)], random_state = random_state, **params)
+    return make_pipeline(FunctionTransformer(decode_missing), clf)
+
+
+# Train on raw features, with `threads` OpenMP threads (0 = all cores) and optional sample weights
+def fit_gbt(features, label, sample_weight = None, threads = 0, **params):
+    from threadpoolctl import threadpool_limits
+
+    model = build_gbt(**params)
+    fit_params = {} if sample_weight is None else {'histgradientboostingclassifier__sample_weight': sample_weight}
+    with threadpool_limits(limits = threads or None, user_api = 'openmp'), stage('fit', rows_in = len(features), backend = 'gbt'):
+        model.fit(np.asarray(features), np.asarray(label), **fit_params)
+    return model
+
+
+# Signal probabilities (rows,) of raw events
+def predict_gbt(model, features):
+    return model.predict_proba(np.asarray(features))[:, 1].astype(np.float32)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Train the gradient-boosted tree classifier")
+    parser.add_argument('csv', help = "Training events (Kaggle training.csv layout)")
+    parser.add_argument('--out', default = 'trained_gbt.joblib')
+    parser.add_argument('--threads', type = int, default = 0, help = "OpenMP threads (0 = all cores)")
+    parser.add_argument('--max-iter', type = int, default = GBT_PARAMS['max_iter'])
+    parser.add_argument('--learning-rate', type = float, default = GBT_PARAMS['learning_rate'])
+    parser.add_argument('--max-leaf-nodes', type = int, default = GBT_PARAMS['max_leaf_nodes'])
+    parser.add_argument('--no-weights', dest = 'weighted', action = 'store_false', help = "Ignore the event weights")
+    parser.add_argument('--test-size', type = float, default = 0.35)
+    parser.add_argument('--random-state', type = int, default = 20)
+    args = parser.parse_args(argv)
+
+    import joblib
+    from preprocessing import training_weights
+
+    events = load_events(args.csv)
+    train, test = stratified_split(strata(events.label, events.jet_num), args.test_size, args.random_state)
+    y = events.label[train]
+    sample_weight = training_weights(events.weight[train], y) if args.weighted else None
+
+    start = time.time()
+    model = fit_gbt(events.features[train], y, sample_weight, args.threads, max_iter = args.max_iter,
+                    learning_rate = args.learning_rate, max_leaf_nodes = args.max_leaf_nodes, random_state = args.random_state)
+    trained = time.time()
+    joblib.dump(model, args.out)
+
+    probs = predict_gbt(model, events.features[test])
+    y_test = events.label[test] == 1
+    best = best_threshold(y_test, probs, holdout_weights(events.weight[test], y_test, events.weight, events.label))
+    print(pd.Series({"Training time": "{:.2f} s".format(trained - start),
+                     "Boosting iterations": model[-1].n_iter_,
+                     "Held-out precision": "{:.4f}".format(precision(y_test, probs >= 0.5)),
+                     "Best AMS": "{:.3f} at threshold {:.3f}".format(best['ams'], best['threshold']),
+                     "Output": args.out}).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -21,10 +21,6 @@
 # File system manangement
 import time, os
 
-# Progress bar for loops
-# !pip install tqdm
-from tqdm import tqdm
-
 # Mathematical functions
 import math
 
@@ -32,26 +28,10 @@ import math
 import numpy as np
 import pandas as pd
 
-# Plotting and visualization
-import matplotlib.pyplot as plt
-get_ipython().run_line_magic('matplotlib', 'inline')
-import matplotlib.patches as mpatches
-
-from mpl_toolkits.mplot3d import Axes3D
-from matplotlib.colors import ListedColormap
-from matplotlib import cm
-from mpl_toolkits.mplot3d.axes3d import get_test_data
-
-import seaborn as sns
-sns.set_theme()
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-
-
-from sklearn.model_selection import train_test_split
-
-import tensorflow as tf
-from tensorflow import keras
+# The heavy libraries are imported by the sections that use them: matplotlib and seaborn with the first
+# plot (section 3), plotly with the donut plots, scikit-learn with the split below and Keras with the model
+# (model.py). Running the statistics or scoring cells alone does not load them; python startup.py
+# measures the cold-start cost of each entry point and library.
 
 
 # In[3]:
@@ -119,22 +99,43 @@ from tensorflow import keras
 
 
 # Loading the training data
-data_train = pd.read_csv('training.csv')
-print(pd.Series({"Memory usage": "{:.2f} MB".format(data_train.memory_usage().sum()/(1024*1024)),
-                 "Dataset shape": "{}".format(data_train.shape)}).to_string())
+# The CSV is parsed once into a columnar float32 cache (training.cache/) which later runs memory-map
+from ingest import load_events, resident_memory
+start = time.time()
+# The -999 sentinel is decoded to NaN once, when the cache is built; events.missing packs the missing
+# columns of every event into a uint32 bitmask
+events = load_events('training.csv')
+# the one frame every subset below indexes into (its feature columns are the memory-mapped cache)
+data_all = events.to_frame()
+print(pd.Series({"Load time": "{:.2f} s".format(time.time() - start),
+                 "Resident memory": "{:.2f} MB".format(resident_memory()/(1024*1024)),
+                 "Memory usage": "{:.2f} MB".format(data_all.memory_usage().sum()/(1024*1024)),
+                 "Dataset shape": "{}".format(data_all.shape)}).to_string())
 print(" ")
-data_train.head()
+data_all.head()
 
 
 # In[5]:
 
 
-X = data_train.drop(columns = ["Label", "EventId", "Weight"])
-y = data_train["Label"]
+# Intermediate arrays of the modeling chain (split, preprocessing, scaled matrices) are kept in a
+# content-addressed stage cache (see stage_cache.py): keyed on the hash of training.csv and the stage
+# parameters, memory-mapped from stages.cache/ on re-runs, least recently used entries evicted beyond 8 GB
+from stage_cache import StageCache
+stage_cache = StageCache('stages.cache', max_bytes = 8 << 30)
+source_key = stage_cache.file_digest('training.csv')
 
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.35, random_state=20)
-data_train = pd.concat([X_train, y_train], axis=1)
-data_test = pd.concat([X_test, y_test], axis=1)
+# The split is two arrays of row positions, stratified by Label and PRI_jet_num (see split.py);
+# data_train and data_test are lazy subsets of data_all (the feature columns and Label, as before) whose
+# rows are gathered only when values are read, so no DataFrame copy of either set is kept
+from ingest import FEATURES
+from split import Rows, strata, stratified_split
+split_key = stage_cache.key('split', source = source_key, test_size = 0.35, random_state = 20, stratify = ['Label', 'PRI_jet_num'])
+split = stage_cache.cached(split_key, lambda: dict(zip(['train', 'test'], stratified_split(strata(events.label, events.jet_num), test_size=0.35, random_state=20))))
+data_train = Rows(data_all, split['train'], columns = FEATURES + ['Label'])
+data_test = Rows(data_all, split['test'], columns = FEATURES + ['Label'])
+# the event weights follow the same split; they are used as sample weights and for the AMS
+w_train, w_test = events.weight[split['train']], events.weight[split['test']]
 
 
 # ## 1.5. Project Objective
@@ -206,9 +207,9 @@ data_train.dtypes
 
 # Count of column datatypes for the training dataset
 df_cols_train = pd.DataFrame(index = ['Number of columns for the training set'], columns = ['Integer', 'Float', 'Object'])
-df_cols_train['Integer'] = len(data_train.columns[data_train.dtypes == 'int64'])
-df_cols_train['Float'] = len(data_train.columns[data_train.dtypes == 'float64'])
-df_cols_train['Object'] = len(data_train.columns[data_train.dtypes == 'object'])
+df_cols_train['Integer'] = len(data_train.select_dtypes(include = 'integer').columns)
+df_cols_train['Float'] = len(data_train.select_dtypes(include = 'floating').columns)
+df_cols_train['Object'] = len(data_train.select_dtypes(include = ['object', 'category']).columns)
 df_cols_train
 
 
@@ -216,14 +217,14 @@ df_cols_train
 
 
 # Integer columns in the training dataset
-data_train.columns[data_train.dtypes == 'int64']
+data_train.select_dtypes(include = 'integer').columns
 
 
 # In[15]:
 
 
 # Object columns in the training dataset
-data_train.columns[data_train.dtypes == 'object']
+data_train.select_dtypes(include = ['object', 'category']).columns
 
 
 # In[16]:
@@ -231,9 +232,9 @@ data_train.columns[data_train.dtypes == 'object']
 
 # Count of column datatypes for the test dataset
 df_cols_test = pd.DataFrame(index = ['Number of columns for the test set'], columns = ['Integer', 'Float', 'Object'])
-df_cols_test['Integer'] = len(data_test.columns[data_test.dtypes == 'int64'])
-df_cols_test['Float'] = len(data_test.columns[data_test.dtypes == 'float64'])
-df_cols_test['Object'] = len(data_test.columns[data_test.dtypes == 'object'])
+df_cols_test['Integer'] = len(data_test.select_dtypes(include = 'integer').columns)
+df_cols_test['Float'] = len(data_test.select_dtypes(include = 'floating').columns)
+df_cols_test['Object'] = len(data_test.select_dtypes(include = ['object', 'category']).columns)
 df_cols_test
 
 
@@ -242,8 +243,8 @@ df_cols_test
 
 # Count of duplicate rows
 df_duplicate_rows = pd.DataFrame(index = ['Number of duplicate rows'], columns = ['Training set', 'Test set'])
-df_duplicate_rows['Training set'] = data_train.duplicated().sum()
-df_duplicate_rows['Test set'] = data_test.duplicated().sum()
+df_duplicate_rows['Training set'] = data_train.to_frame().duplicated().sum()
+df_duplicate_rows['Test set'] = data_test.to_frame().duplicated().sum()
 df_duplicate_rows
 
 
@@ -251,7 +252,7 @@ df_duplicate_rows
 
 
 # Constant columns in the training set
-cols_constant_train = data_train.columns[data_train.nunique() == 1].tolist()
+cols_constant_train = data_train.columns[data_train.to_frame().nunique() == 1].tolist()
 if len(cols_constant_train) == 0:
     cols_constant_train = "None"
 print(pd.Series({"Constant columns in the training set": cols_constant_train}).to_string())
@@ -261,7 +262,7 @@ print(pd.Series({"Constant columns in the training set": cols_constant_train}).t
 
 
 # Constant columns in the test set
-cols_constant_test = data_test.columns[data_test.nunique() == 1].tolist()
+cols_constant_test = data_test.columns[data_test.to_frame().nunique() == 1].tolist()
 if len(cols_constant_test) == 0:
     cols_constant_test = "None"
 print(pd.Series({"Constant columns in the test set": cols_constant_test}).to_string())
@@ -272,8 +273,8 @@ print(pd.Series({"Constant columns in the test set": cols_constant_test}).to_str
 
 # Count of columns with missing values
 df_missing = pd.DataFrame(index = ['Number of columns with missing values'], columns = ['Training set', 'Test set'])
-df_missing['Training set'] = len(data_train.isna().sum()[data_train.isna().sum() != 0])
-df_missing['Test set'] = len(data_test.isna().sum()[data_test.isna().sum() != 0])
+df_missing['Training set'] = int((data_train.to_frame().isna().sum() != 0).sum())
+df_missing['Test set'] = int((data_test.to_frame().isna().sum() != 0).sum())
 df_missing
 
 
@@ -281,21 +282,21 @@ df_missing
 
 
 # Statistical description of numerical variables in the training set
-data_train.describe()
+data_train.to_frame().describe()
 
 
 # In[22]:
 
 
 # Statistical description of categorical variables in the training set
-data_train.describe(include = ['O'])
+data_train.to_frame().describe(include = ['category'])
 
 
 # In[23]:
 
 
 # Statistical description of numerical variables in the test set
-data_test.describe()
+data_test.to_frame().describe()
 
 
 # # 3. Univariate Analysis
@@ -306,12 +307,24 @@ data_test.describe()
 # In[24]:
 
 
+# Plotting and visualization (inline in Jupyter; the non-interactive Agg backend when run as a script,
+# see report.py for the figures as files)
+import matplotlib
+try:
+    get_ipython().run_line_magic('matplotlib', 'inline')
+except NameError:
+    matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import matplotlib.patches as mpatches
+import seaborn as sns
+sns.set_theme()
+
 # Matplotlib patches for adding manual legends
 grey_patch = mpatches.Patch(color = 'grey', label = "Train")
 red_patch = mpatches.Patch(color = 'red', label = "Test")
 
 
-# In general, throughout the notebook, we choose the number of bins of a histogram by the [Freedman-Diaconis rule](https://en.wikipedia.org/wiki/Freedman%E2%80%93Diaconis_rule), which suggests the optimal number of bins to grow as $k \sim n^{1/3},$ where $n$ is the total number of observations.
+# The histograms in this notebook are drawn from fixed-edge histogram sketches with $100$ equal-width bins over a fixed range per feature (`FEATURE_RANGES` in `sketches.py`, the same for every chunk and node), rather than from the raw observations. For reference, the [Freedman-Diaconis rule](https://en.wikipedia.org/wiki/Freedman%E2%80%93Diaconis_rule) suggests the number of bins to grow as $k \sim n^{1/3},$ where $n$ is the total number of observations, i.e. about $63$ bins for the $250000$ training events.
 
 # ## 3.1. Target variable
 
@@ -325,6 +338,9 @@ red_patch = mpatches.Patch(color = 'red', label = "Test")
 
 
 # Function to construct barplot and donutplot of a dataframe column
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
 def bar_donut(df, col, h = 500, w = 800):
     fig = make_subplots(rows = 1, cols = 2, specs = [[{'type': 'xy'}, {'type': 'domain'}]])
     x_val, y_val = df[col].value_counts(sort = False).index.tolist(), df[col].value_counts(sort = False).tolist()
@@ -354,13 +370,15 @@ data_train_s = data_train[data_train['Label'] == 's'] # signal events in the tra
 # In[28]:
 
 
+# Single pass statistics engine (see eda_stats.py): one class-conditional accumulator for the training
+# set (0 = background, 1 = signal) and one for the test set give the unique counts, the -999 proportions,
+# the skewness and the kurtosis of all four subsets
+from eda_stats import accumulate, eda_tables
+acc_train = accumulate(data_train[FEATURES].to_numpy(np.float32), (data_train['Label'] == 's').to_numpy(), n_classes = 2)
+acc_test = accumulate(data_test[FEATURES].to_numpy(np.float32))
+df_skew, df_kurt, df_minus_999, df_unique = eda_tables(acc_train, acc_test)
+
 # Number of unique values for the predictor variables
-df_unique = pd.DataFrame()
-df_unique['Training set (background events)'] = [data_train_b[col].nunique() for col in data_test.columns]
-df_unique['Training set (signal events)'] = [data_train_s[col].nunique() for col in data_test.columns]
-df_unique['Training set (all events)'] = [data_train[col].nunique() for col in data_test.columns]
-df_unique['Test set (all events)'] = [data_test[col].nunique() for col in data_test.columns]
-df_unique.set_index(data_test.columns, inplace = True)
 df_unique.style.set_caption("Number of unique values for the predictor variables")
 
 
@@ -368,29 +386,31 @@ df_unique.style.set_caption("Number of unique values for the predictor variables
 
 
 # Proportion of the value -999 in the dataset columns
-def minus_999(df):
-    index = [col for col in df.columns if -999 in df[col].value_counts().index]
-    data = [df[col].value_counts()[-999]/len(df) for col in index]
-    return pd.Series(index = index, data = data).sort_values(ascending = False)
-
-df_minus_999 = pd.DataFrame()
-df_minus_999['Training set (background events)'] = minus_999(data_train_b).values
-df_minus_999['Training set (signal events)'] = minus_999(data_train_s).values
-df_minus_999['Training set (all events)'] = minus_999(data_train).values
-df_minus_999['Test set (all events)'] = minus_999(data_test).values
-df_minus_999.set_index(minus_999(data_train).index, inplace = True)
 df_minus_999.style.set_caption("Proportion of the value -999 in the dataset columns which contain -999")
 
 
+# In[ ]:
+
+
+# Missingness patterns from the bitmask: which columns are missing together, and how each pattern relates
+# to the jet multiplicity (the pattern index can serve as a partition key, see partitioned.py)
+from ingest import missing_patterns, unpack_missing
+patterns, pattern_id, pattern_count = missing_patterns(events.missing)
+df_patterns = pd.DataFrame({'Events': pattern_count, 'Proportion': pattern_count / len(events),
+                            'Missing columns': [', '.join(np.array(FEATURES)[m]) or '-' for m in unpack_missing(patterns)]})
+df_patterns = df_patterns.join(pd.crosstab(pattern_id, np.asarray(events.jet_num)).add_prefix('PRI_jet_num = '))
+df_patterns.sort_values(by = 'Events', ascending = False)
+
+
 # In[30]:
 
 
-# Combining the data
-data_train_temp = data_train.copy(deep = True)
-data_train_temp['dataset'] = "Train"
-data_test_temp = data_test.copy(deep = True)
-data_test_temp['dataset'] = "Test"
-data = pd.concat([data_train_temp, data_test_temp], axis = 0, ignore_index = True)
+# Quantile sketches and fixed-edge histograms per group (training background, training signal, test),
+# built in one streaming pass (see sketches.py). The distribution plots below are drawn from them, so
+# their cost does not depend on the number of events, and sketches of several files or nodes can be merged.
+from sketches import build_sketches, plot_histograms
+sketches = build_sketches(data_train[FEATURES].to_numpy(np.float32), (data_train['Label'] == 's').to_numpy(),
+                          data_test[FEATURES].to_numpy(np.float32))
 
 
 # ### Float features
@@ -402,16 +422,9 @@ data = pd.concat([data_train_temp, data_test_temp], axis = 0, ignore_index = Tru
 # In[31]:
 
 
-# Function to plot distributions of the float features
-def hist(df, cols, bins, ncols = 3):
-    nrows = math.ceil(len(cols) / ncols)
-    fig, ax = plt.subplots(nrows, ncols, figsize = (5 * ncols, 4.2 * nrows), sharey = False)
-    for i in range(len(cols)):
-        sns.histplot(data = df, x = cols[i], bins = bins, hue = 'dataset', palette = ['red', 'grey'], ax = ax[i // ncols, i % ncols])
-        ax[i // ncols, i % ncols].set_xlabel(cols[i])
-        if i % ncols != 0:
-            ax[i // ncols, i % ncols].set_ylabel(" ")
-    plt.tight_layout()
+# Function to plot distributions of the float features for the training set and the test set
+def hist(sketches, cols, ncols = 3):
+    plot_histograms(sketches, cols, groups = [[0, 1], 2], labels = ["Train", "Test"], colors = ['grey', 'red'], ncols = ncols)
     plt.show()
 
 
@@ -419,9 +432,8 @@ def hist(df, cols, bins, ncols = 3):
 
 
 # Distributions of the float features
-hist(data.replace(-999, np.nan),
-     list(data_test.columns[data_test.dtypes == 'float64']),
-     bins = max(math.floor(len(data_train)**(1/3)), math.floor(len(data_test)**(1/3))),
+hist(sketches,
+     list(data_test.columns[data_test.dtypes == 'float32']),
      ncols = 3)
 
 
@@ -433,15 +445,8 @@ hist(data.replace(-999, np.nan),
 
 
 # Function to plot distributions of the float features in the training set by target class
-def hist_target(df, cols, target, bins, ncols = 3):
-    nrows = math.ceil(len(cols) / ncols)
-    fig, ax = plt.subplots(nrows, ncols, figsize = (5 * ncols, 4.2 * nrows), sharey = False)
-    for i in range(len(cols)):
-        sns.histplot(data = df, x = cols[i], bins = bins, hue = target, palette = ['red', 'grey'], ax = ax[i // ncols, i % ncols])
-        ax[i // ncols, i % ncols].set_xlabel(cols[i])
-        if i % ncols != 0:
-            ax[i // ncols, i % ncols].set_ylabel(" ")
-    plt.tight_layout()
+def hist_target(sketches, cols, ncols = 3):
+    plot_histograms(sketches, cols, groups = [0, 1], labels = ["b", "s"], colors = ['red', 'grey'], ncols = ncols)
     plt.show()
 
 
@@ -449,10 +454,8 @@ def hist_target(df, cols, target, bins, ncols = 3):
 
 
 # Distributions of the float features in the training set by target class
-hist_target(data_train.replace(-999, np.nan),
-     list(data_test.columns[data_test.dtypes == 'float64']),
-     target = 'Label',
-     bins = max(math.floor(len(data_train_b)**(1/3)), math.floor(len(data_train_s)**(1/3))),
+hist_target(sketches,
+     list(data_test.columns[data_test.dtypes == 'float32']),
      ncols = 3)
 
 
@@ -468,15 +471,7 @@ hist_target(data_train.replace(-999, np.nan),
 
 
 # Skewness of the float features
-df_skew = pd.DataFrame()
-cols_float_test = data_test.columns[data_test.dtypes == 'float64']
-skew_train_b = data_train_b.replace(-999, np.nan)[cols_float_test].skew().values
-skew_train_s = data_train_s.replace(-999, np.nan)[cols_float_test].skew().values
-skew_train = data_train.replace(-999, np.nan)[cols_float_test].skew().values
-skew_test = data_test.replace(-999, np.nan)[cols_float_test].skew().values
-df_skew['Training set (background events)'], df_skew['Training set (signal events)'] = skew_train_b, skew_train_s
-df_skew['Training set (all events)'], df_skew['Test set (all events)'] = skew_train, skew_test
-df_skew.set_index(np.array(cols_float_test), inplace = True)
+cols_float_test = data_test.columns[data_test.dtypes == 'float32']
 df_skew.style.set_caption("Skewness of the float features")
 
 
@@ -544,14 +539,6 @@ plt.show()
 
 
 # Kurtosis of the float features
-df_kurt = pd.DataFrame()
-kurt_train_b = data_train_b.replace(-999, np.nan)[cols_float_test].kurt().values
-kurt_train_s = data_train_s.replace(-999, np.nan)[cols_float_test].kurt().values
-kurt_train = data_train.replace(-999, np.nan)[cols_float_test].kurt().values
-kurt_test = data_test.replace(-999, np.nan)[cols_float_test].kurt().values
-df_kurt['Training set (background events)'], df_kurt['Training set (signal events)'] = kurt_train_b, kurt_train_s
-df_kurt['Training set (all events)'], df_kurt['Test set (all events)'] = kurt_train, kurt_test
-df_kurt.set_index(np.array(cols_float_test), inplace = True)
 df_kurt.style.set_caption("Kurtosis of the float features")
 
 
@@ -655,12 +642,15 @@ donut(data_train_b, data_train_s, col = 'PRI_jet_num', text1 = 'Background', tex
 
 
 # Correlation coefficients of pairs of float features
-df_corr = pd.DataFrame(columns = ['feature_1', 'feature_2', 'Training set (background events)', 'Training set (signal events)', 'Training set (all events)', 'Test set (all events)'])
-cols = cols_float_test
-for i in range(len(cols)):
-    for j in range(len(cols)):
-        if i<j:
-            df_corr.loc[len(df_corr.index)] = [cols[i], cols[j], data_train_b[cols[i]].corr(data_train_b[cols[j]]), data_train_s[cols[i]].corr(data_train_s[cols[j]]), data_train[cols[i]].corr(data_train[cols[j]]), data_test[cols[i]].corr(data_test[cols[j]])]
+# The four correlation matrices come from one pass of batched covariance products (see eda_stats.py)
+# and are reused by the heatmaps below
+from eda_stats import corr_matrices, corr_table
+cols = list(cols_float_test)
+corr_train_b, corr_train_s, corr_train, corr_test = corr_matrices(data_train[cols].to_numpy(np.float32),
+                                                                  (data_train['Label'] == 's').to_numpy(),
+                                                                  data_test[cols].to_numpy(np.float32),
+                                                                  columns = cols)
+df_corr = corr_table([corr_train_b, corr_train_s, corr_train, corr_test])
 df_corr.sort_values(by = 'Training set (all events)', ascending = False, inplace = True)
 df_corr # df_corr.style.set_caption("Correlation coefficient of pairs of float features")
 
@@ -692,7 +682,7 @@ plt.show()
 
 # Correlation heatmap of float features for the training set
 plt.figure(figsize = (26, 19.5))
-sns.heatmap(data_train[cols_float_test].corr(), vmin = -1, vmax = 1, annot = True, cmap = plt.cm.CMRmap_r)
+sns.heatmap(corr_train, vmin = -1, vmax = 1, annot = True, cmap = plt.cm.CMRmap_r)
 plt.show()
 
 
@@ -701,7 +691,7 @@ plt.show()
 
 # Correlation heatmap of float features for the test set
 plt.figure(figsize = (26, 19.5))
-sns.heatmap(data_test[cols_float_test].corr(), vmin = -1, vmax = 1, annot = True, cmap = plt.cm.CMRmap_r)
+sns.heatmap(corr_test, vmin = -1, vmax = 1, annot = True, cmap = plt.cm.CMRmap_r)
 plt.show()
 
 
@@ -739,8 +729,8 @@ plt.show()
 
 # Correlation heatmap of float features for background events and signal events in the training set
 fig, ax = plt.subplots(1, 2, figsize = (15, 6.5), sharex = True, sharey = True)
-sns.heatmap(data_train_b[cols_float_test].corr(), vmin = -1, vmax = 1, annot = False, xticklabels = False, yticklabels = False, cmap = plt.cm.CMRmap_r, ax = ax[0])
-sns.heatmap(data_train_s[cols_float_test].corr(), vmin = -1, vmax = 1, annot = False, xticklabels = False, yticklabels = False, cmap = plt.cm.CMRmap_r, ax = ax[1])
+sns.heatmap(corr_train_b, vmin = -1, vmax = 1, annot = False, xticklabels = False, yticklabels = False, cmap = plt.cm.CMRmap_r, ax = ax[0])
+sns.heatmap(corr_train_s, vmin = -1, vmax = 1, annot = False, xticklabels = False, yticklabels = False, cmap = plt.cm.CMRmap_r, ax = ax[1])
 ax[0].set_title("Background events", fontsize = 14)
 ax[1].set_title("Signal events", fontsize = 14)
 plt.suptitle("Correlation heatmap of float features for background events and signal events in the training set", fontsize = 14)
@@ -757,25 +747,15 @@ plt.show()
 # In[50]:
 
 
-# Selected bivariate scatterplots
-pairs_selected = [
-    ('DER_mass_MMC', 'DER_mass_jet_jet'),
-    ('DER_mass_MMC', 'DER_prodeta_jet_jet'),
-    ('DER_deltaeta_jet_jet', 'DER_prodeta_jet_jet'),
-    ('DER_mass_jet_jet', 'DER_deltar_tau_lep'),
-    ('DER_mass_jet_jet', 'PRI_jet_leading_eta'),
-    ('DER_prodeta_jet_jet', 'PRI_jet_leading_eta'),
-    ('PRI_tau_eta', 'PRI_lep_eta'),
-    ('PRI_jet_num', 'PRI_jet_subleading_pt')
-]
+# Selected bivariate scatterplots, drawn as 2D histograms (log scale) so that the cost does not depend on
+# the number of events; the axes span the 0.1% to 99.9% quantiles of the sketches
+from report import PAIRS as pairs_selected, pair_counts, pair_edges, plot_pair
 for z in pairs_selected:
-    fig, ax = plt.subplots(1, 2, figsize = (15, 6), sharex = True, sharey = True)
-    sns.scatterplot(data = data_train_b.replace(-999, np.nan), x = z[0], y = z[1], ax = ax[0])
-    sns.scatterplot(data = data_train_s.replace(-999, np.nan), x = z[0], y = z[1], ax = ax[1])
-    ax[0].set_title("Background events", fontsize = 14)
-    ax[1].set_title("Signal events", fontsize = 14)
-    plt.tight_layout()
-plt.show()
+    xedges, yedges = pair_edges(sketches, z[0]), pair_edges(sketches, z[1])
+    fig = plot_pair([pair_counts(df[z[0]].to_numpy(), df[z[1]].to_numpy(), xedges, yedges) for df in [data_train_b, data_train_s]],
+                    xedges, yedges, z)
+    plt.show()
+    plt.close(fig)
 
 
 # ## 4.3. Trivariate scatterplots
@@ -785,57 +765,15 @@ plt.show()
 # In[51]:
 
 
-# Selected trivariate scatterplots
-triples_selected = [
-    ('DER_mass_MMC', 'DER_mass_transverse_met_lep', 'DER_pt_tot'),
-    ('DER_mass_MMC', 'DER_mass_vis', 'DER_prodeta_jet_jet'),
-    ('DER_mass_MMC', 'DER_mass_vis', 'DER_pt_tot'),
-    ('DER_mass_MMC', 'DER_mass_vis', 'PRI_lep_pt'),
-    ('DER_mass_MMC', 'DER_pt_h', 'DER_pt_tot'),
-    ('DER_mass_MMC', 'DER_pt_h', 'PRI_jet_subleading_pt'),
-    ('DER_mass_MMC', 'DER_deltaeta_jet_jet', 'PRI_jet_num'),
-    ('DER_mass_MMC', 'DER_mass_jet_jet', 'PRI_jet_subleading_eta'),
-    ('DER_mass_MMC', 'DER_prodeta_jet_jet', 'DER_pt_tot'),
-    ('DER_mass_MMC', 'DER_lep_eta_centrality', 'PRI_met'),
-    ('DER_mass_MMC', 'DER_lep_eta_centrality', 'PRI_jet_num'),
-    ('DER_mass_MMC', 'PRI_met_phi', 'PRI_jet_subleading_pt'),
-    ('DER_mass_MMC', 'PRI_jet_num', 'PRI_jet_leading_pt'),
-    ('DER_mass_vis', 'DER_pt_h', 'PRI_jet_leading_pt'),
-    ('DER_pt_h', 'PRI_jet_num', 'PRI_jet_leading_eta'),
-    ('DER_deltaeta_jet_jet', 'DER_prodeta_jet_jet', 'PRI_jet_subleading_eta'),
-    ('DER_deltaeta_jet_jet', 'DER_prodeta_jet_jet', 'PRI_jet_subleading_phi'),
-    ('DER_deltaeta_jet_jet', 'DER_prodeta_jet_jet', 'PRI_jet_all_pt'),
-    ('DER_deltaeta_jet_jet', 'DER_met_phi_centrality', 'PRI_jet_num'),
-    ('DER_mass_jet_jet', 'DER_deltar_tau_lep', 'PRI_lep_pt'),
-    ('DER_mass_jet_jet', 'PRI_tau_pt', 'PRI_jet_subleading_eta'),
-    ('DER_prodeta_jet_jet', 'DER_sum_pt', 'PRI_jet_all_pt'),
-    ('DER_mass_jet_jet', 'PRI_jet_leading_eta', 'PRI_jet_subleading_eta'),
-    ('DER_deltar_tau_lep', 'PRI_lep_eta', 'PRI_jet_subleading_pt'),
-    ('DER_pt_ratio_lep_tau', 'PRI_jet_num', 'PRI_jet_leading_pt'),
-    ('DER_met_phi_centrality', 'DER_lep_eta_centrality', 'PRI_jet_num'),
-    ('DER_met_phi_centrality', 'PRI_lep_eta', 'PRI_jet_num')
-]
+# Selected trivariate scatterplots, on a uniform random sample of at most MAX_POINTS events per class
+from report import MAX_POINTS, TRIPLES as triples_selected, downsample, plot_triple
+rng_plot = np.random.default_rng(20)
+sample_b = data_train_b.take(downsample(len(data_train_b), MAX_POINTS, rng_plot))
+sample_s = data_train_s.take(downsample(len(data_train_s), MAX_POINTS, rng_plot))
 for z in triples_selected:
-    fig = plt.figure(figsize = (15, 9))
-    ax = fig.add_subplot(1, 2, 1, projection = '3d')
-    x_b = data_train_b.replace(-999, np.nan)[z[0]]
-    y_b = data_train_b.replace(-999, np.nan)[z[1]]
-    z_b = data_train_b.replace(-999, np.nan)[z[2]]
-    s1 = ax.scatter(x_b, y_b, z_b, s = 40, marker = 'o', c = y_b, alpha = 1)
-    ax.set_title("Background events", fontsize = 14)
-    ax.set_xlabel(z[0])
-    ax.set_ylabel(z[1]) # ax.set_zlabel(z[2])
-    ax = fig.add_subplot(1, 2, 2, projection = '3d')
-    x_s = data_train_s.replace(-999, np.nan)[z[0]]
-    y_s = data_train_s.replace(-999, np.nan)[z[1]]
-    z_s = data_train_s.replace(-999, np.nan)[z[2]]
-    s2 = ax.scatter(x_s, y_s, z_s, s = 40, marker = 'o', c = y_s, alpha = 1)
-    ax.set_title("Signal events", fontsize = 14)
-    ax.set_xlabel(z[0])
-    ax.set_ylabel(z[1])
-    ax.set_zlabel(z[2])
-    plt.tight_layout()
-plt.show()
+    fig = plot_triple([sample_b[list(z)].to_numpy(np.float32), sample_s[list(z)].to_numpy(np.float32)], z)
+    plt.show()
+    plt.close(fig)
 
 
 # ## 5. Modeling
@@ -849,41 +787,44 @@ data_train.head()
 # In[53]:
 
 
-# null value imputation 
-data_train = data_train.replace(-999, np.nan)
-data_train = data_train.fillna(data_train.mean())
+# Preprocessing fitted on the training set (see preprocessing.py): mean imputation of -999, IQR outlier
+# bounds and standardization, held as float32 arrays and saved next to the model artifacts so that
+# scoring applies exactly the same steps
+# iqr_mode = 'sequential' keeps the original column-by-column filter; 'independent' computes all quartiles
+# in one pass and does not depend on the column order
+from preprocessing import Preprocessor
+X_raw = data_train[FEATURES].to_numpy(np.float32)
+prep_key = stage_cache.key('preprocess', split = split_key, iqr_factor = 1.5, iqr_mode = 'sequential')
+preprocessor = Preprocessor.from_arrays(stage_cache.cached(prep_key, lambda: Preprocessor(iqr_factor = 1.5, iqr_mode = 'sequential').fit(X_raw).to_arrays()))
+preprocessor.save('preprocessing.npz')
 
 
 # In[54]:
 
 
-data_test = data_test.replace(-999, np.nan)
-data_test = data_test.fillna(data_train.mean())
+# held-out events, imputed and scaled with the training parameters
+X_holdout = stage_cache.cached(stage_cache.key('transform', preprocess = prep_key, rows = 'holdout'),
+                               lambda: preprocessor.transform(data_test[FEATURES].to_numpy(np.float32)))
+y_holdout = (data_test['Label'] == 's').to_numpy().astype('uint8')
+# holdout weights rescaled to the signal/background totals of the whole training file, for the AMS
+from metrics import holdout_weights
+w_holdout = holdout_weights(w_test, y_holdout, events.weight, events.label)
 
 
 # In[55]:
 
 
-data_test.head()
-
-
-# In[56]:
-
-
-#separating numerical and categorical features
-num_features = data_train.select_dtypes(include = ['float64', 'int64']).columns
-cat_features = data_train.select_dtypes(include = ['object']).columns
+pd.DataFrame(X_holdout, columns = FEATURES).head()
 
 
 # In[57]:
 
 
-#outlier removal using IQR
-for i in num_features:
-    q1 = data_train[i].quantile(0.25)
-    q3 = data_train[i].quantile(0.75)
-    iqr = q3 - q1
-    data_train = data_train[(data_train[i] >= q1 - 1.5*iqr) & (data_train[i] <= q3 + 1.5*iqr)]
+#outlier removal using IQR (all columns of an event must lie within the fitted bounds)
+keep = stage_cache.cached(stage_cache.key('inliers', preprocess = prep_key), lambda: preprocessor.inlier_mask(X_raw))
+data_train = data_train[keep]
+print(pd.Series(preprocessor.removed_, index = FEATURES)[preprocessor.removed_ > 0].to_string())
+print(pd.Series({"Rows removed by the IQR filter": "{} of {}".format(len(keep) - keep.sum(), len(keep))}).to_string())
 
 
 # In[58]:
@@ -895,47 +836,144 @@ data_train.head()
 # In[59]:
 
 
-X = data_train.drop(['Label'], axis = 1)
+X = X_raw[keep]
 y = data_train['Label']
+w = w_train[keep]
 
 
 # In[60]:
 
 
-# normalizing the data
-from sklearn.preprocessing import StandardScaler
-scaler = StandardScaler()
-X = scaler.fit_transform(X)
+# null value imputation and normalizing the data, fused into one pass
+X = stage_cache.cached(stage_cache.key('transform', preprocess = prep_key, rows = 'train_inliers'), lambda: preprocessor.transform(X))
 
 
 # In[61]:
 
 
-y.replace({'b':0,'s':1},inplace=True)
+y = (y == 's').to_numpy().astype('uint8')
+# event weights renormalized so that signal and background carry the same total weight
+from preprocessing import training_weights
+sample_weight = training_weights(w, y)
 
 
 # In[62]:
 
 
-# keras neural network
+# keras neural network: Dense(12, relu) -> Dense(8, relu) -> Dense(1, sigmoid), see model.py
+import keras
+from model import build_model
+from train import BATCH_SIZE, scaled_learning_rate
 
-from keras.models import Sequential
-from keras.layers import Dense
-from keras.layers import Dropout
+# define the keras model; the Adam learning rate is scaled from its batch-32 value to BATCH_SIZE (see train.py)
+model = build_model(input_dim=30, optimizer = keras.optimizers.Adam(scaled_learning_rate(BATCH_SIZE)))
+
+
+# In[ ]:
+
+
+# Trained from a float32 tf.data pipeline in large batches (see train.py), with early stopping on a stratified
+# 10% validation slice of the training rows; every epoch logs its time and events/s, and the whole fit is
+# timed as one stage when instrumentation is on (see instrument.py). Weights, optimizer state and preprocessing
+# are snapshotted to checkpoints/ every 10 minutes and at every epoch end (last 3 kept), and a re-run resumes
+# from the latest snapshot instead of epoch 1 (see checkpoint.py; delete the directory to train from scratch)
+from train import fit
+fit_pos, val_pos = stratified_split(y, test_size = 0.1, random_state = 20)
+history = fit(model, X[fit_pos], y[fit_pos], sample_weight[fit_pos], validation = (X[val_pos], y[val_pos], sample_weight[val_pos]),
+              batch_size = BATCH_SIZE, epochs = 100, patience = 5, seed = 20,
+              checkpoint_dir = 'checkpoints', checkpoint_minutes = 10, keep_checkpoints = 3, preprocessor = preprocessor)
+
+
+# In[ ]:
+
+
+# Saving the model as a SavedModel next to preprocessing.npz; both are loaded by the batch scorer:
+#   python score.py test.csv --model trained_model --output submission.csv
+model.export('trained_model')
+
+
+# In[ ]:
+
+
+# Precision and AMS of the holdout selection at every decision threshold, from one sort of the scores
+from metrics import best_threshold, threshold_scan
+probs_holdout = model.predict(X_holdout, batch_size = 65536).reshape(-1)
+scan = threshold_scan(y_holdout, probs_holdout, w_holdout)
+print(best_threshold(y_holdout, probs_holdout, w_holdout).to_string())
+fig, ax = plt.subplots(figsize = (8, 4.5))
+ax.plot(scan['threshold'], scan['ams'])
+ax.set_xlabel("Decision threshold")
+ax.set_ylabel("AMS")
+plt.show()
+
+
+# In[ ]:
+
+
+# Streaming mode for event files larger than RAM (see streaming.py): the -999 masking, mean
+# imputation, IQR bounds (from quantile sketches) and scaling are fitted in online passes over the
+# memory-mapped cache, and Keras is fed chunk by chunk from a tf.data pipeline.
+STREAMING = False
+if STREAMING:
+    from streaming import make_dataset
+    events_train = load_events('training.csv')
+    preprocessor_streaming = Preprocessor().fit_streaming(events_train.features, chunk_rows = 1_000_000)
+    model_streaming = build_model(input_dim = events_train.features.shape[1])
+    model_streaming.fit(make_dataset(events_train.features, events_train.label, preprocessor_streaming, batch_size = 1024, seed = 20), epochs = 20)
+
+
+# In[ ]:
+
+
+# Jet-multiplicity partitioned models (see partitioned.py): one smaller network per PRI_jet_num = 0, 1, 2+,
+# trained only on the columns that are defined in that partition
+PARTITIONED = False
+if PARTITIONED:
+    from partitioned import PartitionedModel
+    events_train = load_events('training.csv')
+    model_partitioned = PartitionedModel().fit(events_train.features, events_train.jet_num, events_train.label, epochs = 20,
+                                               missing = events_train.missing)
+    model_partitioned.save('partitioned_model')
+
+
+# In[ ]:
+
+
+# 5-fold cross-validation (see cv.py): the preprocessing is refitted on the training folds of every fold, the
+# folds train at once in worker processes sharing the memory-mapped event cache, and the fold models are saved
+# as an ensemble that score.py averages (python score.py test.csv --model cv_model). It runs as its own
+# process: the spawned workers would otherwise re-run this notebook when it is executed as a script.
+CV = False
+if CV:
+    import subprocess, sys
+    cv_run = subprocess.run([sys.executable, 'cv.py', 'training.csv', '--folds', '5', '--out', 'cv_model', '--epochs', '20'],
+                            capture_output = True, text = True, check = True)
+    print(cv_run.stdout)
+
+
+# In[ ]:
 
-# define the keras model
-model = Sequential()
-model.add(Dense(12, input_dim=30, activation='relu'))
-model.add(Dense(8, activation='relu'))
-model.add(Dense(1, activation='sigmoid'))
 
-model.compile(loss='binary_crossentropy',metrics=['accuracy'],optimizer='adam')
+# Gradient-boosted trees on the raw features, -999 decoded to NaN (see gbt.py), saved next to the network
+# artifacts; python compare_models.py training.csv benchmarks both backends on the same split
+GBT = False
+if GBT:
+    import joblib
+    from gbt import fit_gbt, predict_gbt
+    y_gbt = events.label[split['train']]
+    gbt_model = fit_gbt(events.features[split['train']], y_gbt, training_weights(w_train, y_gbt))
+    joblib.dump(gbt_model, 'trained_gbt.joblib')
+    print(best_threshold(y_holdout, predict_gbt(gbt_model, data_test[FEATURES].to_numpy(np.float32)), w_holdout).to_string())
 
 
 # In[ ]:
 
 
-model.fit(X,y,epochs=20)
+# Per-stage wall time, CPU time, peak memory and rows of this run, when the notebook runs with
+# HIGGS_TRACE=trace.json (which also writes a Chrome trace at exit, see instrument.py)
+import instrument
+if instrument.enabled():
+    print(instrument.summary().to_string())
 
 
 # In[ ]:
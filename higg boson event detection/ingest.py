@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Columnar, memory-mapped cache for the Kaggle event files (training.csv / test.csv).
+#
+# The first call to load_events() parses the CSV once, in chunks, and writes one .npy file per
+# column group next to it. Later calls memory-map those files instead of re-parsing the CSV.
+#
+#   features.npy   all 30 predictor columns, file order, float32 (PRI_jet_num included), NaN where missing
+#   missing.npy    missingness bitmask, uint32 (bit j set when FEATURES[j] is missing)
+#   jet_num.npy    PRI_jet_num, int8
+#   event_id.npy   EventId, int32
+#   weight.npy     Weight, float32     (training file only)
+#   label.npy      Label, uint8 (1 = 's')   (training file only)
+#
+# The -999 sentinel of the CSV files is decoded once, while the cache is built: every later reader gets
+# NaN for missing values without a replace() copy, and the bitmask packs the missingness pattern of an
+# event into one integer, usable as a partition key (missing_patterns) or unpacked as 0/1 model inputs
+# (unpack_missing).
+
+import json
+import os
+
+import numpy as np
+
+from instrument import stage, traced
+
+FEATURES = [
+    'DER_mass_MMC', 'DER_mass_transverse_met_lep', 'DER_mass_vis', 'DER_pt_h',
+    'DER_deltaeta_jet_jet', 'DER_mass_jet_jet', 'DER_prodeta_jet_jet', 'DER_deltar_tau_lep',
+    'DER_pt_tot', 'DER_sum_pt', 'DER_pt_ratio_lep_tau', 'DER_met_phi_centrality',
+    'DER_lep_eta_centrality', 'PRI_tau_pt', 'PRI_tau_eta', 'PRI_tau_phi', 'PRI_lep_pt',
+    'PRI_lep_eta', 'PRI_lep_phi', 'PRI_met', 'PRI_met_phi', 'PRI_met_sumet', 'PRI_jet_num',
+    'PRI_jet_leading_pt', 'PRI_jet_leading_eta', 'PRI_jet_leading_phi', 'PRI_jet_subleading_pt',
+    'PRI_jet_subleading_eta', 'PRI_jet_subleading_phi', 'PRI_jet_all_pt'
+]
+JET_NUM = 'PRI_jet_num'
+FLOAT_FEATURES = [col for col in FEATURES if col != JET_NUM]
+LABELS = ['b', 's']
+MISSING = -999.0
+
+CACHE_VERSION = 2
+CHUNK_ROWS = 1_000_000
+
+
+# Resident memory of the current process in bytes (peak RSS when psutil is not installed)
+def resident_memory():
+    try:
+        import psutil
+        return psutil.Process(os.getpid()).memory_info().rss
+    except ImportError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Default cache directory: training.csv -> training.cache/
+def cache_dir_for(csv_path):
+    return os.path.splitext(csv_path)[0] + '.cache'
+
+
+# Number of data rows in a CSV file, counted on raw bytes without parsing
+def count_rows(csv_path, block = 1 << 24):
+    n, last = 0, b'\n'
+    with open(csv_path, 'rb') as f:
+        while True:
+            buf = f.read(block)
+            if not buf:
+                break
+            n += buf.count(b'\n')
+            last = buf[-1:]
+    if last != b'\n':
+        n += 1
+    return n - 1
+
+
+def _source_stamp(csv_path):
+    st = os.stat(csv_path)
+    return {'source': os.path.abspath(csv_path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'version': CACHE_VERSION}
+
+
+def _read_meta(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Packed missingness bitmask (uint32 per row, bit j for column j) of a boolean matrix of up to 32 columns
+def pack_missing(missing):
+    missing = np.asarray(missing, dtype = bool)
+    if missing.shape[1] > 32:
+        raise ValueError("A uint32 bitmask holds at most 32 columns, got {}".format(missing.shape[1]))
+    packed = np.zeros((len(missing), 4), dtype = np.uint8)
+    packed[:, :(missing.shape[1] + 7) // 8] = np.packbits(missing, axis = 1, bitorder = 'little')
+    return packed.view('<u4').reshape(-1).astype(np.uint32)
+
+
+# Boolean matrix (rows x n_cols) of a packed bitmask
+def unpack_missing(bits, n_cols = len(FEATURES)):
+    packed = np.ascontiguousarray(bits, dtype = '<u4').view(np.uint8).reshape(-1, 4)
+    return np.unpackbits(packed, axis = 1, count = n_cols, bitorder = 'little').view(bool)
+
+
+# Decode the -999 sentinel of a float32 feature matrix in place (-999 -> NaN) and return its bitmask
+def decode_sentinel(x):
+    missing = (x == MISSING) | np.isnan(x)
+    x[missing] = np.nan
+    return pack_missing(missing)
+
+
+# Distinct missingness patterns of a bitmask: the patterns, the pattern index of every event and the
+# number of events per pattern
+def missing_patterns(bits):
+    return np.unique(np.asarray(bits), return_inverse = True, return_counts = True)
+
+
+# Events of one file, backed by memory-mapped column arrays
+class Events:
+    def __init__(self, features, jet_num, event_id, weight = None, label = None, missing = None):
+        self.features = features
+        self.jet_num = jet_num
+        self.event_id = event_id
+        self.weight = weight
+        self.label = label
+        self.missing = missing
+
+    def __len__(self):
+        return len(self.features)
+
+    @property
+    def nbytes(self):
+        arrays = [self.features, self.jet_num, self.event_id, self.weight, self.label, self.missing]
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    # DataFrame view with the original Kaggle column layout (float32 features with NaN for missing values,
+    # int8 PRI_jet_num, categorical Label)
+    def to_frame(self):
+        import pandas as pd
+
+        df = pd.DataFrame(self.features, columns = FEATURES, copy = False)
+        df[JET_NUM] = np.asarray(self.jet_num)
+        df.insert(0, 'EventId', np.asarray(self.event_id))
+        if self.weight is not None:
+            df['Weight'] = np.asarray(self.weight)
+        if self.label is not None:
+            df['Label'] = pd.Categorical.from_codes(np.asarray(self.label), categories = LABELS)
+        return df
+
+
+# Parse the CSV once, chunk by chunk, straight into the .npy column files
+@traced('build_cache')
+def build_cache(csv_path, cache_dir = None, chunk_rows = CHUNK_ROWS):
+    import pandas as pd
+
+    cache_dir = cache_dir or cache_dir_for(csv_path)
+    os.makedirs(cache_dir, exist_ok = True)
+    header = pd.read_csv(csv_path, nrows = 0).columns
+    missing = [col for col in ['EventId'] + FEATURES if col not in header]
+    if missing:
+        raise ValueError("{} is missing columns: {}".format(csv_path, missing))
+    has_label = 'Label' in header and 'Weight' in header
+    n = count_rows(csv_path)
+
+    def open_npy(name, dtype, shape):
+        return np.lib.format.open_memmap(os.path.join(cache_dir, name + '.npy'), mode = 'w+', dtype = dtype, shape = shape)
+
+    out = {'features': open_npy('features', np.float32, (n, len(FEATURES))),
+           'missing': open_npy('missing', np.uint32, (n,)),
+           'jet_num': open_npy('jet_num', np.int8, (n,)),
+           'event_id': open_npy('event_id', np.int32, (n,))}
+    if has_label:
+        out['weight'] = open_npy('weight', np.float32, (n,))
+        out['label'] = open_npy('label', np.uint8, (n,))
+
+    dtype = dict.fromkeys(FLOAT_FEATURES + ['Weight'], np.float32)
+    dtype.update({JET_NUM: np.int8, 'EventId': np.int32})
+    start = 0
+    for chunk in pd.read_csv(csv_path, dtype = dtype, chunksize = chunk_rows):
+        stop = start + len(chunk)
+        x = chunk[FEATURES].to_numpy(np.float32)
+        out['missing'][start:stop] = decode_sentinel(x)
+        out['features'][start:stop] = x
+        out['jet_num'][start:stop] = chunk[JET_NUM].to_numpy()
+        out['event_id'][start:stop] = chunk['EventId'].to_numpy()
+        if has_label:
+            out['weight'][start:stop] = chunk['Weight'].to_numpy()
+            out['label'][start:stop] = (chunk['Label'] == 's').to_numpy()
+        start = stop
+    if start != n:
+        raise ValueError("{}: counted {} rows but parsed {}".format(csv_path, n, start))
+    for arr in out.values():
+        arr.flush()
+
+    meta = _source_stamp(csv_path)
+    meta.update({'rows': n, 'columns': FEATURES, 'has_label': has_label})
+    with open(os.path.join(cache_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent = 2)
+    return meta
+
+
+# Memory-map the cached columns of an event file, building the cache first if it is missing or stale
+def load_events(csv_path, cache_dir = None, mmap_mode = 'r'):
+    cache_dir = cache_dir or cache_dir_for(csv_path)
+    with stage('load_events', source = csv_path) as s:
+        meta = _read_meta(cache_dir)
+        if meta is None or any(meta.get(k) != v for k, v in _source_stamp(csv_path).items()):
+            build_cache(csv_path, cache_dir)
+        events = open_cache(cache_dir, mmap_mode)
+        s.rows_out = len(events)
+    return events
+
+
+# Memory-map an existing cache directory as it is (no staleness check against a source file)
+def open_cache(cache_dir, mmap_mode = 'r'):
+    meta = _read_meta(cache_dir)
+    if meta is None:
+        raise FileNotFoundError("No event cache in {}".format(cache_dir))
+
+    def load(name):
+        return np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode = mmap_mode)
+
+    if meta['has_label']:
+        return Events(load('features'), load('jet_num'), load('event_id'), load('weight'), load('label'), missing = load('missing'))
+    return Events(load('features'), load('jet_num'), load('event_id'), missing = load('missing'))
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Per-stage timing and memory instrumentation.
+#
+#   from instrument import stage, traced
+#
+#   with stage('load', rows_in = n) as s:
+#       ...
+#       s.rows_out = len(events)
+#
+#   @traced('fit')
+#   def fit(...): ...
+#
+# Each stage records wall time, CPU time, resident memory before/after, the peak resident memory during the
+# stage (Linux: the kernel high-water mark, reset at stage entry; elsewhere the process peak so far), rows
+# in/out and, with trace_alloc, the peak and net bytes allocated (tracemalloc). Stages nest; a parent keeps
+# the peaks of its children.
+#
+# Instrumentation is off by default: stage() then returns a shared no-op context manager and @traced
+# functions are called directly, so the hooks can stay in production code. It is switched on with enable(),
+# or for any script with the environment variable HIGGS_TRACE=trace.json, which writes a Chrome trace
+# (chrome://tracing, https://ui.perfetto.dev) at exit ('{pid}' in the name is replaced by the process id, for
+# multi-process runs); HIGGS_TRACE_ALLOC=1 adds allocation tracking.
+
+import atexit
+import collections
+import functools
+import json
+import os
+import threading
+import time
+
+MAX_RECORDS = 100_000
+
+
+class _Null:
+    rows_in = rows_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL = _Null()
+
+
+class _State:
+    enabled = False
+    trace_alloc = False
+    reset_peak = True
+    origin = time.perf_counter()
+    records = collections.deque(maxlen = MAX_RECORDS)
+    local = threading.local()
+
+
+def _rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        from ingest import resident_memory
+        return resident_memory()
+
+
+def _peak_rss():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Reset the kernel high-water mark to the current resident memory (Linux only)
+def _reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class Stage:
+    def __init__(self, name, rows_in = None, **attrs):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.attrs = attrs
+        self.child_peak_rss = 0
+        self.child_peak_alloc = 0
+
+    def __enter__(self):
+        stack = _stack()
+        if stack:
+            parent = stack[-1]
+            parent.child_peak_rss = max(parent.child_peak_rss, _peak_rss())
+            if _State.trace_alloc:
+                import tracemalloc
+                parent.child_peak_alloc = max(parent.child_peak_alloc, tracemalloc.get_traced_memory()[1])
+        stack.append(self)
+        self.depth = len(stack) - 1
+        self.peak_exact = _State.reset_peak and _reset_peak_rss()
+        if _State.trace_alloc:
+            import tracemalloc
+            self.alloc_start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self.rss_start = _rss()
+        self.cpu_start = time.process_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        cpu = time.process_time() - self.cpu_start
+        record = {'name': self.name, 'depth': self.depth, 'thread': threading.get_ident(),
+                  'start_s': self.start - _State.origin, 'wall_s': end - self.start, 'cpu_s': cpu,
+                  'rss_start_bytes': self.rss_start, 'rss_end_bytes': _rss(),
+                  'peak_rss_bytes': max(self.child_peak_rss, _peak_rss()), 'peak_rss_exact': self.peak_exact,
+                  'rows_in': self.rows_in, 'rows_out': self.rows_out}
+        if _State.trace_alloc:
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            record['alloc_peak_bytes'] = max(self.child_peak_alloc, peak) - self.alloc_start
+            record['alloc_net_bytes'] = current - self.alloc_start
+        record.update(self.attrs)
+        _stack().pop()
+        _State.records.append(record)
+        return False
+
+
+def _stack():
+    stack = getattr(_State.local, 'stack', None)
+    if stack is None:
+        stack = _State.local.stack = []
+    return stack
+
+
+def enabled():
+    return _State.enabled
+
+
+def enable(trace_alloc = False, reset_peak = True):
+    _State.enabled = True
+    _State.reset_peak = reset_peak
+    if trace_alloc and not _State.trace_alloc:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+    _State.trace_alloc = trace_alloc
+
+
+def disable():
+    _State.enabled = False
+
+
+def clear():
+    _State.records.clear()
+
+
+# Context manager timing one stage; a shared no-op when instrumentation is off
+def stage(name, rows_in = None, **attrs):
+    if not _State.enabled:
+        return _NULL
+    return Stage(name, rows_in, **attrs)
+
+
+# Decorator running the whole function as one stage
+def traced(name = None):
+    def decorate(fn):
+        label = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _State.enabled:
+                return fn(*args, **kwargs)
+            with Stage(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def records():
+    return list(_State.records)
+
+
+# Chrome trace event format: one complete ('X') event per stage, timestamps in microseconds
+def chrome_trace(recs = None):
+    pid = os.getpid()
+    events = []
+    for r in recs if recs is not None else records():
+        args = {k: v for k, v in r.items() if k not in ('name', 'thread', 'start_s', 'wall_s', 'depth')}
+        events.append({'name': r['name'], 'cat': 'stage', 'ph': 'X', 'pid': pid, 'tid': r['thread'],
+                       'ts': r['start_s'] * 1e6, 'dur': r['wall_s'] * 1e6, 'args': args})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+# Write the records as a Chrome trace (kind = 'chrome') or as a plain list of stage records ('records')
+def export(path, kind = 'chrome'):
+    path = path.replace('{pid}', str(os.getpid()))
+    with open(path, 'w') as f:
+        json.dump(chrome_trace() if kind == 'chrome' else records(), f, indent = 1)
+    return path
+
+
+# One row per stage name: calls, total wall/CPU time, largest peak RSS, total rows in/out
+def summary():
+    import pandas as pd
+
+    df = pd.DataFrame(records())
+    if df.empty:
+        return df
+    return df.groupby('name', sort = False).agg(calls = ('wall_s', 'size'), wall_s = ('wall_s', 'sum'), cpu_s = ('cpu_s', 'sum'),
+                                                peak_rss_mb = ('peak_rss_bytes', lambda v: v.max() / (1024 * 1024)),
+                                                rows_in = ('rows_in', 'sum'), rows_out = ('rows_out', 'sum'))
+
+
+if os.environ.get('HIGGS_TRACE'):
+    enable(trace_alloc = os.environ.get('HIGGS_TRACE_ALLOC', '') not in ('', '0'))
+    atexit.register(export, os.environ['HIGGS_TRACE'])
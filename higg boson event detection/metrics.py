@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Evaluation metrics of the challenge: precision of the signal selection and the Approximate Median
+# Significance (AMS) of the weighted signal s and background b selected by a decision threshold.
+# threshold_scan() evaluates every threshold at once, from one sort of the scores.
+
+import numpy as np
+
+AMS_B_REG = 10.0
+
+
+def ams(s, b, b_reg = AMS_B_REG):
+    s, b = np.asarray(s, dtype = np.float64), np.asarray(b, dtype = np.float64)
+    return np.sqrt(2 * ((s + b + b_reg) * np.log1p(s / (b + b_reg)) - s))
+
+
+def precision(y, pred):
+    y, pred = np.asarray(y, dtype = bool), np.asarray(pred, dtype = bool)
+    return np.count_nonzero(y & pred) / max(np.count_nonzero(pred), 1)
+
+
+# Weights of a held-out subset rescaled so that signal and background each sum to their totals over
+# the full training set, as the AMS expects
+def holdout_weights(weight, y, weight_all, y_all):
+    weight, y = np.asarray(weight, dtype = np.float64), np.asarray(y, dtype = bool)
+    weight_all, y_all = np.asarray(weight_all, dtype = np.float64), np.asarray(y_all, dtype = bool)
+    scaled = np.empty(len(weight), dtype = np.float64)
+    for cls in (False, True):
+        total = np.sum(weight_all, where = y_all == cls, dtype = np.float64)
+        subset = weight[y == cls].sum()
+        scaled[y == cls] = weight[y == cls] * (total / subset if subset else 0.0)
+    return scaled
+
+
+# AMS of the events selected at `threshold`
+def ams_score(y, probs, weight, threshold = 0.5):
+    y, selected = np.asarray(y, dtype = bool), np.asarray(probs) >= threshold
+    weight = np.asarray(weight, dtype = np.float64)
+    return float(ams(weight[selected & y].sum(), weight[selected & ~y].sum()))
+
+
+# Precision and AMS of the selection probs >= t for every distinct score t, from one sort and cumulative
+# sums of the signal/background weights (rows ordered by decreasing threshold)
+def threshold_scan(y, probs, weight):
+    import pandas as pd
+
+    probs = np.asarray(probs).reshape(-1)
+    order = np.argsort(probs)[::-1]
+    p = probs[order]
+    y = np.asarray(y, dtype = bool)[order]
+    w = np.asarray(weight, dtype = np.float64)[order]
+    s = np.cumsum(np.where(y, w, 0.0))
+    b = np.cumsum(np.where(y, 0.0, w))
+    tp = np.cumsum(y)
+    # the selection at a threshold ends with the last event of its run of equal scores
+    last = np.flatnonzero(np.append(p[1:] != p[:-1], True))
+    selected = last + 1
+    return pd.DataFrame({'threshold': p[last], 'selected': selected, 's': s[last], 'b': b[last],
+                         'precision': tp[last] / selected, 'ams': ams(s[last], b[last])})
+
+
+# Threshold with the highest AMS, and the precision, selected events and AMS there
+def best_threshold(y, probs, weight):
+    scan = threshold_scan(y, probs, weight)
+    return scan.loc[scan['ams'].idxmax()]
@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Dense event classifier shared by the notebook, streaming training and scoring
+
+from ingest import FEATURES
+
+
+# Keras Sequential network: 30 inputs -> Dense(12, relu) -> Dense(8, relu) -> Dense(1, sigmoid)
+def build_model(input_dim = len(FEATURES), hidden = (12, 8), optimizer = 'adam'):
+    from keras import Input
+    from keras.models import Sequential
+    from keras.layers import Dense
+
+    model = Sequential()
+    model.add(Input(shape = (input_dim,)))
+    for units in hidden:
+        model.add(Dense(units, activation = 'relu'))
+    model.add(Dense(1, activation = 'sigmoid'))
+    model.compile(loss = 'binary_crossentropy', metrics = ['accuracy'], optimizer = optimizer)
+    return model
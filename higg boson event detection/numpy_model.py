@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# NumPy-only inference for the dense classifier, so scoring workers do not import TensorFlow.
+#
+#   python numpy_model.py trained_model --output trained_model.npz     # export (needs TensorFlow once)
+#   python score.py test.csv --model trained_model.npz                  # score without TensorFlow
+#
+# The .npz file holds the kernels W0, W1, ... and biases b0, b1, ... of the Dense layers as float32,
+# plus their activations.
+
+import argparse
+import os
+
+import numpy as np
+
+ACTIVATIONS = ['relu', 'relu', 'sigmoid']
+
+
+# (kernel, bias) pairs of the Dense layers, in layer order, from a SavedModel directory or a Keras model file
+def read_dense_weights(path):
+    if os.path.isdir(path):
+        import tensorflow as tf
+        variables = [v.numpy() for v in tf.saved_model.load(path).variables]
+    else:
+        if path.endswith('.joblib') or path.endswith('.pkl'):
+            import joblib
+            model = joblib.load(path)
+        else:
+            import keras
+            model = keras.models.load_model(path)
+        variables = model.get_weights()
+    if len(variables) % 2:
+        raise ValueError("{}: expected kernel/bias pairs, got {} variables".format(path, len(variables)))
+    layers = [(variables[i], variables[i + 1]) for i in range(0, len(variables), 2)]
+    for (w, b), (w_next, _) in zip(layers, layers[1:] + [(None, None)]):
+        if w.ndim != 2 or b.shape != (w.shape[1],) or (w_next is not None and w_next.shape[0] != w.shape[1]):
+            raise ValueError("{}: variables do not form a chain of Dense layers".format(path))
+    return layers
+
+
+# Apply a Dense layer activation in place
+def activate(out, act):
+    if act == 'relu':
+        np.maximum(out, 0, out = out)
+    elif act == 'sigmoid':
+        np.negative(out, out = out)
+        with np.errstate(over = 'ignore'):
+            np.exp(out, out = out)
+        out += 1
+        np.reciprocal(out, out = out)
+    elif act != 'linear':
+        raise ValueError("Unsupported activation: {}".format(act))
+    return out
+
+
+def export_npz(model_path, output, activations = ACTIVATIONS):
+    layers = read_dense_weights(model_path)
+    if len(activations) != len(layers):
+        raise ValueError("{} layers but {} activations".format(len(layers), len(activations)))
+    NumpyModel([w for w, _ in layers], [b for _, b in layers], activations).save(output)
+    return output
+
+
+class NumpyModel:
+    def __init__(self, weights, biases, activations):
+        self.weights = [np.ascontiguousarray(w, dtype = np.float32) for w in weights]
+        self.biases = [np.ascontiguousarray(b, dtype = np.float32) for b in biases]
+        self.activations = list(activations)
+        self.buffers = []
+
+    # From an in-memory Keras model made of Dense layers, activations read from the layer configs
+    @classmethod
+    def from_keras(cls, model):
+        layers = [layer for layer in model.layers if layer.get_weights()]
+        weights = [layer.get_weights() for layer in layers]
+        activations = [layer.get_config().get('activation', 'linear') for layer in layers]
+        return cls([w for w, _ in weights], [b for _, b in weights], activations)
+
+    def save(self, path):
+        arrays = {}
+        for i, (w, b) in enumerate(zip(self.weights, self.biases)):
+            arrays['W{}'.format(i)], arrays['b{}'.format(i)] = w, b
+        np.savez(path, activations = np.array(self.activations), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            activations = f['activations'].tolist()
+            n = len(activations)
+            return cls([f['W{}'.format(i)] for i in range(n)], [f['b{}'.format(i)] for i in range(n)], activations)
+
+    @property
+    def nbytes(self):
+        return sum(w.nbytes + b.nbytes for w, b in zip(self.weights, self.biases))
+
+    # One buffer per layer output, grown on demand and reused across calls (not thread-safe)
+    def _buffers(self, rows):
+        if not self.buffers or len(self.buffers[0]) < rows:
+            self.buffers = [np.empty((rows, w.shape[1]), dtype = np.float32) for w in self.weights]
+        return [buf[:rows] for buf in self.buffers]
+
+    # Signal probabilities (rows,) for a preprocessed float32 batch (rows x inputs)
+    def predict(self, x):
+        h = np.asarray(x, dtype = np.float32)
+        for w, b, act, out in zip(self.weights, self.biases, self.activations, self._buffers(len(h))):
+            np.matmul(h, w, out = out)
+            out += b
+            activate(out, act)
+            h = out
+        return h.reshape(-1).copy()
+
+    __call__ = predict
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Export the dense model weights for NumPy-only inference")
+    parser.add_argument('model', help = "SavedModel directory, .keras, .joblib or .pkl file")
+    parser.add_argument('--output', default = 'trained_model.npz')
+    parser.add_argument('--activations', nargs = '+', default = ACTIVATIONS)
+    args = parser.parse_args(argv)
+
+    export_npz(args.model, args.output, args.activations)
+    model = NumpyModel.load(args.output)
+    print("Exported {} Dense layers ({} bytes of weights) to {}".format(len(model.weights), model.nbytes, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Jet-multiplicity partitioned models keyed on PRI_jet_num.
+#
+# Whole groups of features are undefined (-999) depending on the number of jets. Events are split into
+# the groups PRI_jet_num = 0, 1 and 2+, the columns that are entirely missing or constant within a group
+# are dropped, and each group gets its own preprocessing and a smaller dense network. At scoring time the
+# events are routed to their partition through a vectorized group index.
+#
+#   python partitioned.py training.csv --out partitioned_model --epochs 20
+#   python score.py test.csv --model partitioned_model
+#
+# The output directory holds partitions.json and, per partition, preprocessing_jet{g}.npz and the NumPy
+# weights model_jet{g}.npz (see numpy_model.py), so scoring does not need TensorFlow.
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from ingest import FEATURES, load_events, unpack_missing
+from instrument import stage
+from metrics import best_threshold, holdout_weights, precision
+from numpy_model import NumpyModel
+from preprocessing import Preprocessor, missing_mask, training_weights
+from split import strata, stratified_split
+
+N_GROUPS = 3
+GROUP_NAMES = ['PRI_jet_num = 0', 'PRI_jet_num = 1', 'PRI_jet_num >= 2']
+
+
+# Partition index of every event: 0, 1, or 2 for two or more jets
+def jet_group(jet_num):
+    return np.minimum(np.asarray(jet_num), N_GROUPS - 1).astype(np.int8)
+
+
+# Columns worth keeping within a group: not missing for every event and not constant. With `bits`, the
+# missingness bitmask of the rows of a decoded matrix (NaN for missing, see ingest.py), the always-missing
+# columns come from one AND over the bitmask and no missing mask is built.
+def partition_columns(x, bits = None):
+    if bits is None:
+        missing = missing_mask(x)
+        all_missing = missing.all(axis = 0)
+        lo = np.min(x, axis = 0, where = ~missing, initial = np.inf)
+        hi = np.max(x, axis = 0, where = ~missing, initial = -np.inf)
+    else:
+        all_missing = unpack_missing(np.bitwise_and.reduce(np.asarray(bits), keepdims = True), x.shape[1])[0]
+        lo, hi = np.fmin.reduce(x, axis = 0, initial = np.inf), np.fmax.reduce(x, axis = 0, initial = -np.inf)
+    constant = lo == hi
+    return np.flatnonzero(~all_missing & ~constant)
+
+
+class PartitionedModel:
+    def __init__(self, columns = FEATURES):
+        self.columns = list(columns)
+        self.partitions = [None] * N_GROUPS  # (column indices, Preprocessor, NumpyModel) per group
+
+    # Train one network per jet group; build_kwargs go to model.build_model (e.g. hidden = (8, 4)).
+    # With `weight`, the event weights renormalized per class within each group are the sample weights;
+    # `missing` is the missingness bitmask of decoded features (Events.missing).
+    def fit(self, features, jet_num, label, weight = None, epochs = 20, batch_size = 32, iqr_mode = 'sequential', verbose = 0,
+            missing = None, **build_kwargs):
+        from model import build_model
+
+        group = jet_group(jet_num)
+        label = np.asarray(label)
+        for g in range(N_GROUPS):
+            rows = np.flatnonzero(group == g)
+            if len(rows) == 0:
+                continue
+            x = np.asarray(features[rows], dtype = np.float32)
+            cols = partition_columns(x, None if missing is None else np.asarray(missing)[rows])
+            x = x[:, cols]
+            prep = Preprocessor(columns = [self.columns[c] for c in cols], iqr_mode = iqr_mode).fit(x)
+            keep = prep.inlier_mask(x)
+            y = label[rows][keep]
+            sample_weight = None if weight is None else training_weights(np.asarray(weight)[rows][keep], y)
+            model = build_model(input_dim = len(cols), **build_kwargs)
+            with stage('fit', rows_in = len(y), partition = g, epochs = epochs):
+                model.fit(prep.transform(x[keep]), y, sample_weight = sample_weight, epochs = epochs, batch_size = batch_size,
+                          verbose = verbose)
+            self.partitions[g] = (cols, prep, NumpyModel.from_keras(model))
+        return self
+
+    # Signal probabilities of raw events, each routed to the model of its jet group
+    def predict(self, features, jet_num):
+        group = jet_group(jet_num)
+        probs = np.full(len(group), np.nan, dtype = np.float32)
+        for g, part in enumerate(self.partitions):
+            rows = np.flatnonzero(group == g)
+            if len(rows) == 0 or part is None:
+                continue
+            cols, prep, model = part
+            x = np.asarray(features[rows], dtype = np.float32)[:, cols]
+            probs[rows] = model.predict(prep.transform(x))
+        return probs
+
+    # Multiply-adds of the dense layers per event of each partition
+    def flops_per_event(self):
+        return [sum(w.size for w in part[2].weights) if part else 0 for part in self.partitions]
+
+    def save(self, path):
+        os.makedirs(path, exist_ok = True)
+        meta = {'columns': self.columns, 'groups': GROUP_NAMES, 'partitions': []}
+        for g, part in enumerate(self.partitions):
+            if part is None:
+                meta['partitions'].append(None)
+                continue
+            cols, prep, model = part
+            prep.save(os.path.join(path, 'preprocessing_jet{}.npz'.format(g)))
+            model.save(os.path.join(path, 'model_jet{}.npz'.format(g)))
+            meta['partitions'].append({'columns': [self.columns[c] for c in cols]})
+        with open(os.path.join(path, 'partitions.json'), 'w') as f:
+            json.dump(meta, f, indent = 2)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, 'partitions.json')) as f:
+            meta = json.load(f)
+        pm = cls(meta['columns'])
+        for g, part in enumerate(meta['partitions']):
+            if part is None:
+                continue
+            cols = np.array([pm.columns.index(c) for c in part['columns']])
+            pm.partitions[g] = (cols,
+                                Preprocessor.load(os.path.join(path, 'preprocessing_jet{}.npz'.format(g))),
+                                NumpyModel.load(os.path.join(path, 'model_jet{}.npz'.format(g))))
+        return pm
+
+
+def is_partitioned(path):
+    return os.path.isfile(os.path.join(path, 'partitions.json'))
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Train one model per jet-multiplicity partition")
+    parser.add_argument('csv', help = "Training events (Kaggle training.csv layout)")
+    parser.add_argument('--out', default = 'partitioned_model')
+    parser.add_argument('--epochs', type = int, default = 20)
+    parser.add_argument('--batch-size', type = int, default = 32)
+    parser.add_argument('--hidden', type = int, nargs = '+', default = [12, 8])
+    parser.add_argument('--test-size', type = float, default = 0.35)
+    parser.add_argument('--random-state', type = int, default = 20)
+    args = parser.parse_args(argv)
+
+    import pandas as pd
+
+    events = load_events(args.csv)
+    train, test = stratified_split(strata(events.label, events.jet_num), args.test_size, args.random_state)
+
+    start = time.time()
+    pm = PartitionedModel().fit(events.features[train], events.jet_num[train], events.label[train], events.weight[train],
+                                epochs = args.epochs, batch_size = args.batch_size, missing = events.missing[train],
+                                hidden = tuple(args.hidden))
+    print("Trained {} partitions in {:.2f} s".format(N_GROUPS, time.time() - start))
+    pm.save(args.out)
+
+    probs = pm.predict(events.features[test], events.jet_num[test])
+    group, y, pred = jet_group(events.jet_num[test]), events.label[test] == 1, probs >= 0.5
+    table = pd.DataFrame(index = GROUP_NAMES, columns = ['Events', 'Columns', 'Multiply-adds per event', 'Precision'])
+    for g, part in enumerate(pm.partitions):
+        in_g = group == g
+        table.loc[GROUP_NAMES[g]] = [int(in_g.sum()), len(part[0]) if part else 0, pm.flops_per_event()[g],
+                                     precision(y[in_g], pred[in_g])]
+    print(table.to_string())
+    best = best_threshold(y, probs, holdout_weights(events.weight[test], y, events.weight, events.label))
+    print(pd.Series({"Held-out precision": "{:.4f}".format(precision(y, pred)),
+                     "Best AMS": "{:.3f} at threshold {:.3f}".format(best['ams'], best['threshold'])}).to_string())
+
+
+if __name__ == '__main__':
+    main()
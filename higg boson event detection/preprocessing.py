@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Fitted preprocessing shared by training and inference.
+#
+# Preprocessor reproduces the modeling steps of the notebook on float32 matrices:
+#   1. -999 (or NaN) replaced by the training mean of the column
+#   2. IQR outlier bounds (q1 - 1.5 iqr, q3 + 1.5 iqr), see iqr_filter()
+#   3. standard scaling with the mean and standard deviation of the kept rows
+# The fitted parameters are contiguous float32 arrays, saved with the model artifacts as an .npz file.
+# fit_streaming() fits the same steps in two passes over a memory-mapped matrix of any size, with the
+# quartiles taken from quantile sketches (iqr_mode = 'sketch').
+
+import numpy as np
+
+from ingest import FEATURES, MISSING
+from instrument import stage, traced
+from sketches import QuantileSketch, iqr_bounds
+from streaming import CHUNK_ROWS, RunningStats, iter_chunk_rows, masked_chunk
+
+IQR_FACTOR = 1.5
+IQR_MODES = ['sequential', 'independent']
+BLOCK_ROWS = 65536
+
+
+# Boolean mask of missing entries (-999 sentinel or NaN)
+def missing_mask(x):
+    return (x == MISSING) | np.isnan(x)
+
+
+# Training mean of every column over its non-missing entries, and the matrix with missing entries set to it
+def impute_mean(x, missing):
+    with np.errstate(invalid = 'ignore'):
+        mean = np.nanmean(np.where(missing, np.nan, x), axis = 0, dtype = np.float64)
+    mean = np.ascontiguousarray(np.nan_to_num(mean), dtype = np.float32)
+    return mean, np.where(missing, mean, x)
+
+
+# IQR outlier bounds of an imputed float32 matrix and the combined row mask, applied once.
+#   'sequential':  quartiles of each column on the rows kept by the previous columns, as in the
+#                  notebook's filter loop; removed[j] counts the rows column j removes from those
+#   'independent': quartiles of all columns in one np.quantile pass over all rows, so the result does not
+#                  depend on the column order; removed[j] counts the rows outside column j's bounds
+# Returns lower, upper, keep, removed.
+def iqr_filter(x, factor = IQR_FACTOR, mode = 'sequential'):
+    if mode not in IQR_MODES:
+        raise ValueError("Unknown IQR mode {!r}, expected one of {}".format(mode, IQR_MODES))
+    n, n_cols = x.shape
+    keep = np.ones(n, dtype = bool)
+    removed = np.zeros(n_cols, dtype = np.int64)
+    if mode == 'independent':
+        q1, q3 = np.quantile(x, [0.25, 0.75], axis = 0).astype(np.float64)
+        lower = (q1 - factor * (q3 - q1)).astype(np.float32)
+        upper = (q3 + factor * (q3 - q1)).astype(np.float32)
+        for j in range(n_cols):
+            inside = (x[:, j] >= lower[j]) & (x[:, j] <= upper[j])
+            removed[j] = n - np.count_nonzero(inside)
+            keep &= inside
+        return lower, upper, keep, removed
+
+    # Bounds are stored as float32 and compared as such, so inlier_mask() reproduces this mask exactly
+    lower, upper = np.empty(n_cols, np.float32), np.empty(n_cols, np.float32)
+    for j in range(n_cols):
+        q1, q3 = np.quantile(x[keep, j], [0.25, 0.75]).astype(np.float64)
+        lower[j], upper[j] = q1 - factor * (q3 - q1), q3 + factor * (q3 - q1)
+        before = np.count_nonzero(keep)
+        keep &= (x[:, j] >= lower[j]) & (x[:, j] <= upper[j])
+        removed[j] = before - np.count_nonzero(keep)
+    return lower, upper, keep, removed
+
+
+# Event weights renormalized per class for training: signal and background each sum to half the number
+# of events, so the classes are balanced and the mean weight stays 1
+def training_weights(weight, y):
+    weight, y = np.asarray(weight, dtype = np.float64), np.asarray(y, dtype = bool)
+    out = np.empty(len(weight), dtype = np.float32)
+    for cls in (False, True):
+        total = weight[y == cls].sum()
+        out[y == cls] = weight[y == cls] * (len(weight) / 2 / total if total else 0.0)
+    return out
+
+
+class Preprocessor:
+    def __init__(self, columns = FEATURES, iqr_factor = IQR_FACTOR, iqr_mode = 'sequential'):
+        self.columns = list(columns)
+        self.iqr_factor = iqr_factor
+        self.iqr_mode = iqr_mode
+        self.mean_ = self.lower_ = self.upper_ = self.center_ = self.scale_ = None
+        self.removed_ = None
+
+    @property
+    def fitted(self):
+        return self.scale_ is not None
+
+    # x: raw float32 matrix (rows x columns) with -999 marking missing values
+    @traced('preprocess_fit')
+    def fit(self, x):
+        if self.iqr_mode == 'sketch':
+            return self.fit_streaming(x)
+        x = np.asarray(x, dtype = np.float32)
+        with stage('impute', rows_in = len(x)):
+            self.mean_, imputed = impute_mean(x, missing_mask(x))
+        with stage('iqr_filter', rows_in = len(x), mode = self.iqr_mode) as s:
+            self.lower_, self.upper_, keep, self.removed_ = iqr_filter(imputed, self.iqr_factor, self.iqr_mode)
+            s.rows_out = int(keep.sum())
+
+        with stage('fit_scaler', rows_in = int(keep.sum())):
+            kept = imputed[keep]
+            center = kept.mean(axis = 0, dtype = np.float64)
+            scale = kept.std(axis = 0, dtype = np.float64)
+        scale[scale == 0] = 1.0
+        self.center_ = np.ascontiguousarray(center, dtype = np.float32)
+        self.scale_ = np.ascontiguousarray(scale, dtype = np.float32)
+        return self
+
+    # Two passes over chunks of a raw (possibly memory-mapped) matrix: column means, missing counts and
+    # quantile sketches first, then the scaler statistics of the rows inside the bounds. The bounds follow
+    # the 'independent' mode, with approximate quartiles; removed_[j] counts rows outside column j's bounds.
+    # `rows` (sorted positions) fits on those rows only.
+    def fit_streaming(self, features, chunk_rows = CHUNK_ROWS, rows = None):
+        with stage('fit_streaming', rows_in = len(features) if rows is None else len(rows)):
+            return self._fit_streaming(features, chunk_rows, rows)
+
+    def _fit_streaming(self, features, chunk_rows, rows):
+        n_cols = features.shape[1]
+        stats = RunningStats(n_cols)
+        sketches = [QuantileSketch() for _ in range(n_cols)]
+        for r in iter_chunk_rows(len(features), chunk_rows, rows):
+            x = masked_chunk(features, r)
+            stats.update(x)
+            for j in range(n_cols):
+                sketches[j].update(x[:, j])
+        self.mean_ = np.ascontiguousarray(stats.mean, dtype = np.float32)
+        n_imputed = stats.rows - stats.count
+        bounds = [iqr_bounds(sketches[j], self.mean_[j], n_imputed[j], self.iqr_factor) for j in range(n_cols)]
+        self.lower_ = np.array([lo for lo, _ in bounds], dtype = np.float32)
+        self.upper_ = np.array([hi for _, hi in bounds], dtype = np.float32)
+
+        kept = RunningStats(n_cols)
+        self.removed_ = np.zeros(n_cols, dtype = np.int64)
+        for r in iter_chunk_rows(len(features), chunk_rows, rows):
+            x = np.asarray(features[r], dtype = np.float32)
+            x = np.where(missing_mask(x), self.mean_, x)
+            inside = (x >= self.lower_) & (x <= self.upper_)
+            self.removed_ += len(x) - inside.sum(axis = 0)
+            kept.update(x[inside.all(axis = 1)])
+        self.center_, self.scale_ = kept.imputed_scaler()
+        self.iqr_mode = 'sketch'
+        return self
+
+    # Rows of x that fall inside the IQR bounds in every column (the training rows the filter keeps)
+    def inlier_mask(self, x):
+        keep = np.ones(len(x), dtype = bool)
+        with stage('inlier_mask', rows_in = len(x)) as s:
+            for i in range(0, len(x), BLOCK_ROWS):
+                xb = np.asarray(x[i:i + BLOCK_ROWS], dtype = np.float32)
+                xb = np.where(missing_mask(xb), self.mean_, xb)
+                keep[i:i + BLOCK_ROWS] = ((xb >= self.lower_) & (xb <= self.upper_)).all(axis = 1)
+            s.rows_out = int(keep.sum())
+        return keep
+
+    # Imputation and scaling fused into one float32 output: x * a + b, with missing entries set to the
+    # scaled training mean. Works block by block so temporaries stay small; `out` may be preallocated.
+    def transform(self, x, out = None):
+        a = (1.0 / self.scale_).astype(np.float32)
+        b = (-self.center_ * a).astype(np.float32)
+        fill = ((self.mean_ - self.center_) * a).astype(np.float32)
+        if out is None:
+            out = np.empty((len(x), len(self.columns)), dtype = np.float32)
+        for i in range(0, len(x), BLOCK_ROWS):
+            xb = np.asarray(x[i:i + BLOCK_ROWS], dtype = np.float32)
+            ob = out[i:i + BLOCK_ROWS]
+            np.multiply(xb, a, out = ob)
+            ob += b
+            np.copyto(ob, np.broadcast_to(fill, ob.shape), where = missing_mask(xb))
+        return out
+
+    def fit_transform(self, x):
+        return self.fit(x).transform(x)
+
+    # Fitted parameters as named arrays (the .npz layout, also stored by the stage cache)
+    def to_arrays(self):
+        arrays = {'columns': np.array(self.columns), 'iqr_factor': np.float32(self.iqr_factor), 'iqr_mode': np.array(self.iqr_mode),
+                  'mean': self.mean_, 'lower': self.lower_, 'upper': self.upper_, 'center': self.center_, 'scale': self.scale_}
+        if self.removed_ is not None:
+            arrays['removed'] = self.removed_
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, f):
+        prep = cls(columns = np.asarray(f['columns']).tolist(), iqr_factor = float(f['iqr_factor']),
+                   iqr_mode = str(f['iqr_mode']) if 'iqr_mode' in f else 'sequential')
+        prep.mean_, prep.lower_, prep.upper_ = np.array(f['mean']), np.array(f['lower']), np.array(f['upper'])
+        prep.center_, prep.scale_ = np.array(f['center']), np.array(f['scale'])
+        if 'removed' in f:
+            prep.removed_ = np.array(f['removed'])
+        return prep
+
+    def save(self, path):
+        np.savez(path, **self.to_arrays())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls.from_arrays(f)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Post-training int8 quantization of the dense classifier, scored on float16 activations.
+#
+#   python quantized.py trained_model --output trained_model_int8.npz                        # export
+#   python quantized.py trained_model.npz --output trained_model_int8.npz --validate training.csv
+#   python score.py test.csv --model trained_model_int8.npz
+#
+# Every Dense kernel is stored as int8, with one float32 scale per output channel (symmetric: scale =
+# max |w| / 127 over the channel). Biases stay float32. The file is about a third of the float32 export.
+#
+# Scoring is limited by memory bandwidth, not by the few hundred weights. At load, the channel scales are
+# folded into the kernels (int8 x scale, once), so every layer is one float32 GEMM with no per-layer
+# quantization pass. The activations that travel through memory, the input batches, can be float16: half
+# the bytes per event of float32. They are widened to float32 in cache-sized blocks of rows, and the
+# hidden activations of a block stay in cache. float32 inputs are used in place, at the speed of the
+# float32 NumpyModel, and that is what score.py and serve.py pass. NumPy's float16 conversion is slower
+# than the GEMM it feeds, so float16 inputs pay off where memory is the limit (preprocessed batches kept
+# or shipped at scale), not in events/s here; --validate measures both.
+#
+# --validate scores the held-out split of a training file (stratified as in split.py) with the float32
+# model and with the int8 model on float16 inputs. Both use the same preprocessing (preprocessing.npz
+# next to the source model). It reports the probability drift, the precision, the agreement of the 0.5
+# decisions and the best AMS, followed by the measured events/s and bytes/event of both models, alone and
+# end to end.
+
+import argparse
+
+import numpy as np
+
+from numpy_model import ACTIVATIONS, NumpyModel, activate, read_dense_weights
+
+BLOCK_ROWS = 8192
+QMAX = 127
+
+
+# int8 kernel and per-output-channel float32 scales of a float kernel (inputs x outputs)
+def quantize_kernel(w):
+    w = np.asarray(w, dtype = np.float32)
+    scale = np.abs(w).max(axis = 0) / QMAX
+    scale[scale == 0] = 1.0
+    q = np.clip(np.rint(w / scale), -QMAX, QMAX).astype(np.int8)
+    return q, scale.astype(np.float32)
+
+
+class QuantizedModel:
+    def __init__(self, qweights, scales, biases, activations, block_rows = BLOCK_ROWS):
+        self.qweights = [np.ascontiguousarray(q, dtype = np.int8) for q in qweights]
+        self.scales = [np.ascontiguousarray(s, dtype = np.float32) for s in scales]
+        self.biases = [np.ascontiguousarray(b, dtype = np.float32) for b in biases]
+        self.activations = list(activations)
+        self.block_rows = block_rows
+        # int8 kernels with their channel scales folded in, for one GEMM per layer
+        self.kernels = [q * s for q, s in zip(self.qweights, self.scales)]
+        # float32 block of widened float16 inputs and the per-layer outputs; not thread-safe
+        self.block = np.empty((block_rows, self.qweights[0].shape[0]), dtype = np.float32)
+        self.outputs = [np.empty((block_rows, q.shape[1]), dtype = np.float32) for q in self.qweights]
+
+    @classmethod
+    def from_numpy_model(cls, model, **kwargs):
+        quantized = [quantize_kernel(w) for w in model.weights]
+        return cls([q for q, _ in quantized], [s for _, s in quantized], model.biases, model.activations, **kwargs)
+
+    def save(self, path):
+        arrays = {}
+        for i, (q, s, b) in enumerate(zip(self.qweights, self.scales, self.biases)):
+            arrays['Q{}'.format(i)], arrays['S{}'.format(i)], arrays['b{}'.format(i)] = q, s, b
+        np.savez(path, activations = np.array(self.activations), **arrays)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with np.load(path) as f:
+            activations = f['activations'].tolist()
+            n = len(activations)
+            return cls([f['Q{}'.format(i)] for i in range(n)], [f['S{}'.format(i)] for i in range(n)],
+                       [f['b{}'.format(i)] for i in range(n)], activations, **kwargs)
+
+    @property
+    def nbytes(self):
+        return sum(q.nbytes + s.nbytes + b.nbytes for q, s, b in zip(self.qweights, self.scales, self.biases))
+
+    # Float32 model with the dequantized kernels (weight quantization only, for comparison)
+    def dequantized(self):
+        return NumpyModel(self.kernels, self.biases, self.activations)
+
+    # Signal probabilities (rows,) for a preprocessed batch (rows x inputs), float16 or float32
+    def predict(self, x):
+        x = np.asarray(x)
+        probs = np.empty(len(x), dtype = np.float32)
+        for i in range(0, len(x), self.block_rows):
+            a = x[i:i + self.block_rows]
+            rows = len(a)
+            if a.dtype != np.float32:
+                np.copyto(self.block[:rows], a)
+                a = self.block[:rows]
+            for w, b, act, out in zip(self.kernels, self.biases, self.activations, self.outputs):
+                a = np.matmul(a, w, out = out[:rows])
+                a += b
+                activate(a, act)
+            probs[i:i + rows] = a[:, 0]
+        return probs
+
+    __call__ = predict
+
+
+def is_quantized(path):
+    with np.load(path) as f:
+        return 'Q0' in f.files
+
+
+# Float32 NumpyModel of a SavedModel directory, a Keras/joblib file or an exported .npz
+def load_float_model(path, activations = ACTIVATIONS):
+    if path.endswith('.npz'):
+        return NumpyModel.load(path)
+    layers = read_dense_weights(path)
+    return NumpyModel([w for w, _ in layers], [b for _, b in layers], activations)
+
+
+# Probability drift, precision, decision agreement and best AMS of the quantized model against the float32
+# model on preprocessed held-out events
+def validate(float_model, qmodel, x, y, weight):
+    from metrics import best_threshold, precision
+
+    p32 = float_model.predict(x)
+    pq = qmodel.predict(x.astype(np.float16))
+    diff = np.abs(pq - p32)
+    best32, bestq = best_threshold(y, p32, weight), best_threshold(y, pq, weight)
+    return {'events': len(x), 'max_abs_diff': float(diff.max()), 'mean_abs_diff': float(diff.mean()),
+            'precision_float32': precision(y, p32 >= 0.5), 'precision_int8': precision(y, pq >= 0.5),
+            'decision_agreement': float(np.mean((p32 >= 0.5) == (pq >= 0.5))),
+            'best_ams_float32': float(best32['ams']), 'best_ams_int8': float(bestq['ams'])}
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Quantize the dense model to int8 and validate it")
+    parser.add_argument('model', help = "Float32 model: SavedModel directory, .keras, .joblib, .pkl or exported .npz")
+    parser.add_argument('--output', default = 'trained_model_int8.npz')
+    parser.add_argument('--activations', nargs = '+', default = ACTIVATIONS)
+    parser.add_argument('--validate', default = None, metavar = 'CSV', help = "Training events: validate and benchmark on the held-out split")
+    parser.add_argument('--preprocessing', default = None, help = "Fitted preprocessing (default: preprocessing.npz next to the model)")
+    parser.add_argument('--test-size', type = float, default = 0.35)
+    parser.add_argument('--random-state', type = int, default = 20)
+    parser.add_argument('--batch-size', type = int, default = 65536)
+    parser.add_argument('--repeat', type = int, default = 5)
+    args = parser.parse_args(argv)
+
+    float_model = load_float_model(args.model, args.activations)
+    qmodel = QuantizedModel.from_numpy_model(float_model)
+    qmodel.save(args.output)
+    print("Quantized {} Dense layers: {} bytes of weights (float32: {}) written to {}".format(
+        len(qmodel.qweights), qmodel.nbytes, float_model.nbytes, args.output))
+    if not args.validate:
+        return
+
+    import pandas as pd
+
+    from benchmark import throughput
+    from ingest import load_events
+    from metrics import holdout_weights
+    from preprocessing import Preprocessor
+    from score import preprocessing_path_for, score_events
+    from split import strata, stratified_split
+
+    preprocessor = Preprocessor.load(args.preprocessing or preprocessing_path_for(args.model))
+    events = load_events(args.validate)
+    _, test = stratified_split(strata(events.label, events.jet_num), args.test_size, args.random_state)
+    y = events.label[test] == 1
+    x = preprocessor.transform(events.features[test])
+    print(pd.Series(validate(float_model, qmodel, x, y, holdout_weights(events.weight[test], y, events.weight, events.label))).to_string())
+
+    x16 = x.astype(np.float16)
+    raw = np.ascontiguousarray(events.features)
+    rows = {}
+    for name, model, xm in [('float32', float_model, x), ('int8, float32 input', qmodel, x), ('int8, float16 input', qmodel, x16)]:
+        rows[name] = {'model events/s': throughput(model.predict, xm, repeat = args.repeat),
+                      'model bytes/event': xm.shape[1] * xm.itemsize + 4,
+                      'weight bytes': model.nbytes}
+        if xm is not x16:
+            rows[name]['end-to-end events/s'] = throughput(lambda f: score_events(f, model.predict, preprocessor, args.batch_size),
+                                                           raw, repeat = args.repeat)
+    table = pd.DataFrame(rows).T
+    print(table.to_string(float_format = '{:,.0f}'.format))
+
+
+if __name__ == '__main__':
+    main()
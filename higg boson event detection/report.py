@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Headless EDA report: the figures of the notebook written to PNG (matplotlib, Agg backend) and HTML
+# (plotly) files, with an index.html, without Jupyter or a display.
+#
+#   python report.py training.csv --out report --workers 8 --max-points 20000
+#
+# The events are read twice from the column cache (ingest.py), chunk by chunk. The first pass fills the
+# sketches, the moment and correlation accumulators and the category counts; the second fills the 2D
+# histograms of the bivariate plots (on the range of the sketches) and draws a uniform random sample of at
+# most --max-points events per class for the 3D plots. Figures are then drawn from these summaries only, on
+# a pool of worker processes, so the rendering time does not depend on the number of events: a 2D histogram
+# keeps the density of a scatter plot at a fixed resolution, and a uniform sample keeps its shape.
+
+import argparse
+import concurrent.futures
+import html
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from eda_stats import SUBSETS, CorrAccumulator, MomentAccumulator, corr_frames, corr_table, eda_tables
+from ingest import CHUNK_ROWS, FEATURES, FLOAT_FEATURES, JET_NUM, MISSING, load_events
+from instrument import stage, traced
+from sketches import EventSketches, plot_histograms
+from split import strata, stratified_split
+
+MAX_POINTS = 20_000
+PAIR_BINS = 200
+PAIR_RANGE = (0.001, 0.999)  # quantiles bounding the 2D histograms
+CLASSES = ["Background events", "Signal events"]
+
+PAIRS = [
+    ('DER_mass_MMC', 'DER_mass_jet_jet'),
+    ('DER_mass_MMC', 'DER_prodeta_jet_jet'),
+    ('DER_deltaeta_jet_jet', 'DER_prodeta_jet_jet'),
+    ('DER_mass_jet_jet', 'DER_deltar_tau_lep'),
+    ('DER_mass_jet_jet', 'PRI_jet_leading_eta'),
+    ('DER_prodeta_jet_jet', 'PRI_jet_leading_eta'),
+    ('PRI_tau_eta', 'PRI_lep_eta'),
+    ('PRI_jet_num', 'PRI_jet_subleading_pt')
+]
+
+TRIPLES = [
+    ('DER_mass_MMC', 'DER_mass_transverse_met_lep', 'DER_pt_tot'),
+    ('DER_mass_MMC', 'DER_mass_vis', 'DER_prodeta_jet_jet'),
+    ('DER_mass_MMC', 'DER_mass_vis', 'DER_pt_tot'),
+    ('DER_mass_MMC', 'DER_mass_vis', 'PRI_lep_pt'),
+    ('DER_mass_MMC', 'DER_pt_h', 'DER_pt_tot'),
+    ('DER_mass_MMC', 'DER_pt_h', 'PRI_jet_subleading_pt'),
+    ('DER_mass_MMC', 'DER_deltaeta_jet_jet', 'PRI_jet_num'),
+    ('DER_mass_MMC', 'DER_mass_jet_jet', 'PRI_jet_subleading_eta'),
+    ('DER_mass_MMC', 'DER_prodeta_jet_jet', 'DER_pt_tot'),
+    ('DER_mass_MMC', 'DER_lep_eta_centrality', 'PRI_met'),
+    ('DER_mass_MMC', 'DER_lep_eta_centrality', 'PRI_jet_num'),
+    ('DER_mass_MMC', 'PRI_met_phi', 'PRI_jet_subleading_pt'),
+    ('DER_mass_MMC', 'PRI_jet_num', 'PRI_jet_leading_pt'),
+    ('DER_mass_vis', 'DER_pt_h', 'PRI_jet_leading_pt'),
+    ('DER_pt_h', 'PRI_jet_num', 'PRI_jet_leading_eta'),
+    ('DER_deltaeta_jet_jet', 'DER_prodeta_jet_jet', 'PRI_jet_subleading_eta'),
+    ('DER_deltaeta_jet_jet', 'DER_prodeta_jet_jet', 'PRI_jet_subleading_phi'),
+    ('DER_deltaeta_jet_jet', 'DER_prodeta_jet_jet', 'PRI_jet_all_pt'),
+    ('DER_deltaeta_jet_jet', 'DER_met_phi_centrality', 'PRI_jet_num'),
+    ('DER_mass_jet_jet', 'DER_deltar_tau_lep', 'PRI_lep_pt'),
+    ('DER_mass_jet_jet', 'PRI_tau_pt', 'PRI_jet_subleading_eta'),
+    ('DER_prodeta_jet_jet', 'DER_sum_pt', 'PRI_jet_all_pt'),
+    ('DER_mass_jet_jet', 'PRI_jet_leading_eta', 'PRI_jet_subleading_eta'),
+    ('DER_deltar_tau_lep', 'PRI_lep_eta', 'PRI_jet_subleading_pt'),
+    ('DER_pt_ratio_lep_tau', 'PRI_jet_num', 'PRI_jet_leading_pt'),
+    ('DER_met_phi_centrality', 'DER_lep_eta_centrality', 'PRI_jet_num'),
+    ('DER_met_phi_centrality', 'PRI_lep_eta', 'PRI_jet_num')
+]
+
+
+# Sorted indices of a uniform random sample of at most max_points of n rows
+def downsample(n, max_points = MAX_POINTS, rng = None):
+    if n <= max_points:
+        return np.arange(n)
+    rng = np.random.default_rng(0) if rng is None else rng
+    return np.sort(rng.choice(n, max_points, replace = False))
+
+
+# Bin edges of a column for the 2D histograms: unit bins for the jet multiplicity, else `bins` equal bins
+# between two quantiles of the column's sketch
+def pair_edges(sketches, col, groups = (0, 1), bins = PAIR_BINS):
+    if col == JET_NUM:
+        return np.arange(-0.5, 4.5)
+    lo, hi = sketches.column_sketch(col, groups).quantile(list(PAIR_RANGE))
+    if not hi > lo:
+        lo, hi = lo - 0.5, hi + 0.5
+    return np.linspace(lo, hi, bins + 1)
+
+
+# 2D histogram of (x, y) on equal-width edges; pairs with a missing value (-999 or NaN) or outside the
+# edges are left out
+def pair_counts(x, y, xedges, yedges):
+    x, y = np.asarray(x, dtype = np.float64), np.asarray(y, dtype = np.float64)
+    nx, ny = len(xedges) - 1, len(yedges) - 1
+    with np.errstate(invalid = 'ignore'):
+        ix = np.floor((x - xedges[0]) / (xedges[-1] - xedges[0]) * nx)
+        iy = np.floor((y - yedges[0]) / (yedges[-1] - yedges[0]) * ny)
+        ok = (x != MISSING) & (y != MISSING) & (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    flat = ix[ok].astype(np.intp) * ny + iy[ok].astype(np.intp)
+    return np.bincount(flat, minlength = nx * ny).reshape(nx, ny).astype(np.float64)
+
+
+# Bivariate plot of a pair of features per class, from 2D histograms (counts[c] is nx x ny) on a log scale
+def plot_pair(counts, xedges, yedges, names, titles = CLASSES):
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LogNorm
+
+    fig, ax = plt.subplots(1, 2, figsize = (15, 6), sharex = True, sharey = True)
+    for a, c, title in zip(ax, counts, titles):
+        mesh = a.pcolormesh(xedges, yedges, np.ma.masked_equal(c.T, 0), norm = LogNorm(vmin = 1, vmax = max(c.max(), 1)),
+                            cmap = 'viridis', rasterized = True)
+        fig.colorbar(mesh, ax = a, label = "Events")
+        a.set_title(title, fontsize = 14)
+        a.set_xlabel(names[0])
+    ax[0].set_ylabel(names[1])
+    plt.tight_layout()
+    return fig
+
+
+# Trivariate plot of a triple of features per class, from (sampled) points; colored by the second feature
+def plot_triple(points, names, titles = CLASSES):
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize = (15, 9))
+    for i, (p, title) in enumerate(zip(points, titles)):
+        p = np.where(p == MISSING, np.nan, p)
+        ax = fig.add_subplot(1, 2, i + 1, projection = '3d')
+        ax.scatter(p[:, 0], p[:, 1], p[:, 2], s = 8, marker = 'o', c = p[:, 1], alpha = 1)
+        ax.set_title(title, fontsize = 14)
+        ax.set_xlabel(names[0])
+        ax.set_ylabel(names[1])
+        ax.set_zlabel(names[2])
+    plt.tight_layout()
+    return fig
+
+
+# Side by side kernel density plots of two columns of a small table (skewness, kurtosis, correlations)
+def plot_kde_pair(df, cols, titles, xlabel, suptitle, clip = None):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    fig, ax = plt.subplots(1, 2, figsize = (15, 6), sharex = True, sharey = True)
+    for a, col, title in zip(ax, cols, titles):
+        sns.kdeplot(data = df, x = col, ax = a, **({} if clip is None else {'clip': clip}))
+        a.set_title(title, fontsize = 14)
+        a.set_xlabel(xlabel, fontsize = 14)
+    plt.suptitle(suptitle, fontsize = 14)
+    plt.tight_layout()
+    return fig
+
+
+def plot_heatmap(corr):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    fig = plt.figure(figsize = (26, 19.5))
+    sns.heatmap(corr, vmin = -1, vmax = 1, annot = True, cmap = plt.cm.CMRmap_r)
+    return fig
+
+
+def plot_heatmap_pair(corrs, suptitle, titles = CLASSES):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    fig, ax = plt.subplots(1, 2, figsize = (15, 6.5), sharex = True, sharey = True)
+    for a, corr, title in zip(ax, corrs, titles):
+        sns.heatmap(corr, vmin = -1, vmax = 1, annot = False, xticklabels = False, yticklabels = False, cmap = plt.cm.CMRmap_r, ax = a)
+        a.set_title(title, fontsize = 14)
+    plt.suptitle(suptitle, fontsize = 14)
+    plt.tight_layout()
+    return fig
+
+
+# Barplot and donutplot of the value counts of a column (plotly)
+def bar_donut(counts, col, h = 500, w = 800):
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    fig = make_subplots(rows = 1, cols = 2, specs = [[{'type': 'xy'}, {'type': 'domain'}]])
+    x_val, y_val = counts.index.tolist(), counts.tolist()
+    fig.add_trace(go.Bar(x = x_val, y = y_val, text = y_val, textposition = 'auto'), row = 1, col = 1)
+    fig.add_trace(go.Pie(values = y_val, labels = x_val, hole = 0.5, textinfo = 'label+percent', title = f"{col}"), row = 1, col = 2)
+    fig.update_layout(height = h, width = w, showlegend = False, xaxis = dict(tickmode = 'linear', tick0 = 0, dtick = 1),
+                      title = dict(text = f"Frequency distribution of {col}", x = 0.5, y = 0.95))
+    return fig
+
+
+# Two donutplots comparing the value counts of a column in two subsets (plotly)
+def donut(counts1, counts2, text1, text2, title_text):
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    fig = make_subplots(rows = 1, cols = 2, specs = [[{'type': 'domain'}, {'type': 'domain'}]])
+    for i, (counts, text) in enumerate([(counts1, text1), (counts2, text2)]):
+        fig.add_trace(go.Pie(labels = counts.index, values = counts, legendgroup = "group", textinfo = 'percent', hole = 0.3,
+                             title = dict(text = text)), row = 1, col = i + 1)
+    fig.update_layout(title = dict(text = title_text, y = 0.9, x = 0.5, xanchor = 'center', yanchor = 'top'))
+    return fig
+
+
+PLOTS = {'histograms': plot_histograms, 'pair': plot_pair, 'triple': plot_triple, 'kde_pair': plot_kde_pair,
+         'heatmap': plot_heatmap, 'heatmap_pair': plot_heatmap_pair, 'bar_donut': bar_donut, 'donut': donut}
+PLOTLY = {'bar_donut', 'donut'}
+
+
+# Everything the figures are drawn from, in two chunked passes over the events (memory-mapped cache)
+@traced('report_collect')
+def collect(events, is_test, max_points = MAX_POINTS, bins = PAIR_BINS, seed = 0, chunk_rows = CHUNK_ROWS):
+    features, label = events.features, events.label
+    float_idx = [FEATURES.index(c) for c in FLOAT_FEATURES]
+    sketches = EventSketches()
+    acc_train, acc_test = MomentAccumulator(len(FEATURES), 2, track_unique = False), MomentAccumulator(len(FEATURES), track_unique = False)
+    corr_train, corr_test = CorrAccumulator(len(float_idx), 2), CorrAccumulator(len(float_idx))
+    jet_counts = np.zeros((3, 4), np.int64)
+    for i in range(0, len(events), chunk_rows):
+        x, t = np.asarray(features[i:i + chunk_rows]), is_test[i:i + chunk_rows]
+        groups = np.where(t, 2, label[i:i + chunk_rows]).astype(np.int64)
+        sketches.update(x, groups)
+        acc_train.update(x[~t], groups[~t])
+        acc_test.update(x[t])
+        corr_train.update(x[~t][:, float_idx], groups[~t])
+        corr_test.update(x[t][:, float_idx])
+        np.add.at(jet_counts, (groups, events.jet_num[i:i + chunk_rows]), 1)
+
+    edges = {col: pair_edges(sketches, col, bins = bins) for pair in PAIRS for col in pair}
+    pair_hist = {pair: np.zeros((2, len(edges[pair[0]]) - 1, len(edges[pair[1]]) - 1)) for pair in PAIRS}
+    triple_idx = [[FEATURES.index(c) for c in triple] for triple in TRIPLES]
+    triple_cols = sorted({j for idx in triple_idx for j in idx})
+    n_class = jet_counts[:2].sum(axis = 1)
+    # a few standard deviations above max_points, so the Bernoulli draw rarely falls short
+    keep_p = np.minimum(1.0, (max_points + 4 * np.sqrt(max_points)) / np.maximum(n_class, 1))
+    rng = np.random.default_rng(seed)
+    samples = [[], []]
+    for i in range(0, len(events), chunk_rows):
+        x, t = np.asarray(features[i:i + chunk_rows]), is_test[i:i + chunk_rows]
+        y = label[i:i + chunk_rows]
+        sampled = ~t & (rng.random(len(x)) < keep_p[y])
+        for c in range(2):
+            xc = x[~t & (y == c)]
+            for a, b in PAIRS:
+                pair_hist[a, b][c] += pair_counts(xc[:, FEATURES.index(a)], xc[:, FEATURES.index(b)], edges[a], edges[b])
+            samples[c].append(x[sampled & (y == c)][:, triple_cols])
+    # cut down to max_points by a uniform subsample, not by keeping the first rows (which come from early chunks)
+    samples = [s[downsample(len(s), max_points, rng)] for s in map(np.concatenate, samples)]
+
+    df_skew, df_kurt, df_minus_999, _ = eda_tables(acc_train, acc_test)
+    corr_b, corr_s, corr_all, corr_t = corr_frames(corr_train, corr_test)
+    jet_index = pd.Index(range(4), name = JET_NUM)
+    return {'sketches': sketches, 'df_skew': df_skew, 'df_kurt': df_kurt, 'df_minus_999': df_minus_999,
+            'corr': [corr_b, corr_s, corr_all, corr_t], 'df_corr': corr_table([corr_b, corr_s, corr_all, corr_t]),
+            'edges': edges, 'pair_hist': pair_hist,
+            'triples': {triple: [s[:, [triple_cols.index(j) for j in idx]] for s in samples] for triple, idx in zip(TRIPLES, triple_idx)},
+            'label_counts': pd.Series(n_class, index = ['b', 's']),
+            'jet_counts': [pd.Series(counts, index = jet_index) for counts in [jet_counts[:2].sum(axis = 0), jet_counts[2], jet_counts[0], jet_counts[1]]]}
+
+
+# (file name, title, plot, keyword arguments) of every figure of the report, in notebook order
+def figure_jobs(summary):
+    sk, corr = summary['sketches'], summary['corr']
+    kde = lambda df, what, cols, titles, suptitle, clip = None: {'df': df, 'cols': cols, 'titles': titles, 'xlabel': what,
+                                                                  'suptitle': suptitle, 'clip': clip}
+    by_set, by_class = [SUBSETS[2], SUBSETS[3]], [SUBSETS[0], SUBSETS[1]]
+    jobs = [
+        ('label', "Target variable", 'bar_donut', {'counts': summary['label_counts'], 'col': 'Label'}),
+        ('hist_train_test', "Distributions of the float features", 'histograms',
+         {'sketches': sk, 'cols': FLOAT_FEATURES, 'groups': [[0, 1], 2], 'labels': ["Train", "Test"], 'colors': ['grey', 'red']}),
+        ('hist_target', "Distributions of the float features in the training set by target class", 'histograms',
+         {'sketches': sk, 'cols': FLOAT_FEATURES, 'groups': [0, 1], 'labels': ["b", "s"], 'colors': ['red', 'grey']}),
+        ('skew', "Skewness of float features", 'kde_pair',
+         kde(summary['df_skew'], "Skewness", by_set, ["Training set", "Test set"], "Skewness of float features")),
+        ('skew_target', "Skewness by target class", 'kde_pair',
+         kde(summary['df_skew'], "Skewness", by_class, CLASSES, "Skewness of float features in the training set by target class")),
+        ('kurt', "Kurtosis of float features", 'kde_pair',
+         kde(summary['df_kurt'], "Kurtosis", by_set, ["Training set", "Test set"], "Kurtosis of float features")),
+        ('kurt_target', "Kurtosis by target class", 'kde_pair',
+         kde(summary['df_kurt'], "Kurtosis", by_class, CLASSES, "Kurtosis of float features in the training set by target class")),
+        ('jet_num', "Frequency comparison of PRI_jet_num", 'donut',
+         {'counts1': summary['jet_counts'][0], 'counts2': summary['jet_counts'][1], 'text1': 'Train', 'text2': 'Test',
+          'title_text': "Frequency comparison of PRI_jet_num"}),
+        ('jet_num_target', "Frequency comparison of PRI_jet_num by target class", 'donut',
+         {'counts1': summary['jet_counts'][2], 'counts2': summary['jet_counts'][3], 'text1': 'Background', 'text2': 'Signal',
+          'title_text': "Frequency comparison of PRI_jet_num in the training set by target class"}),
+        ('corr', "Correlation coefficient of float features", 'kde_pair',
+         kde(summary['df_corr'], "Correlation coefficient", by_set, ["Training set", "Test set"], "Correlation coefficient of float features", (-1.0, 1.0))),
+        ('corr_heatmap_train', "Correlation heatmap of float features for the training set", 'heatmap', {'corr': corr[2]}),
+        ('corr_heatmap_test', "Correlation heatmap of float features for the test set", 'heatmap', {'corr': corr[3]}),
+        ('corr_target', "Correlation coefficient by target class", 'kde_pair',
+         kde(summary['df_corr'], "Correlation coefficient", by_class, CLASSES,
+             "Correlation coefficient of pairs of float features by target class in the training set", (-1.0, 1.0))),
+        ('corr_heatmap_target', "Correlation heatmaps by target class", 'heatmap_pair',
+         {'corrs': corr[:2], 'suptitle': "Correlation heatmap of float features for background events and signal events in the training set"}),
+    ]
+    for k, (a, b) in enumerate(PAIRS):
+        jobs.append(('pair_{:02d}'.format(k), "{} vs {}".format(a, b), 'pair',
+                     {'counts': summary['pair_hist'][a, b], 'xedges': summary['edges'][a], 'yedges': summary['edges'][b], 'names': (a, b)}))
+    for k, triple in enumerate(TRIPLES):
+        jobs.append(('triple_{:02d}'.format(k), ", ".join(triple), 'triple', {'points': summary['triples'][triple], 'names': triple}))
+    return jobs
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+    import seaborn as sns
+    sns.set_theme()
+
+
+# Draw one figure and write it to out_dir (PNG for matplotlib, HTML for plotly); returns the file name and
+# the seconds it took
+def render(job, out_dir, dpi = 100):
+    name, _, plot, kwargs = job
+    start = time.perf_counter()
+    fig = PLOTS[plot](**kwargs)
+    if plot in PLOTLY:
+        path = name + '.html'
+        fig.write_html(os.path.join(out_dir, path), include_plotlyjs = 'cdn')
+    else:
+        import matplotlib.pyplot as plt
+        path = name + '.png'
+        fig.savefig(os.path.join(out_dir, path), dpi = dpi)
+        plt.close(fig)
+    return path, time.perf_counter() - start
+
+
+# Render every job on `workers` processes (1 = in this process); returns {name: (file, seconds)}
+def render_all(jobs, out_dir, workers = None, dpi = 100):
+    os.makedirs(out_dir, exist_ok = True)
+    workers = workers or os.cpu_count()
+    with stage('report_render', rows_in = len(jobs), workers = workers):
+        if workers == 1:
+            _init_worker()
+            return {job[0]: render(job, out_dir, dpi) for job in jobs}
+        context = multiprocessing.get_context('spawn')
+        with concurrent.futures.ProcessPoolExecutor(workers, mp_context = context, initializer = _init_worker) as pool:
+            futures = {job[0]: pool.submit(render, job, out_dir, dpi) for job in jobs}
+            return {name: f.result() for name, f in futures.items()}
+
+
+def write_index(out_dir, jobs, files, summary, source):
+    parts = ['<!DOCTYPE html>', '<html><head><meta charset="utf-8"><title>Higgs boson EDA report</title></head><body>',
+             '<h1>Higgs boson EDA report</h1>', '<p>{}</p>'.format(html.escape(source))]
+    for caption, df in [("Skewness of the float features", summary['df_skew']), ("Kurtosis of the float features", summary['df_kurt']),
+                        ("Proportion of the value -999 in the dataset columns which contain -999", summary['df_minus_999'])]:
+        parts += ['<h2>{}</h2>'.format(caption), df.to_html(float_format = '{:.4f}'.format)]
+    for name, title, plot, _ in jobs:
+        path = files[name][0]
+        parts.append('<h2>{}</h2>'.format(html.escape(title)))
+        if plot in PLOTLY:
+            parts.append('<iframe src="{}" width="850" height="520" frameborder="0"></iframe>'.format(path))
+        else:
+            parts.append('<img src="{}" style="max-width: 100%">'.format(path))
+    parts.append('</body></html>')
+    path = os.path.join(out_dir, 'index.html')
+    with open(path, 'w') as f:
+        f.write('\n'.join(parts))
+    return path
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Write the EDA figures to PNG/HTML files without a display")
+    parser.add_argument('csv', help = "Training events (Kaggle training.csv layout)")
+    parser.add_argument('--out', default = 'report')
+    parser.add_argument('--workers', type = int, default = 0, help = "Rendering processes (0 = all cores)")
+    parser.add_argument('--max-points', type = int, default = MAX_POINTS, help = "Sampled events per class in the 3D plots")
+    parser.add_argument('--bins', type = int, default = PAIR_BINS, help = "Bins per axis of the bivariate 2D histograms")
+    parser.add_argument('--dpi', type = int, default = 100)
+    parser.add_argument('--test-size', type = float, default = 0.35)
+    parser.add_argument('--random-state', type = int, default = 20)
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    events = load_events(args.csv)
+    # the notebook's train/test split (stratified by Label and PRI_jet_num, see split.py)
+    is_test = np.zeros(len(events), dtype = bool)
+    is_test[stratified_split(strata(events.label, events.jet_num), args.test_size, args.random_state)[1]] = True
+    summary = collect(events, is_test, args.max_points, args.bins, args.random_state)
+    collected = time.time()
+    jobs = figure_jobs(summary)
+    files = render_all(jobs, args.out, args.workers, args.dpi)
+    index = write_index(args.out, jobs, files, summary, "{} ({:,} events)".format(os.path.abspath(args.csv), len(events)))
+    slowest = max(files.items(), key = lambda item: item[1][1])
+    print(pd.Series({"Events": len(events),
+                     "Summary passes": "{:.2f} s".format(collected - start),
+                     "Rendering": "{:.2f} s ({} figures, {} workers)".format(time.time() - collected, len(files), args.workers or os.cpu_count()),
+                     "Slowest figure": "{} ({:.2f} s)".format(*slowest[1]),
+                     "Report": index}).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Batch scoring of an event file with the saved model, written in the Kaggle submission format
+# (EventId,RankOrder,Class; RankOrder 1 is the most background-like event).
+#
+#   python score.py test.csv --model trained_model --output submission.csv --batch-size 65536 --threads 8
+#
+# The model is loaded once, the events are memory-mapped from the columnar cache (see ingest.py) and
+# pushed through the fitted preprocessing (preprocessing.npz) one large batch at a time. A directory written
+# by partitioned.py is scored per jet-multiplicity partition and carries its own preprocessing, as does the
+# fold ensemble of cv.py; the gradient-boosted trees of gbt.py run on the raw features.
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from ingest import load_events
+from instrument import stage, traced
+from partitioned import PartitionedModel, is_partitioned
+from preprocessing import Preprocessor
+
+BATCH_SIZE = 65536
+WRITE_ROWS = 1_000_000
+
+
+# Limit the CPU threads used by TensorFlow; must run before the first TensorFlow operation
+def set_threads(threads):
+    if not threads:
+        return
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(min(threads, 2))
+
+
+# Context limiting the BLAS and OpenMP thread pools (NumPy models, the int8 path, the GBT pipeline, the cv.py
+# ensemble) to `threads`; no limit when 0
+def thread_limits(threads):
+    from threadpoolctl import threadpool_limits
+    return threadpool_limits(limits = threads or None)
+
+
+# Callable mapping a preprocessed float32 batch (rows x 30) to signal probabilities (rows,).
+# Accepts a SavedModel directory (trained_model/), a .keras file, a pickled/joblib model, or the
+# exported .npz weights (float32, see numpy_model.py, or int8, see quantized.py), which are run with NumPy
+# only. For a scikit-learn model (see gbt.py) or the fold ensemble of cv.py, which carries its own
+# preprocessing, the callable takes raw features and has raw_features = True.
+def load_predictor(path):
+    if path.endswith('.npz'):
+        from quantized import QuantizedModel, is_quantized
+        if is_quantized(path):
+            return QuantizedModel.load(path).predict
+        from numpy_model import NumpyModel
+        return NumpyModel.load(path).predict
+
+    from cv import CVEnsemble, is_cv_ensemble
+    if is_cv_ensemble(path):
+        ensemble = CVEnsemble.load(path)
+
+        def predict(x):
+            return ensemble.predict(x)
+        predict.raw_features = True
+        return predict
+
+    if os.path.isdir(path):
+        import tensorflow as tf
+        signature = tf.saved_model.load(path).signatures['serving_default']
+        name = list(signature.structured_input_signature[1])[0]
+
+        def predict(x):
+            out = signature(**{name: tf.constant(x)})
+            return next(iter(out.values())).numpy().reshape(-1)
+        return predict
+
+    if path.endswith('.keras') or path.endswith('.h5'):
+        import keras
+        model = keras.models.load_model(path)
+    elif path.endswith('.joblib') or path.endswith('.pkl'):
+        import joblib
+        model = joblib.load(path)
+        if hasattr(model, 'predict_proba'):
+            def predict(x):
+                return model.predict_proba(x)[:, 1].astype(np.float32)
+            predict.raw_features = True
+            return predict
+    else:
+        raise ValueError("Unknown model format: {}".format(path))
+
+    def predict(x):
+        return np.asarray(model(x, training = False)).reshape(-1)
+    return predict
+
+
+# Default location of the fitted preprocessing: next to the model artifact
+def preprocessing_path_for(model_path):
+    return os.path.join(os.path.dirname(os.path.abspath(model_path.rstrip('/'))), 'preprocessing.npz')
+
+
+# Signal probabilities for all events, computed batch by batch into one float32 array
+# (raw batches go straight to `predict` when preprocessor is None)
+def score_events(features, predict, preprocessor, batch_size = BATCH_SIZE):
+    probs = np.empty(len(features), dtype = np.float32)
+    buf = np.empty((batch_size, features.shape[1]), dtype = np.float32)
+    with stage('predict', rows_in = len(features), batch_size = batch_size) as s:
+        s.rows_out = len(probs)
+        for i in range(0, len(features), batch_size):
+            x = features[i:i + batch_size]
+            xb = x if preprocessor is None else preprocessor.transform(x, out = buf[:len(x)])
+            probs[i:i + len(x)] = predict(xb)
+    return probs
+
+
+# Same for a PartitionedModel, which routes each raw batch by PRI_jet_num (see partitioned.py)
+def score_partitioned(features, jet_num, model, batch_size = BATCH_SIZE):
+    probs = np.empty(len(features), dtype = np.float32)
+    with stage('predict', rows_in = len(features), batch_size = batch_size) as s:
+        s.rows_out = len(probs)
+        for i in range(0, len(features), batch_size):
+            probs[i:i + batch_size] = model.predict(features[i:i + batch_size], jet_num[i:i + batch_size])
+    return probs
+
+
+# Kaggle RankOrder: 1..n, increasing with the signal probability
+def rank_order(probs):
+    ranks = np.empty(len(probs), dtype = np.int64)
+    ranks[np.argsort(probs, kind = 'stable')] = np.arange(1, len(probs) + 1)
+    return ranks
+
+
+@traced('write_submission')
+def write_submission(path, event_id, probs, threshold = 0.5):
+    import pandas as pd
+
+    ranks = rank_order(probs)
+    for i in range(0, len(probs), WRITE_ROWS):
+        chunk = slice(i, i + WRITE_ROWS)
+        pd.DataFrame({'EventId': event_id[chunk], 'RankOrder': ranks[chunk],
+                      'Class': np.where(probs[chunk] >= threshold, 's', 'b')}).to_csv(
+            path, mode = 'w' if i == 0 else 'a', header = i == 0, index = False)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Score an event file with the saved model")
+    parser.add_argument('csv', help = "Events to score (Kaggle test.csv layout)")
+    parser.add_argument('--model', default = 'trained_model', help = "SavedModel directory, .keras, .joblib, .pkl or .npz file, a partitioned or cv.py model directory or a gbt.py model")
+    parser.add_argument('--preprocessing', default = None, help = "Fitted preprocessing (default: preprocessing.npz next to the model)")
+    parser.add_argument('--output', default = 'submission.csv')
+    parser.add_argument('--batch-size', type = int, default = BATCH_SIZE)
+    parser.add_argument('--threads', type = int, default = 0,
+                        help = "CPU threads for inference, TensorFlow and BLAS/OpenMP (0 = library default)")
+    parser.add_argument('--threshold', type = float, default = 0.5)
+    args = parser.parse_args(argv)
+
+    import pandas as pd
+
+    partitioned = is_partitioned(args.model)
+    prep_path = args.preprocessing or preprocessing_path_for(args.model)
+
+    start = time.time()
+    set_threads(args.threads)
+    if partitioned:
+        model = PartitionedModel.load(args.model)
+    else:
+        predict = load_predictor(args.model)
+        preprocessor = None
+        if not getattr(predict, 'raw_features', False):
+            if not os.path.exists(prep_path):
+                parser.error("fitted preprocessing not found at {} (it is written by the training notebook)".format(prep_path))
+            preprocessor = Preprocessor.load(prep_path)
+    events = load_events(args.csv)
+    loaded = time.time()
+
+    with thread_limits(args.threads):
+        if partitioned:
+            probs = score_partitioned(events.features, events.jet_num, model, args.batch_size)
+        else:
+            probs = score_events(events.features, predict, preprocessor, args.batch_size)
+    scored = time.time()
+
+    write_submission(args.output, np.asarray(events.event_id), probs, args.threshold)
+    done = time.time()
+
+    print(pd.Series({"Events": len(events),
+                     "Load time": "{:.2f} s".format(loaded - start),
+                     "Scoring time": "{:.2f} s".format(scored - loaded),
+                     "Throughput": "{:,.0f} events/s".format(len(events) / max(scored - loaded, 1e-9)),
+                     "Write time": "{:.2f} s".format(done - scored),
+                     "Signal fraction": "{:.4f}".format(float((probs >= args.threshold).mean())),
+                     "Output": args.output}).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Local online scoring service with request micro-batching.
+#
+# Concurrent requests are queued and collected into one batch (up to --max-batch events or --max-wait-ms
+# after the first request) before each forward pass of the dense network.
+#
+#   python serve.py --model trained_model --port 8000 --max-batch 256 --max-wait-ms 2
+#   curl -d '{"features": [[...30 raw values...]]}' http://127.0.0.1:8000/score
+#   curl http://127.0.0.1:8000/stats
+#   python serve.py --load-test --clients 32 --requests 5000 --events test.csv
+#   python serve.py --model trained_gbt.joblib --check test.csv
+#
+# Endpoints: POST /score (JSON {"features": one event or a list of events, raw values with -999 for
+# missing}), GET /stats (latency percentiles and throughput), GET /health.
+#
+# A model that takes raw features (a gbt.py pipeline, or the cv.py fold ensemble whose members apply their
+# own fold preprocessing) gets the raw batches; the fitted preprocessing is only loaded for the others.
+# --check starts the service on a free port, sends events of a file through POST /score and compares the
+# probabilities with score.py's batch scoring of the same events.
+#
+# A request that cannot be parsed gets 400; an error while scoring its micro-batch gets 500 (with the error)
+# for every request of that batch.
+
+import argparse
+import collections
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from ingest import FEATURES, MISSING
+
+MAX_BATCH = 256
+MAX_WAIT_MS = 2.0
+LATENCY_WINDOW = 100_000
+
+
+# Request latencies (bounded window) and event/batch counters
+class LatencyStats:
+    def __init__(self, window = LATENCY_WINDOW):
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen = window)
+        self.start = time.perf_counter()
+        self.requests = self.events = self.batches = 0
+
+    def record_batch(self, n_events):
+        with self.lock:
+            self.batches += 1
+            self.events += n_events
+
+    def record_request(self, latency):
+        with self.lock:
+            self.requests += 1
+            self.latencies.append(latency)
+
+    def snapshot(self):
+        with self.lock:
+            lat = np.array(self.latencies) * 1000.0
+            elapsed = time.perf_counter() - self.start
+            return {'requests': self.requests,
+                    'events': self.events,
+                    'batches': self.batches,
+                    'mean_batch_events': self.events / self.batches if self.batches else 0.0,
+                    'throughput_events_per_s': self.events / elapsed if elapsed > 0 else 0.0,
+                    'latency_p50_ms': float(np.percentile(lat, 50)) if len(lat) else None,
+                    'latency_p99_ms': float(np.percentile(lat, 99)) if len(lat) else None}
+
+
+class _Request:
+    def __init__(self, x):
+        self.x = x
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+# Collects queued requests into micro-batches and runs preprocessing (unless None) and the model on each batch
+class MicroBatcher:
+    def __init__(self, predict, preprocessor, max_batch = MAX_BATCH, max_wait_ms = MAX_WAIT_MS, stats = None):
+        self.predict = predict
+        self.preprocessor = preprocessor
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.stats = stats or LatencyStats()
+        self.queue = queue.Queue()
+        self.buf = np.empty((max_batch, len(FEATURES)), dtype = np.float32)
+        self.thread = threading.Thread(target = self._run, daemon = True)
+        self.thread.start()
+
+    # Blocking call from a request thread: probabilities for the events in x (rows x 30)
+    def submit(self, x):
+        req = _Request(np.asarray(x, dtype = np.float32).reshape(-1, len(FEATURES)))
+        self.queue.put(req)
+        req.done.wait()
+        if req.error is not None:
+            raise req.error
+        return req.result
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _collect(self):
+        first = self.queue.get()
+        if first is None:
+            return None
+        batch, n = [first], len(first.x)
+        deadline = time.perf_counter() + self.max_wait
+        while n < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                req = self.queue.get(timeout = timeout)
+            except queue.Empty:
+                break
+            if req is None:
+                self.queue.put(None)
+                break
+            batch.append(req)
+            n += len(req.x)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            try:
+                x = np.concatenate([req.x for req in batch])
+                if self.preprocessor is not None:
+                    x = self.preprocessor.transform(x, out = self.buf[:len(x)] if len(x) <= self.max_batch else None)
+                probs = self.predict(x)
+                self.stats.record_batch(len(x))
+                i = 0
+                for req in batch:
+                    req.result = probs[i:i + len(req.x)]
+                    i += len(req.x)
+            except Exception as e:
+                for req in batch:
+                    req.error = e
+            for req in batch:
+                req.done.set()
+
+
+def make_handler(batcher, threshold = 0.5):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send(self, code, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._send(200, batcher.stats.snapshot())
+            elif self.path == '/health':
+                self._send(200, {'status': 'ok'})
+            else:
+                self._send(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/score':
+                self._send(404, {'error': 'not found'})
+                return
+            start = time.perf_counter()
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                x = np.asarray(payload['features'], dtype = np.float32).reshape(-1, len(FEATURES))
+            except (ValueError, KeyError, TypeError) as e:
+                self._send(400, {'error': str(e)})
+                return
+            # a failure of the batch this request was scored in is a server error, reported to each of its requests
+            try:
+                probs = batcher.submit(x)
+            except Exception as e:
+                self._send(500, {'error': '{}: {}'.format(type(e).__name__, e)})
+                return
+            self._send(200, {'probability': probs.tolist(), 'class': np.where(probs >= threshold, 's', 'b').tolist()})
+            batcher.stats.record_request(time.perf_counter() - start)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(predict, preprocessor, host = '127.0.0.1', port = 8000, max_batch = MAX_BATCH, max_wait_ms = MAX_WAIT_MS,
+          threshold = 0.5):
+    batcher = MicroBatcher(predict, preprocessor, max_batch, max_wait_ms)
+    server = ThreadingHTTPServer((host, port), make_handler(batcher, threshold))
+    server.daemon_threads = True
+    return server, batcher
+
+
+# Closed-loop load test: `clients` threads each sending single-event requests back to back
+def load_test(url, events, clients = 16, requests = 2000):
+    import urllib.request
+
+    latencies = []
+    lock = threading.Lock()
+    per_client = max(requests // clients, 1)
+
+    def client(k):
+        rng = np.random.default_rng(k)
+        local = []
+        for _ in range(per_client):
+            body = json.dumps({'features': events[rng.integers(len(events))].tolist()}).encode()
+            start = time.perf_counter()
+            with urllib.request.urlopen(urllib.request.Request(url + '/score', data = body)) as r:
+                r.read()
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target = client, args = (k,)) for k in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    lat = np.array(latencies) * 1000.0
+    with urllib.request.urlopen(url + '/stats') as r:
+        server_stats = json.loads(r.read())
+    return {'clients': clients, 'requests': len(lat), 'elapsed_s': elapsed,
+            'throughput_requests_per_s': len(lat) / elapsed,
+            'client_latency_p50_ms': float(np.percentile(lat, 50)),
+            'client_latency_p99_ms': float(np.percentile(lat, 99)),
+            'server': server_stats}
+
+
+# Probabilities of `features` (raw, NaN for missing) scored through POST /score in requests of `batch` events
+# (sent with -999 for missing, like a client), next to score.py's batch scoring of the same events
+def check(predict, preprocessor, features, batch = 64, max_batch = MAX_BATCH, max_wait_ms = MAX_WAIT_MS):
+    import urllib.request
+
+    from score import score_events
+
+    server, batcher = serve(predict, preprocessor, port = 0, max_batch = max_batch, max_wait_ms = max_wait_ms)
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    url = 'http://{}:{}/score'.format(*server.server_address[:2])
+    try:
+        online = np.empty(len(features), dtype = np.float32)
+        for i in range(0, len(features), batch):
+            x = np.nan_to_num(np.asarray(features[i:i + batch], dtype = np.float32), nan = MISSING)
+            body = json.dumps({'features': x.tolist()}).encode()
+            with urllib.request.urlopen(urllib.request.Request(url, data = body)) as r:
+                online[i:i + len(x)] = json.loads(r.read())['probability']
+    finally:
+        server.shutdown()
+        server.server_close()
+        batcher.close()
+    return online, score_events(features, predict, preprocessor)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Online event scoring service with micro-batching")
+    parser.add_argument('--model', default = 'trained_model')
+    parser.add_argument('--preprocessing', default = None,
+                        help = "Fitted preprocessing (default: preprocessing.npz next to the model)")
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8000)
+    parser.add_argument('--max-batch', type = int, default = MAX_BATCH)
+    parser.add_argument('--max-wait-ms', type = float, default = MAX_WAIT_MS)
+    parser.add_argument('--threads', type = int, default = 0,
+                        help = "CPU threads for inference, TensorFlow and BLAS/OpenMP (0 = library default)")
+    parser.add_argument('--threshold', type = float, default = 0.5)
+    parser.add_argument('--load-test', action = 'store_true', help = "Run the load-test client against a running service")
+    parser.add_argument('--clients', type = int, default = 16)
+    parser.add_argument('--requests', type = int, default = 2000)
+    parser.add_argument('--events', default = None,
+                        help = "Event file to draw load-test requests from (default: random events)")
+    parser.add_argument('--check', default = None, metavar = 'CSV',
+                        help = "Compare /score with score.py on the events of this file and exit")
+    parser.add_argument('--check-events', type = int, default = 5000)
+    args = parser.parse_args(argv)
+
+    url = 'http://{}:{}'.format(args.host, args.port)
+    if args.load_test:
+        if args.events:
+            from ingest import load_events
+            events = np.asarray(load_events(args.events).features[:100_000])
+        else:
+            events = np.random.default_rng(0).normal(size = (10_000, len(FEATURES))).astype(np.float32)
+        print(json.dumps(load_test(url, events, args.clients, args.requests), indent = 2))
+        return
+
+    from preprocessing import Preprocessor
+    from score import load_predictor, preprocessing_path_for, set_threads, thread_limits
+
+    set_threads(args.threads)
+    thread_limits(args.threads)  # applied on creation, kept for the life of the process
+    predict = load_predictor(args.model)
+    preprocessor = None
+    if not getattr(predict, 'raw_features', False):
+        preprocessor = Preprocessor.load(args.preprocessing or preprocessing_path_for(args.model))
+    if args.check:
+        from ingest import load_events
+        features = load_events(args.check).features[:args.check_events]
+        online, batch = check(predict, preprocessor, features, max_batch = args.max_batch, max_wait_ms = args.max_wait_ms)
+        diff = float(np.abs(online - batch).max())
+        agreement = float(np.mean((online >= args.threshold) == (batch >= args.threshold)))
+        print(json.dumps({'events': len(online), 'max_abs_diff': diff, 'class_agreement': agreement}, indent = 2))
+        if diff > 1e-5:
+            parser.exit(1, "served probabilities differ from score.py\n")
+        return
+    server, batcher = serve(predict, preprocessor, args.host, args.port, args.max_batch, args.max_wait_ms, args.threshold)
+    print("Serving on {} (max batch {}, max wait {} ms)".format(url, args.max_batch, args.max_wait_ms))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Mergeable sketches for EDA on event files of any size.
+#
+# One streaming pass over the events fills, per group (training background, training signal, test) and
+# per feature, a quantile sketch and a fixed-edge histogram. Memory does not grow with the number of
+# events, and sketches built on different chunks or worker nodes combine with merge(). The histogram
+# plots of the notebook and the IQR bounds of the streaming preprocessing are drawn from them.
+#
+# The histogram edges do not depend on the data: every feature is binned over its range in FEATURE_RANGES
+# (round bounds around the values of the Kaggle training and test files), or over the `ranges` given to
+# build_sketches, so every chunk and every node bins the same way.
+
+import math
+
+import numpy as np
+
+from ingest import FEATURES, MISSING
+from instrument import traced
+
+CHUNK_ROWS = 1_000_000
+SKETCH_K = 2048
+N_BINS = 100
+
+GROUPS = ['Training set (background events)', 'Training set (signal events)', 'Test set (all events)']
+
+# Histogram range (lo, hi) of every feature
+FEATURE_RANGES = {
+    'DER_mass_MMC': (0, 2000), 'DER_mass_transverse_met_lep': (0, 1000), 'DER_mass_vis': (0, 1500),
+    'DER_pt_h': (0, 3000), 'DER_deltaeta_jet_jet': (0, 10), 'DER_mass_jet_jet': (0, 5000),
+    'DER_prodeta_jet_jet': (-20, 20), 'DER_deltar_tau_lep': (0, 6), 'DER_pt_tot': (0, 3000), 'DER_sum_pt': (0, 2500),
+    'DER_pt_ratio_lep_tau': (0, 20), 'DER_met_phi_centrality': (-1.5, 1.5), 'DER_lep_eta_centrality': (0, 1),
+    'PRI_tau_pt': (0, 1000), 'PRI_tau_eta': (-2.5, 2.5), 'PRI_tau_phi': (-math.pi, math.pi),
+    'PRI_lep_pt': (0, 1000), 'PRI_lep_eta': (-2.5, 2.5), 'PRI_lep_phi': (-math.pi, math.pi),
+    'PRI_met': (0, 3000), 'PRI_met_phi': (-math.pi, math.pi), 'PRI_met_sumet': (0, 2500), 'PRI_jet_num': (0, 4),
+    'PRI_jet_leading_pt': (0, 1500), 'PRI_jet_leading_eta': (-5, 5), 'PRI_jet_leading_phi': (-math.pi, math.pi),
+    'PRI_jet_subleading_pt': (0, 1000), 'PRI_jet_subleading_eta': (-5, 5), 'PRI_jet_subleading_phi': (-math.pi, math.pi),
+    'PRI_jet_all_pt': (0, 2000),
+}
+
+
+# Quantile sketch of one column (KLL-style compactors): level h holds at most k sorted values of weight 2**h.
+# When a level overflows, every other value (random offset) is promoted to the next level. Exact point
+# masses (value, weight) can be added for values known to repeat, e.g. the mean used for imputation.
+class QuantileSketch:
+    def __init__(self, k = SKETCH_K, seed = 0):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0, np.float32)]
+        self.points = {}
+        self.rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        values = np.asarray(values, dtype = np.float32)
+        values = values[~np.isnan(values)]
+        self.n += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def add_point(self, value, weight):
+        if weight > 0:
+            self.points[float(value)] = self.points.get(float(value), 0) + int(weight)
+            self.n += int(weight)
+        return self
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            level = self.levels[h]
+            if len(level) > self.k:
+                level = np.sort(level)
+                rest = len(level) % 2
+                promoted = level[rest:][self.rng.integers(2)::2]
+                self.levels[h] = level[:rest]
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0, np.float32))
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+            h += 1
+
+    def merge(self, other):
+        if other.k != self.k:
+            raise ValueError("Cannot merge sketches with k = {} and k = {}".format(self.k, other.k))
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0, np.float32))
+        for h, level in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], level])
+        for value, weight in other.points.items():
+            self.points[value] = self.points.get(value, 0) + weight
+        self.n += other.n
+        self._compress()
+        return self
+
+    # Approximate quantiles (linear interpolation between the weighted sketch values)
+    def quantile(self, qs):
+        values = np.concatenate(self.levels + [np.array(list(self.points), np.float32)])
+        weights = np.concatenate([np.full(len(level), 2.0 ** h) for h, level in enumerate(self.levels)] +
+                                 [np.array(list(self.points.values()), np.float64)])
+        if len(values) == 0:
+            return np.full(np.shape(qs), np.nan)
+        is_point = np.arange(len(values)) >= len(values) - len(self.points)
+        order = np.argsort(values, kind = 'stable')
+        values, weights, is_point = values[order], weights[order], is_point[order]
+        # Rank of each value in the weighted sorted sample, on the same 0..n-1 scale as np.quantile:
+        # sketch values sit at the middle of the ranks they stand for, point masses cover all of theirs
+        end = np.cumsum(weights) - 1
+        start = np.where(is_point, end - weights + 1, end - (weights - 1) / 2)
+        positions = np.column_stack([start, end - np.where(is_point, 0, (weights - 1) / 2)]).ravel()
+        return np.interp(np.asarray(qs) * (weights.sum() - 1), positions, np.repeat(values, 2))
+
+
+# Fixed-edge histograms of all columns for several groups, filled with one bincount per chunk.
+# Values below/above the edges go to the under/overflow counters, -999/NaN to `missing`.
+class FeatureHistogram:
+    def __init__(self, lo, hi, n_groups = 1, n_bins = N_BINS):
+        self.lo = np.asarray(lo, dtype = np.float64)
+        self.hi = np.asarray(hi, dtype = np.float64)
+        self.n_groups, self.n_bins, self.n_cols = n_groups, n_bins, len(self.lo)
+        # bins 0 and n_bins + 1 are the under/overflow bins, n_bins + 2 is the missing bin
+        self.counts = np.zeros((n_groups, self.n_cols, n_bins + 3), dtype = np.int64)
+
+    # Edges over the (lo, hi) range of every column in `ranges` (default: FEATURE_RANGES)
+    @classmethod
+    def from_ranges(cls, columns, ranges = None, n_groups = 1, n_bins = N_BINS):
+        ranges = FEATURE_RANGES if ranges is None else ranges
+        missing = [col for col in columns if col not in ranges]
+        if missing:
+            raise KeyError("No histogram range for {}".format(missing))
+        lo, hi = np.array([ranges[col] for col in columns], dtype = np.float64).T
+        return cls(lo, hi, n_groups, n_bins)
+
+    @property
+    def edges(self):
+        return np.linspace(self.lo, self.hi, self.n_bins + 1, axis = 1)
+
+    def update(self, x, groups = None):
+        x = np.asarray(x, dtype = np.float64)
+        n = len(x)
+        groups = np.zeros(n, np.int64) if groups is None else np.asarray(groups, dtype = np.int64)
+        width = (self.hi - self.lo) / self.n_bins
+        with np.errstate(invalid = 'ignore'):
+            b = np.floor((x - self.lo) / width)
+        b = np.clip(np.nan_to_num(b, nan = -1), -1, self.n_bins).astype(np.int64) + 1
+        b[(x == MISSING) | np.isnan(x)] = self.n_bins + 2
+        n_slots = self.n_bins + 3
+        flat = (groups[:, None] * self.n_cols + np.arange(self.n_cols)) * n_slots + b
+        self.counts += np.bincount(flat.ravel(), minlength = self.counts.size).reshape(self.counts.shape)
+        return self
+
+    def merge(self, other):
+        if not (np.array_equal(self.lo, other.lo) and np.array_equal(self.hi, other.hi) and self.n_bins == other.n_bins):
+            raise ValueError("Cannot merge histograms with different edges")
+        self.counts += other.counts
+        return self
+
+    # In-range bin counts (groups x columns x bins)
+    @property
+    def bins(self):
+        return self.counts[:, :, 1:self.n_bins + 1]
+
+    @property
+    def missing(self):
+        return self.counts[:, :, self.n_bins + 2]
+
+
+# Per group and per column quantile sketches and histograms of an event stream; `ranges` ({column: (lo,
+# hi)}, default FEATURE_RANGES) sets the histogram edges
+class EventSketches:
+    def __init__(self, columns = FEATURES, groups = GROUPS, k = SKETCH_K, n_bins = N_BINS, seed = 0, ranges = None):
+        self.columns, self.groups = list(columns), list(groups)
+        self.k, self.n_bins, self.seed = k, n_bins, seed
+        self.quantiles = [[QuantileSketch(k, seed) for _ in self.columns] for _ in self.groups]
+        self.hist = FeatureHistogram.from_ranges(self.columns, ranges, len(self.groups), n_bins)
+
+    # x: raw float32 chunk (-999 marks missing), groups: group index of every row
+    def update(self, x, groups):
+        x = np.asarray(x, dtype = np.float32)
+        groups = np.asarray(groups)
+        self.hist.update(x, groups)
+        masked = np.where(x == MISSING, np.nan, x)
+        for g in np.unique(groups):
+            xg = masked[groups == g]
+            for j in range(len(self.columns)):
+                self.quantiles[g][j].update(xg[:, j])
+        return self
+
+    def merge(self, other):
+        for mine, theirs in zip(self.quantiles, other.quantiles):
+            for a, b in zip(mine, theirs):
+                a.merge(b)
+        self.hist.merge(other.hist)
+        return self
+
+    # Quantile sketch of a column over several groups combined
+    def column_sketch(self, col, groups):
+        j = self.columns.index(col)
+        sketch = QuantileSketch(self.k, self.seed)
+        for g in groups:
+            sketch.merge(self.quantiles[g][j])
+        return sketch
+
+
+# One streaming pass over the training events (grouped by Label) and the test events
+@traced('build_sketches')
+def build_sketches(train_features, train_label, test_features = None, chunk_rows = CHUNK_ROWS, **kwargs):
+    sketches = EventSketches(**kwargs)
+    for i in range(0, len(train_features), chunk_rows):
+        sketches.update(train_features[i:i + chunk_rows], np.asarray(train_label[i:i + chunk_rows], dtype = np.int64))
+    if test_features is not None:
+        for i in range(0, len(test_features), chunk_rows):
+            x = test_features[i:i + chunk_rows]
+            sketches.update(x, np.full(len(x), 2))
+    return sketches
+
+
+# IQR bounds (q1 - factor iqr, q3 + factor iqr) of one column from its sketch, with `n_imputed` missing
+# values counted at the imputation mean
+def iqr_bounds(sketch, mean = None, n_imputed = 0, factor = 1.5):
+    if n_imputed:
+        sketch = QuantileSketch(sketch.k).merge(sketch).add_point(mean, n_imputed)
+    q1, q3 = sketch.quantile([0.25, 0.75])
+    return q1 - factor * (q3 - q1), q3 + factor * (q3 - q1)
+
+
+# Histogram grid drawn from the sketches: one panel per column, one step line per group
+def plot_histograms(sketches, cols, groups, labels, colors = ('red', 'grey'), ncols = 3, density = False):
+    import matplotlib.pyplot as plt
+
+    nrows = math.ceil(len(cols) / ncols)
+    fig, ax = plt.subplots(nrows, ncols, figsize = (5 * ncols, 4.2 * nrows), sharey = False, squeeze = False)
+    edges = sketches.hist.edges
+    for i, col in enumerate(cols):
+        j = sketches.columns.index(col)
+        a = ax[i // ncols, i % ncols]
+        for group, label, color in zip(groups, labels, colors):
+            counts = sketches.hist.bins[list(np.atleast_1d(group)), j].sum(axis = 0).astype(float)
+            if density and counts.sum() > 0:
+                counts /= counts.sum() * np.diff(edges[j])
+            a.stairs(counts, edges[j], fill = True, alpha = 0.5, color = color, label = label)
+        a.set_xlabel(col)
+        a.set_ylabel(("Density" if density else "Count") if i % ncols == 0 else " ")
+        a.legend()
+    for i in range(len(cols), nrows * ncols):
+        ax[i // ncols, i % ncols].axis('off')
+    plt.tight_layout()
+    return fig
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Index-based train/test split, stratified by Label (and optionally PRI_jet_num), and lazy row subsets over
+# one shared DataFrame.
+#
+#   train, test = stratified_split(strata(events.label, events.jet_num), test_size = 0.35, random_state = 20)
+#   data_train = Rows(data_all, train, columns = FEATURES + ['Label'])
+#   data_train_b = data_train[data_train['Label'] == 'b']
+#   x = data_train_b[FEATURES].to_numpy(np.float32)
+#   folds = stratified_folds(strata(events.label, events.jet_num), k = 5)        # cross-validation (cv.py)
+#
+# A split is two sorted arrays of row positions; nothing is copied when it is made. A Rows subset holds the
+# base frame, its row positions and a column list: its length, shape, columns and dtypes come from the base
+# without touching the rows, selecting columns or filtering rows composes the positions, and rows are
+# gathered only when values are asked for (one column, to_numpy of the selected columns, head, or
+# to_frame for a full pandas copy). A slice of positions stays a view of the base.
+
+import numpy as np
+
+
+# Integer stratum of every event: the label, combined with the jet multiplicity when given
+def strata(label, jet_num = None):
+    codes = np.asarray(label, dtype = np.int64)
+    if jet_num is not None:
+        jet_num = np.asarray(jet_num, dtype = np.int64)
+        codes = codes * (int(jet_num.max()) + 1) + jet_num
+    return codes
+
+
+# Positions of all events grouped by stratum, in random order within each stratum, and the rank of every
+# position within its stratum
+def _shuffle_by_stratum(strata, random_state):
+    rng = np.random.default_rng(random_state)
+    order = rng.permutation(len(strata))
+    order = order[np.argsort(strata[order], kind = 'stable')]
+    _, counts = np.unique(strata, return_counts = True)
+    rank = np.arange(len(order)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return order, rank, np.repeat(counts, counts)
+
+
+# Sorted row positions (train, test) with round(test_size * n) random events of every stratum in the test set
+def stratified_split(strata, test_size = 0.35, random_state = 20):
+    order, rank, size = _shuffle_by_stratum(np.asarray(strata), random_state)
+    is_test = rank < np.rint(size * test_size)
+    return np.sort(order[~is_test]), np.sort(order[is_test])
+
+
+# Fold (0 .. k-1) of every event for k-fold cross-validation: the events of each stratum are dealt over the
+# folds in random order, so every fold holds 1/k of every stratum
+def stratified_folds(strata, k = 5, random_state = 20):
+    order, rank, _ = _shuffle_by_stratum(np.asarray(strata), random_state)
+    folds = np.empty(len(order), dtype = np.int8)
+    folds[order] = rank % k
+    return folds
+
+
+# Rows `index` (positions or a slice) and `columns` of a shared base DataFrame, gathered on access
+class Rows:
+    def __init__(self, base, index = None, columns = None):
+        self.base = base
+        self.index = slice(None) if index is None else index
+        if columns is None:
+            self.columns = base.columns
+        else:
+            positions = base.columns.get_indexer(columns)
+            if (positions < 0).any():
+                raise KeyError([c for c in columns if c not in base.columns])
+            self.columns = base.columns[positions]
+
+    def _positions(self):
+        if isinstance(self.index, slice):
+            return np.arange(len(self.base))[self.index]
+        return np.asarray(self.index)
+
+    def _take(self, index, columns):
+        return self.base.iloc[index, self.base.columns.get_indexer(columns)]
+
+    def __len__(self):
+        return len(range(len(self.base))[self.index]) if isinstance(self.index, slice) else len(self.index)
+
+    @property
+    def shape(self):
+        return (len(self), len(self.columns))
+
+    @property
+    def dtypes(self):
+        return self.base.dtypes[self.columns]
+
+    # A column name gives the gathered column (Series); a list of names a Rows over those columns; a
+    # boolean mask (array or Series of this subset) the Rows where it is true
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.base[key].iloc[self.index]
+        if isinstance(key, list):
+            return Rows(self.base, self.index, key)
+        return self.where(key)
+
+    def where(self, mask):
+        mask = np.asarray(mask, dtype = bool)
+        if len(mask) != len(self):
+            raise ValueError("Mask of {} rows for a subset of {}".format(len(mask), len(self)))
+        return Rows(self.base, self._positions()[mask], self.columns)
+
+    # Rows at `positions` within this subset
+    def take(self, positions):
+        return Rows(self.base, self._positions()[positions], self.columns)
+
+    def select_dtypes(self, include = None, exclude = None):
+        return Rows(self.base, self.index, self.base.iloc[:0][self.columns].select_dtypes(include, exclude).columns)
+
+    def to_numpy(self, dtype = None):
+        return self._take(self.index, self.columns).to_numpy(dtype)
+
+    def head(self, n = 5):
+        return self._take(self._positions()[:n], self.columns)
+
+    # Materialized copy of the subset, for pandas operations that need all of its rows
+    def to_frame(self):
+        return self._take(self.index, self.columns)
+
+    def __repr__(self):
+        return "Rows({} of {} rows, {} columns)".format(len(self), len(self.base), len(self.columns))
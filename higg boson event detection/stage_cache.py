@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Content-addressed cache of intermediate pipeline arrays, so re-runs load unchanged stages instead of
+# recomputing them.
+#
+#   cache = StageCache('stages.cache', max_bytes = 8 << 30)
+#   split_key = cache.key('split', source = cache.file_digest('training.csv'), test_size = 0.35, random_state = 20)
+#   split = cache.cached(split_key, lambda: {'train': ..., 'test': ...})
+#   prep_key = cache.key('preprocess', split = split_key, iqr_factor = 1.5)
+#
+# A key is the sha256 of the stage name and its parameters; input files enter through the hash of their
+# content and upstream stages through their own keys, so changing a file or a parameter invalidates exactly
+# the stages below it. An entry is a directory holding one .npy file per output array, written to a
+# temporary directory and renamed into place, and hits are memory-mapped read-only. The total size is
+# bounded: after every write the least recently used entries are evicted (meta.json of an entry is touched
+# on each hit).
+#
+#   python stage_cache.py --list                     # entries, most recently used first
+#   python stage_cache.py --max-bytes 2e9            # evict down to 2 GB
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from instrument import stage
+
+DEFAULT_ROOT = 'stages.cache'
+DEFAULT_MAX_BYTES = 8 << 30
+HASH_BLOCK = 1 << 24
+SINGLE = 'data'
+
+
+def _to_json(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (tuple, set)):
+        return list(value)
+    raise TypeError("Stage parameter of type {} is not hashable as JSON".format(type(value).__name__))
+
+
+class StageCache:
+    def __init__(self, root = DEFAULT_ROOT, max_bytes = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok = True)
+
+    # sha256 of a file's content; remembered per (path, size, mtime) so unchanged files are hashed once
+    def file_digest(self, path):
+        st = os.stat(path)
+        stamp = '{}:{}:{}'.format(os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        digests_path = os.path.join(self.root, 'digests.json')
+        try:
+            with open(digests_path) as f:
+                digests = json.load(f)
+        except (OSError, ValueError):
+            digests = {}
+        if stamp not in digests:
+            h = hashlib.sha256()
+            with stage('file_digest', rows_in = st.st_size), open(path, 'rb') as f:
+                for block in iter(lambda: f.read(HASH_BLOCK), b''):
+                    h.update(block)
+            digests = {k: v for k, v in digests.items() if not k.startswith(os.path.abspath(path) + ':')}
+            digests[stamp] = h.hexdigest()
+            tmp = '{}.{}.tmp'.format(digests_path, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(digests, f, indent = 1)
+            os.replace(tmp, digests_path)
+        return digests[stamp]
+
+    # Key of a stage: hash of its name and JSON-serializable parameters (upstream keys, digests, settings)
+    def key(self, stage_name, **params):
+        blob = json.dumps({'stage': stage_name, 'params': params}, sort_keys = True, default = _to_json)
+        return '{}-{}'.format(stage_name, hashlib.sha256(blob.encode()).hexdigest()[:32])
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    # Memory-mapped arrays of an entry ({name: array}), or None on a miss
+    def load(self, key):
+        meta_path = os.path.join(self.path(key), 'meta.json')
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        os.utime(meta_path)
+        return {name: np.load(os.path.join(self.path(key), name + '.npy'), mmap_mode = 'r') for name in meta['arrays']}
+
+    # Write the arrays of an entry, evict down to the size bound and return the stored (memory-mapped) arrays
+    def store(self, key, arrays):
+        final = self.path(key)
+        tmp = os.path.join(self.root, '.tmp-{}-{}'.format(key, os.getpid()))
+        shutil.rmtree(tmp, ignore_errors = True)
+        os.makedirs(tmp)
+        try:
+            size = 0
+            for name, array in arrays.items():
+                array = np.asarray(array)
+                np.save(os.path.join(tmp, name + '.npy'), array)
+                size += array.nbytes
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump({'stage': key.rsplit('-', 1)[0], 'arrays': list(arrays), 'bytes': size, 'created': time.time()}, f, indent = 1)
+            try:
+                os.rename(tmp, final)
+            except OSError:
+                # another process stored the same entry first; its content is the same
+                if not os.path.exists(os.path.join(final, 'meta.json')):
+                    raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors = True)
+        self.evict(protect = {key})
+        return self.load(key)
+
+    # Arrays of the stage `key`, loaded from the cache or computed with compute() and stored. compute()
+    # returns a dict of arrays, or a single array (then a single array is returned).
+    def cached(self, key, compute):
+        arrays = self.load(key)
+        if arrays is None:
+            with stage('stage_cache_miss', key = key):
+                result = compute()
+            single = not isinstance(result, dict)
+            arrays = self.store(key, {SINGLE: result} if single else result)
+        else:
+            single = list(arrays) == [SINGLE]
+        return arrays[SINGLE] if single else arrays
+
+    # (key, stage, bytes, last used) of every entry, most recently used first
+    def entries(self):
+        out = []
+        for name in os.listdir(self.root):
+            meta_path = os.path.join(self.root, name, 'meta.json')
+            if name.startswith('.') or not os.path.isfile(meta_path):
+                continue
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                out.append((name, meta['stage'], meta['bytes'], os.path.getmtime(meta_path)))
+            except (OSError, ValueError):
+                continue
+        return sorted(out, key = lambda e: e[3], reverse = True)
+
+    # Remove least recently used entries until the total size is within max_bytes (or `max_bytes`)
+    def evict(self, max_bytes = None, protect = ()):
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(e[2] for e in entries)
+        removed = []
+        for key, _, size, _ in reversed(entries):
+            if total <= max_bytes:
+                break
+            if key in protect:
+                continue
+            shutil.rmtree(self.path(key), ignore_errors = True)
+            total -= size
+            removed.append(key)
+        return removed
+
+    def clear(self):
+        return self.evict(max_bytes = 0)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Inspect or trim the stage cache")
+    parser.add_argument('--root', default = DEFAULT_ROOT)
+    parser.add_argument('--list', action = 'store_true', help = "List the entries, most recently used first")
+    parser.add_argument('--max-bytes', type = float, default = None, help = "Evict least recently used entries down to this size")
+    parser.add_argument('--clear', action = 'store_true')
+    args = parser.parse_args(argv)
+
+    import pandas as pd
+
+    cache = StageCache(args.root)
+    if args.clear:
+        print("Removed {} entries".format(len(cache.clear())))
+    elif args.max_bytes is not None:
+        print("Removed {} entries".format(len(cache.evict(int(args.max_bytes)))))
+    entries = cache.entries()
+    if args.list:
+        table = pd.DataFrame(entries, columns = ['key', 'stage', 'bytes', 'last_used'])
+        table['last_used'] = pd.to_datetime(table['last_used'], unit = 's').dt.strftime('%Y-%m-%d %H:%M:%S')
+        print(table.to_string(index = False))
+    print(pd.Series({"Entries": len(entries), "Size": "{:.1f} MB".format(sum(e[2] for e in entries) / 1e6),
+                     "Root": os.path.abspath(args.root)}).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Cold-start cost of the command-line entry points, and of the heavy libraries they import on first use.
+#
+#   python startup.py --repeat 5 --json startup.json
+#
+# Every measurement runs in a fresh interpreter (python -c), so nothing is imported beforehand; the first
+# repeat also warms the OS file cache and the median over the repeats is reported. For each entry point:
+# the process wall time (interpreter start included), the time of the import itself, the peak resident
+# memory and which heavy libraries the import pulled in. Each subsystem row is the cost a command pays when
+# it first needs that library (plots, plotly donuts, Keras training, gradient-boosted trees).
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ENTRY_POINTS = ['score', 'serve', 'numpy_model', 'quantized', 'streaming', 'partitioned', 'gbt', 'compare_models', 'sweep', 'cv',
+                'train', 'checkpoint', 'report', 'benchmark', 'synthetic']
+SUBSYSTEMS = {
+    'numpy': 'import numpy',
+    'pandas': 'import pandas',
+    'EDA plots (matplotlib, seaborn)': "import matplotlib; matplotlib.use('Agg'); import matplotlib.pyplot, seaborn",
+    '3D plots (mplot3d)': "import matplotlib; matplotlib.use('Agg'); import mpl_toolkits.mplot3d",
+    'plotly donuts': 'import plotly.graph_objects, plotly.subplots',
+    'scikit-learn split': 'import sklearn.model_selection',
+    'gradient-boosted trees': 'import sklearn.ensemble, joblib',
+    'Keras training': 'import keras',
+    'TensorFlow (SavedModel inference)': 'import tensorflow',
+    'all of the above': "import pandas, matplotlib; matplotlib.use('Agg'); import matplotlib.pyplot, seaborn, mpl_toolkits.mplot3d, "
+                        "plotly.graph_objects, plotly.subplots, sklearn.model_selection, tensorflow, keras, tqdm",
+}
+HEAVY = ['pandas', 'matplotlib', 'seaborn', 'plotly', 'sklearn', 'scipy', 'tensorflow', 'keras', 'tqdm']
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+{code}
+seconds = time.perf_counter() - start
+try:  # the high-water mark of this process image (ru_maxrss on Linux carries over from the parent across exec)
+    peak = next(int(line.split()[1]) * 1024 for line in open('/proc/self/status') if line.startswith('VmHWM:'))
+except OSError:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+print(json.dumps({{'import_s': seconds, 'peak_rss_bytes': peak, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+# Run `code` in a fresh interpreter from this directory; the probe's measurements plus the process wall time
+def probe(code, python = sys.executable):
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL = '3')
+    start = time.perf_counter()
+    out = subprocess.run([python, '-c', PROBE.format(code = code, heavy = HEAVY)], cwd = os.path.dirname(os.path.abspath(__file__)),
+                         env = env, capture_output = True, text = True)
+    wall = time.perf_counter() - start
+    if out.returncode:
+        raise RuntimeError("{!r} failed:\n{}".format(code, out.stderr))
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result['process_s'] = wall
+    return result
+
+
+# Median over `repeat` fresh processes
+def measure(code, repeat = 5):
+    runs = [probe(code) for _ in range(repeat)]
+    return {'process_s': float(np.median([r['process_s'] for r in runs])), 'import_s': float(np.median([r['import_s'] for r in runs])),
+            'peak_rss_mb': max(r['peak_rss_bytes'] for r in runs) / (1024 * 1024), 'heavy': ' '.join(runs[-1]['heavy'])}
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Measure the cold-start time of the entry points and heavy libraries")
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--entry-points', nargs = '+', default = ENTRY_POINTS)
+    parser.add_argument('--no-subsystems', dest = 'subsystems', action = 'store_false')
+    parser.add_argument('--json', default = None, help = "Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    import pandas as pd
+
+    results = {'interpreter': measure('pass', args.repeat)}
+    for name in args.entry_points:
+        results[name + '.py'] = measure('import ' + name, args.repeat)
+    if args.subsystems:
+        for name, code in SUBSYSTEMS.items():
+            results[name] = measure(code, args.repeat)
+
+    table = pd.DataFrame(results).T
+    table['heavy'] = table['heavy'].replace('', '-')
+    print("Median of {} fresh processes each (process = interpreter start + import)".format(args.repeat))
+    print(table[['process_s', 'import_s', 'peak_rss_mb', 'heavy']].to_string(float_format = '{:.3f}'.format))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': sys.version, 'repeat': args.repeat, 'results': results}, f, indent = 2)
+
+
+if __name__ == '__main__':
+    main()
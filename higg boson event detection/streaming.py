@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Streaming mode for event files larger than RAM.
+#
+# Events are read from the memory-mapped cache (see ingest.py) in fixed-size chunks. The -999
+# masking, the mean imputation, the IQR outlier bounds and the standard scaling are fitted in online
+# passes (Preprocessor.fit_streaming), and the Keras model is fed from a tf.data generator, so no step
+# needs the full matrix resident.
+#
+#   python streaming.py training.csv --chunk-rows 1000000 --epochs 20 --out trained_model.keras
+#
+# The fitted preprocessing is saved as preprocessing.npz next to the model, for score.py.
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from ingest import MISSING, load_events
+from instrument import stage
+
+CHUNK_ROWS = 1_000_000
+
+
+# Row positions of the chunks covering `rows` (all rows, a slice or a sorted index array)
+def iter_chunk_rows(n, chunk_rows = CHUNK_ROWS, rows = None):
+    if rows is None:
+        rows = slice(0, n)
+    if isinstance(rows, slice):
+        start, stop, _ = rows.indices(n)
+        for i in range(start, stop, chunk_rows):
+            yield slice(i, min(i + chunk_rows, stop))
+    else:
+        for i in range(0, len(rows), chunk_rows):
+            yield rows[i:i + chunk_rows]
+
+
+# Float32 copy of one chunk of features with the -999 sentinel replaced by NaN
+def masked_chunk(features, rows):
+    x = np.array(features[rows], dtype = np.float32)
+    x[x == MISSING] = np.nan
+    return x
+
+
+# Per-column count, mean and sum of squared deviations over the non-missing values,
+# updated chunk by chunk and mergeable across chunks/processes (Chan et al.)
+class RunningStats:
+    def __init__(self, n_cols):
+        self.rows = 0
+        self.count = np.zeros(n_cols)
+        self.mean = np.zeros(n_cols)
+        self.m2 = np.zeros(n_cols)
+
+    def update(self, x):
+        count = np.sum(~np.isnan(x), axis = 0)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            mean = np.nansum(x, axis = 0, dtype = np.float64) / count
+        mean = np.where(count > 0, mean, 0.0)
+        m2 = np.nansum((x - mean.astype(np.float32)) ** 2, axis = 0, dtype = np.float64)
+        other = RunningStats(x.shape[1])
+        other.rows, other.count, other.mean, other.m2 = len(x), count, mean, m2
+        return self.merge(other)
+
+    def merge(self, other):
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            w = np.where(count > 0, other.count / count, 0.0)
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * w
+        self.mean = self.mean + delta * w
+        self.count = count
+        self.rows += other.rows
+        return self
+
+    # Mean and standard deviation after mean imputation, i.e. what StandardScaler would learn on
+    # the imputed matrix: imputed entries sit at the mean, so they only add to the row count
+    # (with no missing values, this is simply the mean and standard deviation)
+    def imputed_scaler(self):
+        var = self.m2 / max(self.rows, 1)
+        scale = np.sqrt(var)
+        scale[scale == 0] = 1.0
+        return self.mean.astype(np.float32), scale.astype(np.float32)
+
+
+# Generator of preprocessed (X, y) batches, or (X, y, sample_weight) when `weight` is given, reshuffled at
+# every pass when `seed` is given. Each chunk goes through the fitted preprocessing (see preprocessing.py);
+# IQR outliers are dropped when filter_outliers. Weights are used as they are (see training_weights()).
+def batch_generator(features, label, preprocessor, batch_size = 1024, chunk_rows = CHUNK_ROWS, rows = None, seed = None,
+                    filter_outliers = True, weight = None):
+    rng = np.random.default_rng(seed)
+
+    def generate():
+        chunks = list(iter_chunk_rows(len(features), chunk_rows, rows))
+        if seed is not None:
+            rng.shuffle(chunks)
+        for r in chunks:
+            x = np.asarray(features[r], dtype = np.float32)
+            y = np.asarray(label[r], dtype = np.float32)
+            w = None if weight is None else np.asarray(weight[r], dtype = np.float32)
+            if filter_outliers:
+                keep = preprocessor.inlier_mask(x)
+                x, y = x[keep], y[keep]
+                w = None if w is None else w[keep]
+            x = preprocessor.transform(x)
+            order = rng.permutation(len(x)) if seed is not None else np.arange(len(x))
+            for i in range(0, len(x), batch_size):
+                b = order[i:i + batch_size]
+                yield (x[b], y[b]) if w is None else (x[b], y[b], w[b])
+    return generate
+
+
+# tf.data pipeline over the generator, so model.fit only ever sees one chunk at a time
+def make_dataset(features, label, preprocessor, batch_size = 1024, chunk_rows = CHUNK_ROWS, rows = None, seed = None,
+                 filter_outliers = True, weight = None):
+    import tensorflow as tf
+
+    n_cols = features.shape[1]
+    signature = (tf.TensorSpec(shape = (None, n_cols), dtype = tf.float32), tf.TensorSpec(shape = (None,), dtype = tf.float32))
+    if weight is not None:
+        signature += (tf.TensorSpec(shape = (None,), dtype = tf.float32),)
+    dataset = tf.data.Dataset.from_generator(
+        batch_generator(features, label, preprocessor, batch_size, chunk_rows, rows, seed, filter_outliers, weight),
+        output_signature = signature)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Train the event classifier in streaming mode")
+    parser.add_argument('csv', help = "Training events (Kaggle training.csv layout)")
+    parser.add_argument('--chunk-rows', type = int, default = CHUNK_ROWS)
+    parser.add_argument('--batch-size', type = int, default = 1024)
+    parser.add_argument('--epochs', type = int, default = 20)
+    parser.add_argument('--seed', type = int, default = 20)
+    parser.add_argument('--no-weights', dest = 'weighted', action = 'store_false', help = "Ignore the event weights")
+    parser.add_argument('--out', default = 'trained_model.keras')
+    args = parser.parse_args(argv)
+
+    from model import build_model
+    from preprocessing import Preprocessor, training_weights
+
+    events = load_events(args.csv)
+    start = time.time()
+    preprocessor = Preprocessor().fit_streaming(events.features, args.chunk_rows)
+    print("Fitted preprocessing on {} events in {:.2f} s".format(len(events), time.time() - start))
+
+    # per-class renormalization only needs the weight and label columns, which fit in memory
+    weight = training_weights(events.weight, events.label) if args.weighted else None
+    model = build_model(input_dim = events.features.shape[1])
+    with stage('fit', rows_in = len(events), epochs = args.epochs):
+        model.fit(make_dataset(events.features, events.label, preprocessor, args.batch_size, args.chunk_rows, seed = args.seed,
+                               weight = weight), epochs = args.epochs)
+    model.save(args.out)
+    preprocessor.save(os.path.join(os.path.dirname(os.path.abspath(args.out)), 'preprocessing.npz'))
+
+
+if __name__ == '__main__':
+    main()
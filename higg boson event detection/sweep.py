@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Parallel hyperparameter and architecture sweep of the dense classifier.
+#
+#   python sweep.py training.csv --hidden 12,8 32,16 64,32,16 --optimizers adam rmsprop --batch-sizes 32 256 --threads 1
+#
+# The events are split and preprocessed once; the float32 train/holdout matrices are written as .npy files
+# in the sweep directory and memory-mapped by every worker process, so the pool shares one copy through the
+# page cache. Workers never copy the training matrix: Keras is fed batch by batch through
+# train.make_training_dataset, which gathers each batch's rows from the memory map, and the holdout is
+# scored in blocks with the NumPy engine. Each worker trains one configuration at a time with a fixed
+# number of threads. Finished configurations are appended to results.csv, keyed by a hash of the
+# configuration, and are skipped when the sweep is started again, so an interrupted sweep resumes where
+# it stopped. Training uses the event
+# weights (renormalized per class) unless the configuration sets weights = 'none'; the AMS is reported at
+# the 0.5 threshold and at the best threshold of the holdout scan.
+#
+#   python sweep.py --check-memory        # a worker's private memory must not grow with the training matrix
+
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from ingest import load_events
+from instrument import stage
+from metrics import ams_score, best_threshold, holdout_weights, precision
+from split import strata, stratified_split
+
+ARRAYS = ['X_train', 'y_train', 'w_train', 'X_test', 'y_test', 'w_test']
+WEIGHTS = ['balanced', 'none']
+
+_data = {}
+
+
+# Stable identifier of a configuration (sorted-key JSON hash)
+def config_id(config):
+    return hashlib.sha1(json.dumps(config, sort_keys = True).encode()).hexdigest()[:12]
+
+
+# Cartesian product of the grid values, one dict per configuration
+def config_grid(hidden, optimizers, epochs, batch_sizes, weights = ('balanced',), seed = 20):
+    return [{'hidden': list(h), 'optimizer': opt, 'epochs': ep, 'batch_size': bs, 'weights': wt, 'seed': seed}
+            for h, opt, ep, bs, wt in itertools.product(hidden, optimizers, epochs, batch_sizes, weights)]
+
+
+# Split, fit the preprocessing on the training rows and write the preprocessed matrices to `out`.
+# Skipped when `out` already holds them for the same source file and split.
+def prepare(csv_path, out, test_size = 0.35, random_state = 20):
+    from preprocessing import Preprocessor, training_weights
+
+    events = load_events(csv_path)
+    stat = os.stat(csv_path)
+    meta = {'source': os.path.abspath(csv_path), 'size': stat.st_size, 'mtime': stat.st_mtime,
+            'test_size': test_size, 'random_state': random_state, 'split': 'stratified', 'arrays': ARRAYS}
+    meta_path = os.path.join(out, 'data.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) == meta:
+                return
+    os.makedirs(out, exist_ok = True)
+    # results of an earlier sweep were measured on other data
+    if os.path.exists(os.path.join(out, 'results.csv')):
+        os.remove(os.path.join(out, 'results.csv'))
+
+    train, test = stratified_split(strata(events.label, events.jet_num), test_size, random_state)
+    x_train = np.asarray(events.features[train])
+    preprocessor = Preprocessor().fit(x_train)
+    keep = preprocessor.inlier_mask(x_train)
+    arrays = {'X_train': preprocessor.transform(x_train[keep]),
+              'y_train': events.label[train][keep].astype(np.float32),
+              'w_train': training_weights(events.weight[train][keep], events.label[train][keep]),
+              'X_test': preprocessor.transform(events.features[test]),
+              'y_test': events.label[test].astype(np.float32),
+              'w_test': holdout_weights(events.weight[test], events.label[test], events.weight, events.label).astype(np.float32)}
+    for name, array in arrays.items():
+        np.save(os.path.join(out, name + '.npy'), array)
+    preprocessor.save(os.path.join(out, 'preprocessing.npz'))
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+
+
+# Pool initializer: pin the thread counts before TensorFlow starts, then memory-map the shared matrices
+def init_worker(data_dir, threads):
+    for var in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']:
+        os.environ[var] = str(threads)
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+    from score import set_threads
+    set_threads(threads)
+    for name in ARRAYS:
+        _data[name] = np.load(os.path.join(data_dir, name + '.npy'), mmap_mode = 'r')
+
+
+# Train and evaluate one configuration in a worker; returns one row of the results table
+def run_config(config):
+    import keras
+    from model import build_model
+    from numpy_model import NumpyModel
+    from score import score_events
+    from train import make_training_dataset
+
+    start = time.time()
+    keras.utils.set_random_seed(config['seed'])
+    x = _data['X_train']
+    model = build_model(input_dim = x.shape[1], hidden = tuple(config['hidden']), optimizer = config['optimizer'])
+    sample_weight = _data['w_train'] if config['weights'] == 'balanced' else None
+    # cache_bytes = 0: batches are gathered from the memory map, never a tensor copy of the whole matrix
+    batches = make_training_dataset(x, _data['y_train'], sample_weight, config['batch_size'], seed = config['seed'],
+                                    cache_bytes = 0, epochs = config['epochs'])
+    with stage('fit', rows_in = len(x), config = config_id(config)):
+        model.fit(batches, epochs = config['epochs'], steps_per_epoch = -(-len(x) // config['batch_size']), shuffle = False,
+                  verbose = 0)
+    trained = time.time()
+    probs = score_events(_data['X_test'], NumpyModel.from_keras(model).predict, None)
+    y = _data['y_test'] == 1
+    best = best_threshold(y, probs, _data['w_test'])
+    return {'id': config_id(config), 'hidden': ','.join(map(str, config['hidden'])), 'optimizer': config['optimizer'],
+            'epochs': config['epochs'], 'batch_size': config['batch_size'], 'weights': config['weights'], 'seed': config['seed'],
+            'precision': precision(y, probs >= 0.5), 'ams': ams_score(y, probs, _data['w_test']),
+            'best_threshold': best['threshold'], 'best_ams': best['ams'], 'best_precision': best['precision'],
+            'train_time': trained - start, 'wall_time': time.time() - start, 'pid': os.getpid()}
+
+
+# Private (anonymous) resident memory of this process in bytes; the pages of the memory maps are file
+# backed and shared through the page cache, so they are left out
+def private_memory():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('RssAnon:'):
+                return int(line.split()[1]) * 1024
+    raise OSError("RssAnon is not reported on this platform")
+
+
+# Worker task of --check-memory: peak growth of private memory while run_config trains on this worker's matrix
+def measure_config(config):
+    import threading
+
+    import keras  # noqa: F401 (loaded before the baseline)
+
+    peak, done = [private_memory()], threading.Event()
+    base = peak[0]
+
+    def sample():
+        while not done.wait(0.005):
+            peak[0] = max(peak[0], private_memory())
+    sampler = threading.Thread(target = sample, daemon = True)
+    sampler.start()
+    try:
+        run_config(config)
+    finally:
+        done.set()
+        sampler.join()
+    return {'rows': len(_data['X_train']), 'matrix_mb': _data['X_train'].nbytes / 2**20,
+            'private_growth_mb': (max(peak[0], private_memory()) - base) / 2**20}
+
+
+# Train one configuration in a fresh worker on synthetic matrices of each row count and compare the growth
+# of the worker's private memory; it must not follow the size of the training matrix
+def check_memory(sizes, out, batch_size = 1024, threads = 1, tolerance = 0.25):
+    import tempfile
+
+    rng = np.random.default_rng(0)
+    rows = []
+    with tempfile.TemporaryDirectory(dir = out) as tmp:
+        for n in sizes:
+            data_dir = os.path.join(tmp, str(n))
+            os.makedirs(data_dir)
+            y = (rng.random(n) < 0.35).astype(np.float32)
+            arrays = {'X_train': rng.normal(size = (n, 30)).astype(np.float32), 'y_train': y,
+                      'w_train': np.ones(n, dtype = np.float32), 'X_test': rng.normal(size = (10_000, 30)).astype(np.float32),
+                      'y_test': (rng.random(10_000) < 0.35).astype(np.float32), 'w_test': np.ones(10_000, dtype = np.float32)}
+            for name, array in arrays.items():
+                np.save(os.path.join(data_dir, name + '.npy'), array)
+            del arrays
+            config = config_grid([(12, 8)], ['adam'], [1], [batch_size])[0]
+            context = multiprocessing.get_context('spawn')
+            with context.Pool(1, initializer = init_worker, initargs = (data_dir, threads)) as pool:
+                rows.append(pool.apply(measure_config, (config,)))
+    report = pd.DataFrame(rows)
+    # the growth may differ by a fraction of the matrix size (allocator noise), not by a copy of it
+    extra = report['private_growth_mb'].iloc[-1] - report['private_growth_mb'].iloc[0]
+    allowed = tolerance * (report['matrix_mb'].iloc[-1] - report['matrix_mb'].iloc[0])
+    return report, extra <= allowed
+
+
+def load_results(path):
+    return pd.read_csv(path) if os.path.exists(path) else pd.DataFrame(columns = ['id'])
+
+
+# Run the configurations not yet in results.csv on `workers` processes of `threads` threads each
+def run_sweep(configs, out, workers = 0, threads = 1):
+    results_path = os.path.join(out, 'results.csv')
+    done = set(load_results(results_path)['id'].astype(str))
+    todo = [c for c in configs if config_id(c) not in done]
+    print("{} configurations, {} already done, {} to run".format(len(configs), len(configs) - len(todo), len(todo)))
+    if todo:
+        workers = workers or max(1, (os.cpu_count() or 1) // threads)
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(min(workers, len(todo)), initializer = init_worker, initargs = (out, threads), maxtasksperchild = 1) as pool:
+            for row in pool.imap_unordered(run_config, todo):
+                pd.DataFrame([row]).to_csv(results_path, mode = 'a', header = not os.path.exists(results_path), index = False)
+                print("{id} hidden={hidden} {optimizer} epochs={epochs} batch={batch_size} weights={weights}: "
+                      "precision {precision:.4f}, AMS {ams:.3f} (best {best_ams:.3f} at {best_threshold:.3f}), "
+                      "{wall_time:.1f} s".format(**row))
+    return load_results(results_path)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Parallel hyperparameter sweep of the dense classifier")
+    parser.add_argument('csv', nargs = '?', help = "Training events (Kaggle training.csv layout)")
+    parser.add_argument('--out', default = 'sweep')
+    parser.add_argument('--hidden', nargs = '+', default = ['12,8'], help = "Hidden layer sizes, e.g. 12,8 32,16")
+    parser.add_argument('--optimizers', nargs = '+', default = ['adam'])
+    parser.add_argument('--epochs', type = int, nargs = '+', default = [20])
+    parser.add_argument('--batch-sizes', type = int, nargs = '+', default = [32])
+    parser.add_argument('--weights', nargs = '+', default = ['balanced'], choices = WEIGHTS, help = "Sample weighting")
+    parser.add_argument('--seed', type = int, default = 20)
+    parser.add_argument('--workers', type = int, default = 0, help = "Worker processes (0 = cores / threads)")
+    parser.add_argument('--threads', type = int, default = 1, help = "Threads per worker")
+    parser.add_argument('--test-size', type = float, default = 0.35)
+    parser.add_argument('--random-state', type = int, default = 20)
+    parser.add_argument('--check-memory', action = 'store_true',
+                        help = "Check that a worker's private memory stays flat as the training matrix grows, and exit")
+    parser.add_argument('--check-rows', type = int, nargs = '+', default = [100_000, 800_000],
+                        help = "Training rows of the --check-memory matrices")
+    args = parser.parse_args(argv)
+
+    if args.check_memory:
+        os.makedirs(args.out, exist_ok = True)
+        report, flat = check_memory(args.check_rows, args.out, args.batch_sizes[0], args.threads)
+        print(report.to_string(index = False))
+        if not flat:
+            parser.exit(1, "worker memory grows with the training matrix\n")
+        print("worker memory is flat in the size of the training matrix")
+        return
+    if args.csv is None:
+        parser.error("the training csv is required")
+    start = time.time()
+    prepare(args.csv, args.out, args.test_size, args.random_state)
+    print("Prepared data in {:.2f} s".format(time.time() - start))
+    hidden = [tuple(int(u) for u in h.split(',')) for h in args.hidden]
+    configs = config_grid(hidden, args.optimizers, args.epochs, args.batch_sizes, args.weights, args.seed)
+    results = run_sweep(configs, args.out, args.workers, args.threads)
+    print(results.sort_values('best_ams', ascending = False).to_string(index = False))
+
+
+if __name__ == '__main__':
+    main()
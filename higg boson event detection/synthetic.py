@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Synthetic events with the schema of the Kaggle files, for benchmarks on any number of rows.
+#
+# The 30 features follow rough shapes of the real ones (masses and momenta positive and skewed, angles
+# uniform, pseudorapidities within the detector), shifted for signal events. Missing values (-999) follow
+# the real patterns: the jet columns are undefined for PRI_jet_num = 0 (and the subleading jet for
+# PRI_jet_num = 1), PRI_jet_all_pt is 0 without jets, and DER_mass_MMC is missing for ~15% of events.
+# Weights imitate the real ones (signal ~0.002, background ~0.02 to 5).
+#
+#   python synthetic.py 2500000 --csv synthetic.csv           # a CSV in the training.csv layout
+#   python synthetic.py 25000000 --cache synthetic.cache      # straight into the column cache (ingest.py)
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from ingest import CACHE_VERSION, CHUNK_ROWS, FEATURES, JET_NUM, MISSING, Events, decode_sentinel
+
+SIGNAL_FRACTION = 0.343
+JET_PROBS = [[0.42, 0.31, 0.19, 0.08], [0.26, 0.31, 0.29, 0.14]]  # background, signal
+
+# Columns undefined without a (second) jet
+NO_JET = ['DER_deltaeta_jet_jet', 'DER_mass_jet_jet', 'DER_prodeta_jet_jet', 'DER_lep_eta_centrality',
+          'PRI_jet_leading_pt', 'PRI_jet_leading_eta', 'PRI_jet_leading_phi',
+          'PRI_jet_subleading_pt', 'PRI_jet_subleading_eta', 'PRI_jet_subleading_phi']
+ONE_JET = [col for col in NO_JET if not col.startswith('PRI_jet_leading')]
+
+
+def _column(col, n, signal, rng):
+    boost = np.where(signal, 1.15, 1.0)
+    if col.endswith('_phi'):
+        return rng.uniform(-np.pi, np.pi, n)
+    if col.endswith('_eta'):
+        return np.clip(rng.normal(0, 1.2, n), -2.5, 2.5)
+    if col == 'DER_deltaeta_jet_jet':
+        return rng.gamma(2.0, 1.2, n) * boost
+    if col == 'DER_prodeta_jet_jet':
+        return np.clip(rng.normal(-0.5, 3.5, n), -18, 17)
+    if col == 'DER_met_phi_centrality':
+        return np.clip(rng.normal(0.4 * signal, 1.0, n), -1.414, 1.414)
+    if col == 'DER_lep_eta_centrality':
+        return rng.beta(np.where(signal, 1.2, 0.6), 1.0)
+    if col == 'DER_deltar_tau_lep':
+        return 0.2 + rng.gamma(4.0, 0.6, n)
+    if col == 'DER_pt_ratio_lep_tau':
+        return rng.gamma(3.0, 0.5, n)
+    if col.startswith('DER_mass') or col.startswith('DER_sum') or col == 'PRI_met_sumet':
+        return rng.gamma(6.0, 20.0, n) * boost
+    # transverse momenta and missing energy
+    return 20 + rng.gamma(1.5, 25.0, n) * boost
+
+
+# One chunk of events: features (float32, -999 for missing), jet_num, event_id, weight, label
+def synthetic_chunk(n, rng, start_id = 100000, labelled = True):
+    signal = rng.random(n) < SIGNAL_FRACTION
+    jet_num = np.where(signal, rng.choice(4, n, p = JET_PROBS[1]), rng.choice(4, n, p = JET_PROBS[0])).astype(np.int8)
+    x = np.empty((n, len(FEATURES)), dtype = np.float32)
+    for j, col in enumerate(FEATURES):
+        x[:, j] = jet_num if col == JET_NUM else np.round(_column(col, n, signal, rng), 3)
+    x[:, FEATURES.index('PRI_jet_all_pt')] *= jet_num > 0
+    x[np.ix_(jet_num == 0, [FEATURES.index(c) for c in NO_JET])] = MISSING
+    x[np.ix_(jet_num == 1, [FEATURES.index(c) for c in ONE_JET])] = MISSING
+    x[rng.random(n) < 0.15, FEATURES.index('DER_mass_MMC')] = MISSING
+    event_id = np.arange(start_id, start_id + n, dtype = np.int32)
+    if not labelled:
+        return Events(x, jet_num, event_id)
+    weight = np.where(signal, rng.uniform(0.0015, 0.0027, n), np.clip(rng.lognormal(0.0, 1.0, n), 0.02, 5.7))
+    return Events(x, jet_num, event_id, np.round(weight, 5).astype(np.float32), signal.astype(np.uint8))
+
+
+def iter_synthetic(n, seed = 0, labelled = True, chunk_rows = CHUNK_ROWS):
+    rng = np.random.default_rng(seed)
+    for start in range(0, n, chunk_rows):
+        yield start, synthetic_chunk(min(chunk_rows, n - start), rng, 100000 + start, labelled)
+
+
+# CSV in the training.csv (labelled) or test.csv layout
+def write_synthetic_csv(path, n, seed = 0, labelled = True, chunk_rows = CHUNK_ROWS):
+    for start, chunk in iter_synthetic(n, seed, labelled, chunk_rows):
+        df = chunk.to_frame()
+        if labelled:
+            df['Label'] = df['Label'].astype(str)
+        df.to_csv(path, mode = 'w' if start == 0 else 'a', header = start == 0, index = False)
+    return path
+
+
+# Column cache in the layout of ingest.build_cache (-999 decoded to NaN, missingness bitmask), readable with
+# ingest.open_cache; kept when it already holds the same rows and seed
+def write_synthetic_cache(cache_dir, n, seed = 0, labelled = True, chunk_rows = CHUNK_ROWS):
+    stamp = {'source': 'synthetic', 'seed': seed, 'rows': n, 'version': CACHE_VERSION, 'has_label': labelled}
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if all(meta.get(k) == v for k, v in stamp.items()):
+            return cache_dir
+    os.makedirs(cache_dir, exist_ok = True)
+
+    def open_npy(name, dtype, shape):
+        return np.lib.format.open_memmap(os.path.join(cache_dir, name + '.npy'), mode = 'w+', dtype = dtype, shape = shape)
+
+    names = ['features', 'jet_num', 'event_id'] + (['weight', 'label'] if labelled else [])
+    out = {'features': open_npy('features', np.float32, (n, len(FEATURES))), 'missing': open_npy('missing', np.uint32, (n,)),
+           'jet_num': open_npy('jet_num', np.int8, (n,)), 'event_id': open_npy('event_id', np.int32, (n,))}
+    if labelled:
+        out['weight'], out['label'] = open_npy('weight', np.float32, (n,)), open_npy('label', np.uint8, (n,))
+    for start, chunk in iter_synthetic(n, seed, labelled, chunk_rows):
+        out['missing'][start:start + len(chunk)] = decode_sentinel(chunk.features)
+        for name in names:
+            out[name][start:start + len(chunk)] = getattr(chunk, name)
+    for arr in out.values():
+        arr.flush()
+    stamp['columns'] = FEATURES
+    with open(meta_path, 'w') as f:
+        json.dump(stamp, f, indent = 2)
+    return cache_dir
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Generate synthetic events with the Kaggle schema")
+    parser.add_argument('rows', type = int)
+    parser.add_argument('--csv', default = None, help = "Write a CSV file")
+    parser.add_argument('--cache', default = None, help = "Write a column cache directory")
+    parser.add_argument('--unlabelled', dest = 'labelled', action = 'store_false', help = "test.csv layout (no Weight/Label)")
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args(argv)
+    if not args.csv and not args.cache:
+        parser.error("give --csv and/or --cache")
+
+    if args.csv:
+        write_synthetic_csv(args.csv, args.rows, args.seed, args.labelled)
+    if args.cache:
+        write_synthetic_cache(args.cache, args.rows, args.seed, args.labelled)
+    print(pd.Series({"Events": args.rows, "CSV": args.csv, "Cache": args.cache}).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Large-batch training of the dense classifier from a float32 tf.data pipeline.
+#
+#   python train.py training.csv --batch-size 4096 --epochs 100 --patience 5 --threads 8 --out trained_model.keras
+#   python train.py training.csv --checkpoint-dir checkpoints --checkpoint-steps 500       # resumes when re-run
+#
+# The training rows are split (stratified, see split.py) into fit and validation rows. The preprocessing is
+# fitted on the fit rows, and the preprocessed float32 matrices are kept in the stage cache (see
+# stage_cache.py), so a re-run memory-maps them instead of preprocessing again.
+#
+# The pipeline shuffles row positions, not rows: every epoch takes a fresh permutation of the positions
+# (or a tf.data shuffle through a --shuffle-buffer of that many), batches them, and gathers each batch of
+# rows on parallel calls, with prefetching.
+# A matrix that fits within --cache-bytes is read once into tensors and gathered in the graph, without
+# the GIL. A larger one is gathered batch by batch from the memory map. The validation batches are cached
+# after the first epoch.
+#
+# Large batches take far fewer steps per epoch than the default 32. The Adam learning rate is scaled from
+# its batch-32 value (square root of the batch ratio by default, or linear). Training stops early when the
+# validation loss has not improved for --patience epochs, and the best weights are restored. Every epoch
+# logs its time and events/s (also in history.history as epoch_time and events_per_s).
+#
+# With --checkpoint-dir, weights, optimizer state and preprocessing are snapshotted every --checkpoint-steps
+# batches or --checkpoint-minutes and at every epoch end, and a re-run resumes from the latest snapshot at
+# the batch it reached (see checkpoint.py). --restart discards the snapshots and trains from scratch.
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from checkpoint import KEEP, Checkpoints, checkpoint_callback, data_digest
+from instrument import stage
+
+BATCH_SIZE = 4096
+BASE_BATCH_SIZE = 32
+BASE_LEARNING_RATE = 1e-3
+CACHE_BYTES = 2 << 30
+LR_SCALING = ['sqrt', 'linear', 'none']
+EPOCH_SEED_STRIDE = 1000003
+
+
+# Adam learning rate for `batch_size`, scaled from base_lr at base_batch_size
+def scaled_learning_rate(batch_size, base_lr = BASE_LEARNING_RATE, base_batch_size = BASE_BATCH_SIZE, rule = 'sqrt'):
+    ratio = batch_size / base_batch_size
+    return base_lr * {'sqrt': np.sqrt(ratio), 'linear': ratio, 'none': 1.0}[rule]
+
+
+# Batches (x, y) or (x, y, weight) of float32 rows of x (an array or a memory map). When shuffled, the batches
+# of epochs first_epoch .. epochs-1 follow each other (iterate with steps_per_epoch), each epoch in its own
+# order (buffer: all rows unless shuffle_buffer) derived from seed and epoch, less the first skip_batches.
+# Cached when not shuffled. `rows` restricts the batches to these positions of x, y and weight, and
+# `transform` is applied to every gathered batch of x; either one gathers from x batch by batch.
+def make_training_dataset(x, y, weight = None, batch_size = BATCH_SIZE, shuffle = True, seed = None, shuffle_buffer = None,
+                          cache_bytes = CACHE_BYTES, epochs = 1, first_epoch = 0, skip_batches = 0, rows = None,
+                          transform = None):
+    import tensorflow as tf
+
+    arrays = [x, np.asarray(y, dtype = np.float32)] + ([] if weight is None else [np.asarray(weight, dtype = np.float32)])
+    n = len(x) if rows is None else len(rows)
+    if shuffle:
+        buffer = min(shuffle_buffer or n, n)
+
+        def epoch_seed(epoch):
+            return None if seed is None else seed * EPOCH_SEED_STRIDE + epoch
+
+        # a full reshuffle is a NumPy permutation of the positions (8 bytes a row); tf.data's shuffle buffer
+        # holds every position as a separate element, about 150 bytes a row
+        def permutation(epoch):
+            return np.random.default_rng(epoch_seed(int(epoch))).permutation(n)
+
+        def epoch_batches(epoch):
+            if buffer < n:
+                return tf.data.Dataset.range(n).shuffle(buffer, seed = epoch_seed(epoch)).batch(batch_size)
+            positions = tf.numpy_function(permutation, [epoch], tf.int64)
+            positions.set_shape((n,))
+            return tf.data.Dataset.from_tensor_slices(positions).batch(batch_size)
+        batches = tf.data.Dataset.range(first_epoch, epochs).flat_map(epoch_batches).skip(skip_batches)
+    else:
+        batches = tf.data.Dataset.range(n).batch(batch_size)
+
+    if rows is None and transform is None and x.nbytes <= cache_bytes:
+        tensors = [tf.constant(np.asarray(a, dtype = np.float32)) for a in arrays]
+
+        def gather(rows):
+            return tuple(tf.gather(t, rows) for t in tensors)
+    else:
+        # rows in file order within a batch, for locality; the order inside a batch does not matter
+        def gather_rows(positions):
+            positions = np.sort(positions if rows is None else rows[positions])
+            out = [np.asarray(a[positions], dtype = np.float32) for a in arrays]
+            if transform is not None:
+                out[0] = transform(out[0])
+            return tuple(out)
+
+        def gather(rows):
+            out = tf.numpy_function(gather_rows, [rows], [tf.float32] * len(arrays))
+            out[0].set_shape((None, x.shape[1]))
+            for o in out[1:]:
+                o.set_shape((None,))
+            return tuple(out)
+
+    dataset = batches.map(gather, num_parallel_calls = tf.data.AUTOTUNE, deterministic = not shuffle)
+    if not shuffle:
+        dataset = dataset.cache()
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+# Keras callback logging the time and events/s of every epoch
+def epoch_timer(n_events, verbose = True):
+    import keras
+
+    class EpochTimer(keras.callbacks.Callback):
+        def on_epoch_begin(self, epoch, logs = None):
+            self.start = time.perf_counter()
+
+        def on_epoch_end(self, epoch, logs = None):
+            seconds = time.perf_counter() - self.start
+            if logs is not None:
+                logs['epoch_time'] = seconds
+                logs['events_per_s'] = n_events / seconds
+            if verbose:
+                metrics = ', '.join('{} {:.4f}'.format(k, v) for k, v in (logs or {}).items() if 'loss' in k or 'accuracy' in k)
+                print("epoch {}: {:.2f} s, {:,.0f} events/s, {}".format(epoch + 1, seconds, n_events / seconds, metrics), flush = True)
+    return EpochTimer()
+
+
+# EarlyStopping on val_loss whose counters and best weights carry over between model.fit calls and from a
+# checkpoint; the best weights are restored by fit once training is over
+def early_stopping(patience, resume = None, best_weights = None):
+    import keras
+
+    class EarlyStopping(keras.callbacks.EarlyStopping):
+        started = False
+
+        def on_train_begin(self, logs = None):
+            if not self.started:
+                super().on_train_begin(logs)
+                for k, v in (resume or {}).items():
+                    setattr(self, k, v)
+                self.best_weights = best_weights
+                self.started = True
+
+        def on_train_end(self, logs = None):
+            pass
+
+    return EarlyStopping(monitor = 'val_loss', patience = patience, restore_best_weights = True)
+
+
+# Train `model` on (x, y, weight) in batches of batch_size; with validation = (x, y[, weight]), stop when the
+# validation loss has not improved for `patience` epochs and keep the best weights. With checkpoint_dir,
+# snapshot the run every checkpoint_steps batches or checkpoint_minutes and at every epoch end, and resume
+# from the latest snapshot there (see checkpoint.py). Returns the History of all epochs.
+def fit(model, x, y, weight = None, validation = None, batch_size = BATCH_SIZE, epochs = 100, patience = 5, seed = None,
+        shuffle_buffer = None, cache_bytes = CACHE_BYTES, verbose = True, checkpoint_dir = None, checkpoint_steps = None,
+        checkpoint_minutes = None, keep_checkpoints = KEEP, preprocessor = None):
+    import keras
+
+    batches = -(-len(x) // batch_size)
+    config = {'rows': len(x), 'inputs': x.shape[1], 'batch_size': batch_size, 'shuffle_buffer': shuffle_buffer,
+              'weighted': weight is not None, 'learning_rate': float(model.optimizer.learning_rate)}
+    state, best_weights, checkpoints = None, None, None
+    if checkpoint_dir:
+        config['data'] = data_digest(*[a for a in [x, y, weight] + list(validation or []) if a is not None])
+        checkpoints = Checkpoints(checkpoint_dir, keep_checkpoints)
+        state, best_weights = checkpoints.restore(model, config)
+        if state is not None and verbose:
+            print("Resumed from {} at epoch {}, batch {}".format(checkpoints.latest(), state['epoch'] + 1, state['batch']), flush = True)
+    if state is None:
+        seed = int(np.random.SeedSequence().entropy % (1 << 31)) if seed is None else seed
+        state = {'step': 0, 'epoch': 0, 'batch': 0, 'seed': seed, 'config': config, 'history': {}, 'done': False}
+    history = {k: list(v) for k, v in state['history'].items()}
+
+    val, early = None, None
+    if validation is not None:
+        val = make_training_dataset(*validation, batch_size = batch_size, shuffle = False, cache_bytes = cache_bytes)
+        if patience:
+            early = early_stopping(patience, state.get('early_stopping'), best_weights)
+    checkpoint = None
+    if checkpoints is not None:
+        checkpoint = checkpoint_callback(checkpoints, state, checkpoint_steps, checkpoint_minutes, early, preprocessor)
+        checkpoint.set_model(model)
+
+    # an interrupted epoch is finished on its own, from the batch the snapshot reached
+    start, skip = state['epoch'], state['batch']
+    runs = ([(start, start + 1, skip)] if skip else []) + [(start + 1 if skip else start, epochs, 0)]
+    stopped = bool(state.get('early_stopping', {}).get('stopped_epoch'))
+    # a finished run is trained further only when given more epochs
+    state['done'] = state['done'] and (stopped or start >= epochs)
+    with stage('fit', rows_in = len(x), epochs = epochs, batch_size = batch_size) as s:
+        for first, last, skip in runs:
+            if stopped or first >= last:
+                continue
+            train = make_training_dataset(x, y, weight, batch_size, seed = state['seed'], shuffle_buffer = shuffle_buffer,
+                                          cache_bytes = cache_bytes, epochs = last, first_epoch = first, skip_batches = skip)
+            callbacks = [epoch_timer(len(x) - skip * batch_size, verbose)] + [c for c in [early, checkpoint] if c is not None]
+            run = model.fit(train, validation_data = val, initial_epoch = first, epochs = last, steps_per_epoch = batches - skip,
+                            callbacks = callbacks, shuffle = False, verbose = 0)
+            for k, v in run.history.items():
+                history.setdefault(k, []).extend(v)
+            stopped = model.stop_training
+        if early is not None and early.best_weights is not None:
+            model.set_weights(early.best_weights)
+        if checkpoint is not None and not state['done']:
+            state['done'] = True
+            checkpoint.snapshot()
+        s.rows_out = len(next(iter(history.values()), []))
+
+    result = keras.callbacks.History()
+    result.history = history
+    result.epoch = list(range(len(next(iter(history.values()), []))))
+    return result
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Train the event classifier from a large-batch tf.data pipeline")
+    parser.add_argument('csv', help = "Training events (Kaggle training.csv layout)")
+    parser.add_argument('--out', default = 'trained_model.keras')
+    parser.add_argument('--batch-size', type = int, default = BATCH_SIZE)
+    parser.add_argument('--epochs', type = int, default = 100, help = "Upper bound; early stopping usually ends sooner")
+    parser.add_argument('--patience', type = int, default = 5, help = "Epochs without validation improvement (0 = no early stopping)")
+    parser.add_argument('--learning-rate', type = float, default = BASE_LEARNING_RATE, help = "Adam learning rate at batch size 32")
+    parser.add_argument('--lr-scaling', default = 'sqrt', choices = LR_SCALING)
+    parser.add_argument('--hidden', type = int, nargs = '+', default = [12, 8])
+    parser.add_argument('--validation-size', type = float, default = 0.1, help = "Fraction of the training rows used for validation")
+    parser.add_argument('--shuffle-buffer', type = int, default = 0, help = "Shuffle buffer in rows (0 = all rows)")
+    parser.add_argument('--cache-bytes', type = float, default = CACHE_BYTES, help = "Largest matrix read into memory as tensors")
+    parser.add_argument('--checkpoint-dir', default = None, help = "Snapshot the run here and resume from the latest snapshot")
+    parser.add_argument('--checkpoint-steps', type = int, default = None, help = "Snapshot every this many batches")
+    parser.add_argument('--checkpoint-minutes', type = float, default = 10, help = "Snapshot at least this often (0 = epoch ends only)")
+    parser.add_argument('--keep-checkpoints', type = int, default = KEEP, help = "Snapshots kept (latest ones)")
+    parser.add_argument('--restart', action = 'store_true', help = "Discard the snapshots in --checkpoint-dir and train from scratch")
+    parser.add_argument('--threads', type = int, default = 0, help = "CPU threads for TensorFlow (0 = library default)")
+    parser.add_argument('--no-weights', dest = 'weighted', action = 'store_false', help = "Ignore the event weights")
+    parser.add_argument('--test-size', type = float, default = 0.35)
+    parser.add_argument('--random-state', type = int, default = 20)
+    parser.add_argument('--stage-cache', default = 'stages.cache')
+    args = parser.parse_args(argv)
+
+    import keras
+    import pandas as pd
+
+    from ingest import load_events
+    from metrics import best_threshold, holdout_weights, precision
+    from model import build_model
+    from preprocessing import Preprocessor, training_weights
+    from score import set_threads
+    from split import strata, stratified_split
+    from stage_cache import StageCache
+
+    set_threads(args.threads)
+    keras.utils.set_random_seed(args.random_state)
+    events = load_events(args.csv)
+    codes = strata(events.label, events.jet_num)
+    train, test = stratified_split(codes, args.test_size, args.random_state)
+    fit_pos, val_pos = stratified_split(codes[train], args.validation_size, args.random_state)
+    fit_rows, val_rows = train[fit_pos], train[val_pos]
+
+    # preprocessed matrices in the stage cache, memory-mapped on re-runs
+    cache = StageCache(args.stage_cache)
+    prep_key = cache.key('train_preprocess', source = cache.file_digest(args.csv), test_size = args.test_size,
+                         validation_size = args.validation_size, random_state = args.random_state)
+    preprocessor = Preprocessor.from_arrays(cache.cached(prep_key, lambda: Preprocessor().fit(events.features[fit_rows]).to_arrays()))
+
+    # validation rows are filtered like the fit rows, so early stopping watches the loss being minimized
+    def prepare(rows):
+        x = np.asarray(events.features[rows])
+        keep = preprocessor.inlier_mask(x)
+        y = events.label[rows][keep]
+        w = training_weights(events.weight[rows][keep], y) if args.weighted else np.ones(len(y), dtype = np.float32)
+        return {'x': preprocessor.transform(x[keep]), 'y': y.astype(np.float32), 'w': w}
+    data = cache.cached(cache.key('train_matrix', preprocess = prep_key, rows = 'fit', weighted = args.weighted), lambda: prepare(fit_rows))
+    val = cache.cached(cache.key('train_matrix', preprocess = prep_key, rows = 'validation', weighted = args.weighted),
+                       lambda: prepare(val_rows))
+
+    lr = scaled_learning_rate(args.batch_size, args.learning_rate, rule = args.lr_scaling)
+    model = build_model(input_dim = data['x'].shape[1], hidden = tuple(args.hidden), optimizer = keras.optimizers.Adam(lr))
+    print("{} fit events, {} validation events, batch size {}, learning rate {:.4g}".format(
+        len(data['x']), len(val['x']), args.batch_size, lr), flush = True)
+    if args.restart and args.checkpoint_dir:
+        Checkpoints(args.checkpoint_dir).clear()
+    start = time.time()
+    history = fit(model, data['x'], data['y'], data['w'], (val['x'], val['y'], val['w']), args.batch_size, args.epochs,
+                  args.patience, args.random_state, args.shuffle_buffer or None, int(args.cache_bytes),
+                  checkpoint_dir = args.checkpoint_dir, checkpoint_steps = args.checkpoint_steps,
+                  checkpoint_minutes = args.checkpoint_minutes or None, keep_checkpoints = args.keep_checkpoints,
+                  preprocessor = preprocessor)
+    trained = time.time() - start
+    model.save(args.out)
+    preprocessor.save(os.path.join(os.path.dirname(os.path.abspath(args.out)), 'preprocessing.npz'))
+
+    probs = model.predict(preprocessor.transform(events.features[test]), batch_size = 65536, verbose = 0).reshape(-1)
+    y = events.label[test] == 1
+    best = best_threshold(y, probs, holdout_weights(events.weight[test], y, events.weight, events.label))
+    epochs = pd.DataFrame(history.history)
+    print(pd.Series({"Epochs": "{} (best {})".format(len(epochs), int(epochs['val_loss'].idxmin()) + 1),
+                     "Training time": "{:.2f} s".format(trained),
+                     "Median epoch time": "{:.2f} s".format(epochs['epoch_time'].median()),
+                     "Median throughput": "{:,.0f} events/s".format(epochs['events_per_s'].median()),
+                     "Held-out precision": "{:.4f}".format(precision(y, probs >= 0.5)),
+                     "Best AMS": "{:.3f} at threshold {:.3f}".format(best['ams'], best['threshold']),
+                     "Output": args.out}).to_string())
+
+
+if __name__ == '__main__':
+    main()